@@ -1,18 +1,34 @@
-from typing import List, Optional
+import asyncio
+import time
+from typing import List, Optional, Set
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from mongoengine import NotUniqueError, Q
 
+from db.document_cache import action_cache, smart_controller_cache
 from db.models import Action, SmartController
 from db.scheduled_task import ScheduledTask
-from models.action import ActionRequest, ActionResponse, ActionUpdateRequest
+from api.v1.pagination import Page
+from config.settings import settings
+from models.action import ActionRequest, ActionResponse, ActionUpdateRequest, ActionBatchRunRequest, \
+    ActionBatchRunResponse, ActionRunItem, ActionRunResult
+from tools.action_executor import executor
 from tools.action_runner import run
-from tools.action_runner.action_runner import read_sensor
+from tools.action_runner.action_runner import read_sensor, run_async, read_sensor_async
+from tools.automation_runner.compiled_graph import graph_cache
+from tools.resilience import ControllerUnavailableError
 from tools.scheduler import scheduler
 
 router = APIRouter()
 
 
+def _invalidate_action(action_id: str):
+    action_cache.invalidate(action_id)
+    # Cached controllers and compiled automations hold dereferenced actions
+    smart_controller_cache.clear()
+    graph_cache.clear()
+
+
 @router.post("/")
 def create_action(action_request: ActionRequest) -> ActionResponse:
     opposite_action = Action.objects(opposite_action_id=action_request.opposite_action_id).first()
@@ -29,15 +45,19 @@ def create_action(action_request: ActionRequest) -> ActionResponse:
 
 
 @router.get("/")
-def get_actions(include_sensors: bool = False, include_actions: bool = False) -> List[ActionResponse]:
+def get_actions(response: Response, include_sensors: bool = False, include_actions: bool = False,
+                page: Page = Depends()) -> List[ActionResponse]:
     query = Q()
     if include_actions:
         query = query & Q(is_sensor=False)
     if include_sensors:
         query = query & Q(is_sensor=True)
 
-    actions = Action.objects(query)
-    return [ActionResponse.from_orm(action) for action in actions]
+    actions = page.apply(Action.objects(query), response_model=ActionResponse)
+    return page.respond(response, [page.build(ActionResponse, id=str(action.id), name=action.name, path=action.path,
+                                              opposite_action_id=action.opposite_action_id,
+                                              description=action.description, is_sensor=action.is_sensor)
+                                   for action in actions])
 
 
 @router.get("/{action_id}")
@@ -72,23 +92,31 @@ def patch_action(action_request: ActionUpdateRequest) -> ActionResponse:
     action.opposite_action_id = action_request.opposite_action_id
 
     action.save()
+    _invalidate_action(str(action.id))
 
     return ActionResponse.from_orm(action)
 
 
 @router.get("/run/{controller_id}/{action_id}")
-def run_action(controller_id: str, action_id: str, minutes_to_run_opposite: Optional[int] = None) -> float:
-    smart_controller: SmartController = SmartController.objects(id=controller_id).first()
+def run_action(response: Response, controller_id: str, action_id: str,
+               minutes_to_run_opposite: Optional[int] = None) -> float:
+    smart_controller: SmartController = smart_controller_cache.get(controller_id)
     if not smart_controller:
         raise HTTPException(status_code=404, detail="Smart Controller not found")
-    action: Action = next(action for action in smart_controller.actions if str(action.id) == action_id)
+    action: Action = next((action for action in smart_controller.actions if str(action.id) == action_id), None)
     if not action:
         raise HTTPException(status_code=404, detail="Action not found")
     if action.is_sensor:
-        return read_sensor(controller=smart_controller, action=action)
+        try:
+            reading = read_sensor(controller=smart_controller, action=action)
+        except ControllerUnavailableError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        response.headers["Age"] = str(int(reading.age))
+        response.headers["X-Sensor-Cache"] = "HIT" if reading.cached else "MISS"
+        return reading.value
     else:
         if minutes_to_run_opposite is not None:
-            opposite_action: Action = Action.objects(id=action.opposite_action_id).first()
+            opposite_action: Action = action_cache.get(action.opposite_action_id)
             if not opposite_action:
                 raise HTTPException(status_code=404, detail="Opposite action not found. Aborting action")
             task = ScheduledTask(
@@ -97,7 +125,64 @@ def run_action(controller_id: str, action_id: str, minutes_to_run_opposite: Opti
                 minutes_to_run=minutes_to_run_opposite
             ).save()
             scheduler.schedule_short_term_tasks(task)
-        return run(controller=smart_controller, action=action).ok
+        return run(controller=smart_controller, action=action).is_success
+
+
+def _action_ids(smart_controller: SmartController) -> Set[str]:
+    # Raw reference ids, avoids dereferencing every action of the controller
+    return {str(action_id) for action_id in smart_controller.to_mongo().get("actions", [])}
+
+
+async def _run_item(item: ActionRunItem, smart_controller: Optional[SmartController], action: Optional[Action],
+                    semaphore: asyncio.Semaphore) -> ActionRunResult:
+    result = ActionRunResult(controller_id=item.controller_id, action_id=item.action_id, status="not_found")
+    if smart_controller is None:
+        result.detail = "Smart Controller not found"
+        return result
+    if action is None or item.action_id not in _action_ids(smart_controller):
+        result.detail = "Action not found"
+        return result
+
+    async with semaphore:
+        started = time.perf_counter()
+        try:
+            if action.is_sensor:
+                reading = await read_sensor_async(controller=smart_controller, action=action)
+                result.value = reading.value
+                result.status = "ok"
+            else:
+                response = await run_async(controller=smart_controller, action=action)
+                result.status_code = response.status_code
+                result.status = "ok" if response.is_success else (
+                    "unavailable" if response.status_code == 503 else "failed")
+        except ControllerUnavailableError as e:
+            result.status, result.detail = "unavailable", str(e)
+        except Exception as e:
+            result.status, result.detail = "failed", str(e)
+        result.elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+    return result
+
+
+async def _run_batch(items: List[ActionRunItem], smart_controllers, actions, max_parallel: int):
+    semaphore = asyncio.Semaphore(max_parallel)
+    return await asyncio.gather(*[
+        _run_item(item=item, smart_controller=smart_controllers.get(item.controller_id),
+                  action=actions.get(item.action_id), semaphore=semaphore)
+        for item in items
+    ])
+
+
+@router.post("/run/batch")
+def run_actions_batch(batch_request: ActionBatchRunRequest) -> ActionBatchRunResponse:
+    started = time.perf_counter()
+    # One $in query per collection for everything that is not cached yet
+    smart_controllers = smart_controller_cache.get_many({item.controller_id for item in batch_request.items})
+    actions = action_cache.get_many({item.action_id for item in batch_request.items})
+
+    max_parallel = batch_request.max_parallel or settings.ACTION_BATCH_MAX_PARALLEL
+    results = executor.run_sync(_run_batch(items=batch_request.items, smart_controllers=smart_controllers,
+                                           actions=actions, max_parallel=max_parallel))
+    return ActionBatchRunResponse(results=results, elapsed_ms=round((time.perf_counter() - started) * 1000, 2))
 
 
 @router.delete("/{action_id}")
@@ -107,5 +192,6 @@ def delete_action(action_id: str) -> ActionResponse:
         raise HTTPException(status_code=404, detail="Action not found")
 
     action.delete()
+    _invalidate_action(action_id)
 
     return ActionResponse.from_orm(action)
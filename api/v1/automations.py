@@ -1,187 +1,292 @@
-from typing import List
+from typing import List, Optional
 
-from fastapi import APIRouter, HTTPException
-from db.automation import Automation, AutomationNode, ConditionEdge, Condition, Location
+from bson import ObjectId
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+
+from api.v1.pagination import Page, full_page
+from config.settings import settings
+from db import automation_graph, repository
+from db.automation import Automation, Condition, GraphEdge, GraphNode, Location
+from db.repository import run_in_db
 import models as api_models
+from tools.automation_runner.compiled_graph import graph_cache
+from tools.automation_runner.tracing import trace_store
+from tools.automation_runner.trigger_index import trigger_index
 
 router = APIRouter()
 
 
+NODE_RESPONSE_FIELDS = ("id", "unique_key", "smart_controller_id", "action_id", "location")
+# Document fields behind the graph fields of AutomationResponse, for either storage mode
+AUTOMATION_FIELD_SOURCES = {
+    "nodes": ("is_embedded", "nodes", "graph_nodes"),
+    "edges": ("is_embedded", "nodes", "graph_nodes", "edges", "graph_edges"),
+}
+
+
+def _automation_changed(automation_id: str):
+    graph_cache.invalidate(automation_id)
+    trigger_index.refresh(automation_id)
+
+
+def _edge_response(edge: GraphEdge, source: api_models.AutomationNodeResponse,
+                   target: api_models.AutomationNodeResponse) -> api_models.AutomationEdgeResponse:
+    return api_models.AutomationEdgeResponse(
+        id=str(edge.id), source=source, target=target,
+        condition=api_models.AutomationEdgeConditionRequest.from_orm(edge.condition))
+
+
+def _find_edge_response(automation: Automation, edge_id: str) -> Optional[api_models.AutomationEdgeResponse]:
+    edge = automation_graph.find_edge(automation, edge_id)
+    if edge is None:
+        return None
+    source = automation_graph.find_node(automation, node_id=str(edge.source_id))
+    target = automation_graph.find_node(automation, node_id=str(edge.target_id))
+    if not source or not target:
+        return None
+    return _edge_response(edge, api_models.AutomationNodeResponse.from_orm(source),
+                          api_models.AutomationNodeResponse.from_orm(target))
+
+
+def _build_automation_responses(automations: List[Automation],
+                                page: Optional[Page] = None) -> List[api_models.AutomationResponse]:
+    page = page or full_page()
+    # Automations are loaded with no_dereference(), graphs of referenced automations are read with one query each
+    # for edges and nodes, embedded automations already hold theirs
+    graphs = automation_graph.load_graphs(automations, only=NODE_RESPONSE_FIELDS)
+
+    responses = []
+    for automation in automations:
+        graph = graphs[automation.id]
+        nodes = {node_id: api_models.AutomationNodeResponse.from_orm(node)
+                 for node_id, node in graph.nodes_by_id.items()}
+        responses.append(page.build(
+            api_models.AutomationResponse,
+            id=str(automation.id),
+            name=automation.name,
+            inserted_at=automation.inserted_at,
+            nodes=[nodes[node.id] for node in graph.nodes],
+            edges=[_edge_response(edge, nodes[edge.source_id], nodes[edge.target_id])
+                   for edge in graph.edges if edge.source_id in nodes and edge.target_id in nodes],
+            is_active=automation.is_active,
+            is_sequential=automation.is_sequential,
+            max_parallel_branches=automation.max_parallel_branches,
+            viewport=api_models.GraphViewport.from_orm(automation.viewport) if automation.viewport else None))
+    return responses
+
+
 @router.post("/")
 async def create_automation(automation: api_models.AutomationRequest) -> api_models.AutomationResponse:
     try:
-        new_automation = Automation(name=automation.name)
-        new_automation.save()
+        new_automation = await repository.automations.save(
+            Automation(name=automation.name, is_embedded=settings.AUTOMATION_STORAGE == "embedded"))
+        await run_in_db(_automation_changed, str(new_automation.id))
         return api_models.AutomationResponse.from_orm(new_automation)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
 @router.get("/")
-async def get_automations() -> List[api_models.AutomationResponse]:
-    automations = Automation.objects()
-    return [api_models.AutomationResponse.from_orm(automation) for automation in automations]
+async def get_automations(response: Response, is_active: Optional[bool] = None,
+                          page: Page = Depends()) -> List[api_models.AutomationResponse]:
+    query = Automation.objects().no_dereference()
+    if is_active is not None:
+        query = query.filter(is_active=is_active)
+
+    automations = await run_in_db(page.apply, query, response_model=api_models.AutomationResponse,
+                                  sources=AUTOMATION_FIELD_SOURCES)
+    return page.respond(response, await run_in_db(_build_automation_responses, automations, page=page))
+
+
+# Declared before /{automation_id} so "runs" is not taken for an automation id
+@router.get("/runs/{run_id}")
+async def read_automation_run(run_id: str) -> api_models.AutomationRunResponse:
+    trace = await run_in_db(trace_store.get, run_id)
+    if trace:
+        return api_models.AutomationRunResponse.model_validate(trace)
+    raise HTTPException(status_code=404, detail="Automation run not found")
 
 
 @router.get("/{automation_id}")
 async def read_automation(automation_id: str) -> api_models.AutomationResponse:
-    automation = Automation.objects(id=automation_id).first()
+    automation = await repository.automations.get(automation_id)
     if automation:
-        return api_models.AutomationResponse.from_orm(automation)
+        return (await run_in_db(_build_automation_responses, [automation]))[0]
     raise HTTPException(status_code=404, detail="Automation not found")
 
 
 @router.put("/{automation_id}")
 async def update_automation(automation_id: str,
                             automation: api_models.AutomationUpdateRequest) -> api_models.AutomationResponse:
-    db_automation = Automation.objects(id=automation_id).first()
+    db_automation = await repository.automations.get(automation_id)
     if db_automation:
         db_automation.name = automation.name
         db_automation.is_active = automation.is_active
-        db_automation.save()
-        return api_models.AutomationResponse.from_orm(db_automation)
+        if automation.is_sequential is not None:
+            db_automation.is_sequential = automation.is_sequential
+        if automation.max_parallel_branches is not None:
+            db_automation.max_parallel_branches = automation.max_parallel_branches
+        await repository.automations.save(db_automation)
+        await run_in_db(_automation_changed, automation_id)
+        return (await run_in_db(_build_automation_responses, [db_automation]))[0]
     raise HTTPException(status_code=404, detail="Automation not found")
 
 
 @router.delete("/{automation_id}")
 async def delete_automation(automation_id: str) -> api_models.AutomationResponse:
-    automation = Automation.objects(id=automation_id).first()
+    automation = await repository.automations.get(automation_id)
     if automation:
-        automation.delete()
-        return api_models.AutomationResponse.from_orm(automation)
+        deleted = (await run_in_db(_build_automation_responses, [automation]))[0]
+        await repository.automations.delete(automation)
+        graph_cache.invalidate(automation_id)
+        trigger_index.remove(automation_id)
+        return deleted
     raise HTTPException(status_code=404, detail="Automation not found")
 
 
+@router.get("/{automation_id}/runs")
+async def read_automation_runs(automation_id: str, limit: int = Query(default=20, ge=1, le=settings.PAGE_MAX_LIMIT),
+                               include_spans: bool = False) -> List[api_models.AutomationRunResponse]:
+    traces = await run_in_db(trace_store.list, automation_id, limit)
+    runs = [api_models.AutomationRunResponse.model_validate(trace) for trace in traces]
+    if not include_spans:
+        for run in runs:
+            run.spans = []
+    return runs
+
+
 @router.post("/{automation_id}/nodes/")
 async def create_node(automation_id: str, node: api_models.AutomationNodeRequest) -> api_models.AutomationNodeResponse:
-    automation = Automation.objects(id=automation_id).first()
+    automation = await repository.automations.get(automation_id)
     if not automation:
         raise HTTPException(status_code=404, detail="Automation not found")
 
-    new_node = AutomationNode(smart_controller_id=node.smart_controller_id, action_id=node.action_id,
-                              unique_key=f"{automation_id};{node.smart_controller_id};{node.action_id}",
-                              location=Location(x=node.location.x, y=node.location.y))
-    new_node.save()
-    automation.add_node(new_node)
+    new_node = GraphNode(smart_controller_id=node.smart_controller_id, action_id=node.action_id,
+                         unique_key=f"{automation_id};{node.smart_controller_id};{node.action_id}",
+                         location=Location(x=node.location.x, y=node.location.y))
+    await run_in_db(automation_graph.add_node, automation, new_node)
+    await run_in_db(_automation_changed, automation_id)
     return api_models.AutomationNodeResponse.from_orm(new_node)
 
 
 @router.get("/{automation_id}/nodes/{node_id}")
 async def read_node(automation_id: str, node_id: str) -> api_models.AutomationNodeResponse:
-    automation = Automation.objects(id=automation_id).first()
+    automation = await repository.automations.get(automation_id)
     if not automation:
         raise HTTPException(status_code=404, detail="Automation not found")
 
-    node = AutomationNode.objects(unique_key=node_id).first()
-    if node and node in automation.nodes:
+    node = await run_in_db(automation_graph.find_node, automation, unique_key=node_id)
+    if node:
         return api_models.AutomationNodeResponse.from_orm(node)
     raise HTTPException(status_code=404, detail="Node not found")
 
 
 @router.get("/{automation_id}/nodes/")
 async def read_automations_nodes(automation_id: str) -> List[api_models.AutomationNodeResponse]:
-    automation = Automation.objects(id=automation_id).first()
+    automation = await repository.automations.get(automation_id)
     if not automation:
         raise HTTPException(status_code=404, detail="Automation not found")
 
-    return [api_models.AutomationNodeResponse.from_orm(node) for node in automation.nodes]
+    graph = await run_in_db(automation_graph.load_graph, automation, only=NODE_RESPONSE_FIELDS)
+    return [api_models.AutomationNodeResponse.from_orm(node) for node in graph.nodes]
 
 
 @router.put("/{automation_id}/nodes")
 async def update_node(automation_id: str,
                       node: api_models.AutomationNodeUpdateRequest) -> api_models.AutomationNodeResponse:
-    automation = Automation.objects(id=automation_id).first()
+    automation = await repository.automations.get(automation_id)
     if not automation:
         raise HTTPException(status_code=404, detail="Automation not found")
 
-    db_node = AutomationNode.objects(unique_key=f"{automation_id};{node.smart_controller_id};{node.action_id}").first()
-    if db_node and db_node in automation.nodes:
+    db_node = await run_in_db(automation_graph.find_node, automation,
+                              unique_key=f"{automation_id};{node.smart_controller_id};{node.action_id}")
+    if db_node:
         db_node.smart_controller_id = node.smart_controller_id
         db_node.action_id = node.action_id
         db_node.location = Location(x=node.location.x, y=node.location.y)
-        db_node.save()
+        await run_in_db(automation_graph.save_node, automation, db_node)
+        await run_in_db(_automation_changed, automation_id)
         return api_models.AutomationNodeResponse.from_orm(db_node)
     raise HTTPException(status_code=404, detail="Node not found")
 
 
 @router.delete("/{automation_id}/nodes/{unique_key}")
 async def delete_node(automation_id: str, unique_key: str) -> api_models.AutomationNodeResponse:
-    automation = Automation.objects(id=automation_id).first()
+    automation = await repository.automations.get(automation_id)
     if not automation:
         raise HTTPException(status_code=404, detail="Automation not found")
 
-    node = AutomationNode.objects(unique_key=unique_key).first()
-    if node and node in automation.nodes:
-        automation.nodes.remove(node)
-        automation.save()
-        node.delete()
+    node = await run_in_db(automation_graph.find_node, automation, unique_key=unique_key)
+    if node:
+        await run_in_db(automation_graph.remove_node, automation, node.id)
+        await run_in_db(_automation_changed, automation_id)
         return api_models.AutomationNodeResponse.from_orm(node)
     raise HTTPException(status_code=404, detail="Node not found")
 
 
 @router.post("/{automation_id}/edges/")
 async def create_edge(automation_id: str, edge: api_models.AutomationEdgeRequest) -> api_models.AutomationEdgeResponse:
-    automation = Automation.objects(id=automation_id).first()
+    automation = await repository.automations.get(automation_id)
     if not automation:
         raise HTTPException(status_code=404, detail="Automation not found")
 
-    source = AutomationNode.objects(id=edge.source.id).first()
-    target = AutomationNode.objects(id=edge.target.id).first()
+    source = await run_in_db(automation_graph.find_node, automation, node_id=edge.source.id)
+    target = await run_in_db(automation_graph.find_node, automation, node_id=edge.target.id)
     if not source or not target:
         raise HTTPException(status_code=404, detail="Source or target node not found")
 
-    condition = Condition(**edge.condition.dict())
-    new_edge = ConditionEdge(source=source, target=target, condition=condition)
-    new_edge.save()
-    automation.add_edge(new_edge)
-    new_edge.condition = api_models.AutomationEdgeConditionRequest.from_orm(condition)
-    return api_models.AutomationEdgeResponse.from_orm(new_edge)
+    new_edge = GraphEdge(source_id=source.id, target_id=target.id, condition=Condition(**edge.condition.dict()))
+    await run_in_db(automation_graph.add_edge, automation, new_edge)
+    await run_in_db(_automation_changed, automation_id)
+    return _edge_response(new_edge, api_models.AutomationNodeResponse.from_orm(source),
+                          api_models.AutomationNodeResponse.from_orm(target))
 
 
 @router.get("/{automation_id}/edges/{edge_id}")
 async def read_edge(automation_id: str, edge_id: str) -> api_models.AutomationEdgeResponse:
-    automation = Automation.objects(id=automation_id).first()
+    automation = await repository.automations.get(automation_id)
     if not automation:
         raise HTTPException(status_code=404, detail="Automation not found")
 
-    edge = ConditionEdge.objects(id=edge_id).first()
-    if edge and edge in automation.edges:
-        return api_models.AutomationEdgeResponse.from_orm(edge)
+    edge = await run_in_db(_find_edge_response, automation, edge_id)
+    if edge:
+        return edge
     raise HTTPException(status_code=404, detail="Edge not found")
 
 
 @router.put("/{automation_id}/edges/{edge_id}")
 async def update_edge(automation_id: str, edge_id: str,
                       edge: api_models.AutomationEdgeUpdateRequest) -> api_models.AutomationEdgeResponse:
-    automation = Automation.objects(id=automation_id).first()
+    automation = await repository.automations.get(automation_id)
     if not automation:
         raise HTTPException(status_code=404, detail="Automation not found")
 
-    db_edge = ConditionEdge.objects(id=edge_id).first()
-    if db_edge and db_edge in automation.edges:
-        source = AutomationNode.objects(id=edge.source_id).first()
-        target = AutomationNode.objects(id=edge.target_id).first()
+    db_edge = await run_in_db(automation_graph.find_edge, automation, edge_id)
+    if db_edge:
+        source = await run_in_db(automation_graph.find_node, automation, node_id=edge.source.id)
+        target = await run_in_db(automation_graph.find_node, automation, node_id=edge.target.id)
         if not source or not target:
             raise HTTPException(status_code=404, detail="Source or target node not found")
 
-        db_edge.source = source
-        db_edge.target = target
+        db_edge.source_id = source.id
+        db_edge.target_id = target.id
         db_edge.condition = Condition(**edge.condition.dict())
-        db_edge.save()
-        return api_models.AutomationEdgeResponse.from_orm(db_edge)
+        await run_in_db(automation_graph.save_edge, automation, db_edge)
+        await run_in_db(_automation_changed, automation_id)
+        return _edge_response(db_edge, api_models.AutomationNodeResponse.from_orm(source),
+                              api_models.AutomationNodeResponse.from_orm(target))
     raise HTTPException(status_code=404, detail="Edge not found")
 
 
 @router.delete("/{automation_id}/edges/{edge_id}")
 async def delete_edge(automation_id: str, edge_id: str) -> api_models.AutomationEdgeResponse:
-    automation = Automation.objects(id=automation_id).first()
+    automation = await repository.automations.get(automation_id)
     if not automation:
         raise HTTPException(status_code=404, detail="Automation not found")
 
-    edge = ConditionEdge.objects(id=edge_id).first()
-    if edge and edge in automation.edges:
-        automation.edges.remove(edge)
-        automation.save()
-        edge.delete()
-        return api_models.AutomationEdgeResponse.from_orm(edge)
+    edge = await run_in_db(_find_edge_response, automation, edge_id)
+    if edge:
+        await run_in_db(automation_graph.remove_edge, automation, ObjectId(edge.id))
+        await run_in_db(_automation_changed, automation_id)
+        return edge
     raise HTTPException(status_code=404, detail="Edge not found")
@@ -0,0 +1,102 @@
+import asyncio
+import json
+from typing import Iterable, List, Optional
+
+from fastapi import APIRouter, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+
+from config.settings import settings
+from tools.event_bus import event_bus, Event, Subscription, TOPICS
+
+router = APIRouter()
+
+TOPICS_DESCRIPTION = f"Comma separated topics or sub topics, e.g. sensors/<controller_id>. One of: {', '.join(TOPICS)}"
+
+
+def _validate_topics(topics: Iterable[str]) -> List[str]:
+    topics = [topic.strip().strip("/") for topic in topics if topic.strip().strip("/")]
+    unknown = {topic.split("/")[0] for topic in topics} - set(TOPICS)
+    if unknown:
+        raise ValueError(f"Unknown topics: {', '.join(sorted(unknown))}")
+    return topics
+
+
+def _parse_topics(topics: Optional[str]) -> List[str]:
+    return _validate_topics(topics.split(",")) if topics else list(TOPICS)
+
+
+def _sse(event: Event) -> str:
+    return f"event: {event.type}\ndata: {json.dumps(event.to_dict())}\n\n"
+
+
+@router.get("/")
+async def stream_events(request: Request, topics: Optional[str] = Query(default=None, description=TOPICS_DESCRIPTION)):
+    try:
+        subscribed = _parse_topics(topics)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    subscription = event_bus.subscribe(subscribed)
+
+    async def stream():
+        try:
+            # The current state first, then only what changes
+            for event in event_bus.retained(subscribed):
+                yield _sse(event)
+            while not await request.is_disconnected():
+                event = await subscription.get(timeout=settings.EVENT_KEEPALIVE_INTERVAL)
+                yield _sse(event) if event else ": keepalive\n\n"
+        finally:
+            event_bus.unsubscribe(subscription)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.websocket("/")
+async def events_socket(websocket: WebSocket, topics: Optional[str] = None):
+    try:
+        subscribed = _parse_topics(topics)
+    except ValueError as e:
+        await websocket.close(code=1008, reason=str(e))
+        return
+
+    await websocket.accept()
+    subscription = event_bus.subscribe(subscribed)
+    send_lock = asyncio.Lock()
+
+    async def send(message: dict):
+        async with send_lock:
+            await websocket.send_json(message)
+
+    receiver = asyncio.create_task(_receive_commands(websocket, subscription, send))
+    try:
+        for event in event_bus.retained(subscribed):
+            await send(event.to_dict())
+        while not receiver.done():
+            event = await subscription.get(timeout=settings.EVENT_KEEPALIVE_INTERVAL)
+            if event:
+                await send(event.to_dict())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        event_bus.unsubscribe(subscription)
+
+
+async def _receive_commands(websocket: WebSocket, subscription: Subscription, send):
+    # Clients change their topics with {"subscribe": [...]} and {"unsubscribe": [...]}
+    try:
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+                add = _validate_topics(message.get("subscribe", []))
+                remove = _validate_topics(message.get("unsubscribe", []))
+            except (ValueError, AttributeError) as e:
+                await send({"error": str(e)})
+                continue
+            event_bus.update(subscription, add=add, remove=remove)
+            for event in event_bus.retained(add):
+                await send(event.to_dict())
+            await send({"subscribed": sorted(subscription.topics)})
+    except WebSocketDisconnect:
+        pass
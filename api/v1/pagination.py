@@ -0,0 +1,79 @@
+from typing import Dict, Iterable, List, Optional, Set, Type
+
+from bson import ObjectId
+from fastapi import HTTPException, Query, Response
+from fastapi.responses import JSONResponse
+from mongoengine import QuerySet
+from pydantic import BaseModel
+
+from config.settings import settings
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class Page:
+    """
+    Cursor pagination on _id plus optional field selection, used as a FastAPI dependency.
+    The next cursor is returned in the X-Next-Cursor header so the response body stays a plain list.
+    """
+
+    def __init__(self,
+                 after: Optional[str] = Query(default=None, description="Return items with an id greater than this"),
+                 limit: Optional[int] = Query(default=None, ge=1, le=settings.PAGE_MAX_LIMIT),
+                 fields: Optional[str] = Query(default=None, description="Comma separated fields to return")):
+        if after is not None and not ObjectId.is_valid(after):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        self.after = after
+        self.limit = limit or settings.PAGE_DEFAULT_LIMIT or None
+        self.fields: Optional[Set[str]] = None
+        if fields:
+            self.fields = {field.strip() for field in fields.split(",") if field.strip()} | {"id"}
+        self.next_cursor: Optional[str] = None
+
+    @property
+    def is_partial(self) -> bool:
+        return self.fields is not None
+
+    def wants(self, field: str) -> bool:
+        return self.fields is None or field in self.fields
+
+    def apply(self, query: QuerySet, response_model: Type[BaseModel],
+              sources: Optional[Dict[str, Iterable[str]]] = None) -> list:
+        """
+        <sources> maps response fields to the document fields they are built from, when those differ.
+        """
+        if self.fields is not None:
+            unknown = self.fields - response_model.model_fields.keys()
+            if unknown:
+                raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+            sources = sources or {}
+            query = query.only(*{source for name in self.fields for source in sources.get(name, (name,))})
+        if self.after is not None:
+            query = query.filter(id__gt=ObjectId(self.after))
+        query = query.order_by("id")
+        if self.limit is None:
+            return list(query)
+
+        documents = list(query.limit(self.limit + 1))
+        if len(documents) > self.limit:
+            documents = documents[:self.limit]
+            self.next_cursor = str(documents[-1].id)
+        return documents
+
+    def build(self, model: Type[BaseModel], **values) -> BaseModel:
+        # Partial documents miss required fields, they are only dumped with the selected fields
+        return model.model_construct(**values) if self.is_partial else model(**values)
+
+    def respond(self, response: Response, items: List[BaseModel]):
+        headers = {NEXT_CURSOR_HEADER: self.next_cursor} if self.next_cursor else {}
+        if self.is_partial:
+            return JSONResponse(content=[item.model_dump(mode="json", include=self.fields) for item in items],
+                                headers=headers)
+        response.headers.update(headers)
+        return items
+
+
+def full_page() -> Page:
+    page = Page(after=None, limit=None, fields=None)
+    page.limit = None
+    return page
@@ -0,0 +1,73 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+from fastapi import APIRouter, HTTPException, Query
+
+from config.settings import settings
+from db.document_cache import smart_controller_cache
+from db.models import Action, SmartController
+from db.sensor_history import Resolution
+from models.sensor import SensorHistoryResponse, SensorHistoryPoint, SensorPushRequest, SensorPushResponse, \
+    SensorPushRejection
+from tools.action_executor import executor
+from tools.action_runner.action_runner import ingest_async
+from tools.sensor_history import get_history, pick_resolution
+
+router = APIRouter()
+
+
+def _to_naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    # Readings are stored as naive UTC like the rest of the documents
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+@router.get("/{controller_id}/{action_id}/history")
+def get_sensor_history(controller_id: str, action_id: str,
+                       start: Optional[datetime] = Query(default=None, alias="from"),
+                       end: Optional[datetime] = Query(default=None, alias="to"),
+                       resolution: Optional[Resolution] = None) -> SensorHistoryResponse:
+    end = _to_naive_utc(end) or datetime.utcnow()
+    start = _to_naive_utc(start) or end - timedelta(days=1)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="'from' must be before 'to'")
+
+    resolution = resolution or pick_resolution(start=start, end=end)
+    points = get_history(smart_controller_id=controller_id, action_id=action_id, start=start, end=end,
+                         resolution=resolution)
+    return SensorHistoryResponse(smart_controller_id=controller_id, action_id=action_id, resolution=resolution,
+                                 points=[SensorHistoryPoint.model_validate(point) for point in points])
+
+
+async def _ingest(values: List[Tuple[SmartController, Action, str]]) -> int:
+    started = await asyncio.gather(*[ingest_async(controller=controller, action=action, text=text)
+                                     for controller, action, text in values])
+    return sum(started)
+
+
+@router.post("/push")
+def push_sensor_values(push_request: SensorPushRequest) -> SensorPushResponse:
+    """
+    Values pushed by controllers. Each one refreshes the sensor cache and history, is published on the event bus and
+    evaluates the automations it triggers, without a request to the device.
+    """
+    if len(push_request.items) > settings.SENSOR_PUSH_MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f"At most {settings.SENSOR_PUSH_MAX_BATCH} values per push")
+
+    smart_controllers = smart_controller_cache.get_many({item.controller_id for item in push_request.items})
+    values, rejected = [], []
+    for index, item in enumerate(push_request.items):
+        smart_controller = smart_controllers.get(item.controller_id)
+        if smart_controller is None:
+            rejected.append(SensorPushRejection(index=index, detail="Smart Controller not found"))
+            continue
+        action = next((action for action in smart_controller.actions if str(action.id) == item.action_id), None)
+        if action is None:
+            rejected.append(SensorPushRejection(index=index, detail="Action not found"))
+            continue
+        values.append((smart_controller, action, item.text))
+
+    started = executor.run_sync(_ingest(values)) if values else 0
+    return SensorPushResponse(accepted=len(values), rejected=rejected, automations_started=started)
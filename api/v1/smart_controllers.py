@@ -1,13 +1,44 @@
 import time
-from typing import List
+from typing import Dict, List, Optional
 
-from fastapi import APIRouter, HTTPException
+from bson import ObjectId
+from fastapi import APIRouter, Depends, HTTPException, Response
 
+from api.v1.pagination import Page, full_page
+
+from db.document_cache import smart_controller_cache
 from db.models import SmartController, Action
-from models.smart_controller import SmartControllerRequest, SmartControllerResponse, SmartControllerUpdateRequest
+from db.prefetch import fetch_by_ids, ref_id
+from models.action import ActionResponse
+from models.smart_controller import SmartControllerRequest, SmartControllerResponse, SmartControllerUpdateRequest, \
+    SmartControllerHealthResponse
+from tools.automation_runner.compiled_graph import graph_cache
+from tools.health_monitor import health_monitor, ControllerHealth
 
 router = APIRouter()
 
+ACTION_RESPONSE_FIELDS = ("id", "name", "path", "opposite_action_id", "description", "is_sensor")
+
+
+def build_smart_controller_responses(smart_controllers: List[SmartController],
+                                     actions: Optional[Dict[ObjectId, Action]] = None,
+                                     page: Optional[Page] = None) -> List[SmartControllerResponse]:
+    """
+    Builds responses for controllers loaded with no_dereference(). Missing actions are fetched with one query
+    instead of one per controller.
+    """
+    page = page or full_page()
+    actions = dict(actions or {})
+    missing = {ref_id(action) for smart_controller in smart_controllers for action in smart_controller.actions}
+    actions.update(fetch_by_ids(Action, missing - actions.keys(), only=ACTION_RESPONSE_FIELDS))
+    return [page.build(SmartControllerResponse,
+                       id=str(smart_controller.id),
+                       name=smart_controller.name,
+                       address=smart_controller.address,
+                       actions=[ActionResponse.from_orm(actions[ref_id(action)])
+                                for action in smart_controller.actions if ref_id(action) in actions])
+            for smart_controller in smart_controllers]
+
 
 @router.post("/")
 def create_smart_controller(smart_controller_request: SmartControllerRequest):
@@ -26,9 +57,36 @@ def create_smart_controller(smart_controller_request: SmartControllerRequest):
 
 
 @router.get("/")
-def get_smart_controllers() -> List[SmartControllerResponse]:
-    smart_controllers = SmartController.objects()
-    return [SmartControllerResponse.from_orm(smart_controller) for smart_controller in smart_controllers]
+def get_smart_controllers(response: Response, action_id: Optional[str] = None,
+                          page: Page = Depends()) -> List[SmartControllerResponse]:
+    query = SmartController.objects().no_dereference()
+    if action_id is not None:
+        if not ObjectId.is_valid(action_id):
+            raise HTTPException(status_code=400, detail="Invalid action id")
+        query = query.filter(actions=ObjectId(action_id))
+
+    smart_controllers = page.apply(query, response_model=SmartControllerResponse)
+    return page.respond(response, build_smart_controller_responses(smart_controllers, page=page))
+
+
+def _latency_ms(health: ControllerHealth, percentile: float) -> Optional[float]:
+    latency = health.latency_percentile(percentile)
+    return None if latency is None else round(latency * 1000, 2)
+
+
+@router.get("/health")
+def get_smart_controllers_health() -> List[SmartControllerHealthResponse]:
+    return [SmartControllerHealthResponse(id=health.controller_id,
+                                          name=health.name,
+                                          address=health.address,
+                                          is_alive=health.is_alive,
+                                          consecutive_failures=health.consecutive_failures,
+                                          last_checked=health.last_checked,
+                                          last_error=health.last_error,
+                                          latency_p50_ms=_latency_ms(health, 50),
+                                          latency_p90_ms=_latency_ms(health, 90),
+                                          latency_p99_ms=_latency_ms(health, 99))
+            for health in health_monitor.get_all()]
 
 
 @router.get("/{smart_controller_id}")
@@ -58,5 +116,7 @@ def patch_smart_controller(smart_controller_request: SmartControllerUpdateReques
         smart_controller.actions = actions
 
     smart_controller.save()
+    smart_controller_cache.invalidate(str(smart_controller.id))
+    graph_cache.clear()
 
     return SmartControllerResponse.from_orm(smart_controller)
@@ -1,22 +1,55 @@
-from typing import List
-
-from fastapi import APIRouter, HTTPException
-
-from db.models import SmartController, Action, Task, TaskType
+import logging
+from typing import List, Optional
+
+from apscheduler.jobstores.base import JobLookupError
+from fastapi import APIRouter, Depends, HTTPException, Response
+
+from api.v1.pagination import Page
+from api.v1.smart_controllers import ACTION_RESPONSE_FIELDS, build_smart_controller_responses
+from db.document_cache import action_cache, smart_controller_cache
+from db.models import Action, SmartController, Task, TaskType
+from db.prefetch import fetch_by_ids, ref_id
+from models.action import ActionResponse
 from models.task import TaskRequest, TaskResponse, TaskUpdateRequest
-from tools.scheduler.scheduler import scheduler, schedule_long_term_tasks
+from tools.scheduler.scheduler import scheduler, schedule_long_term_tasks, task_job_id
 
 router = APIRouter()
 
 
+def _build_task_responses(tasks: List[Task], page: Page) -> List[TaskResponse]:
+    # Tasks are loaded with no_dereference(), every referenced collection is then read once
+    smart_controllers = fetch_by_ids(SmartController, (ref_id(task.smart_controller) for task in tasks))
+    action_ids = {ref_id(task.action) for task in tasks}
+    action_ids.update(ref_id(action) for smart_controller in smart_controllers.values()
+                      for action in smart_controller.actions)
+    actions = fetch_by_ids(Action, action_ids, only=ACTION_RESPONSE_FIELDS)
+    smart_controller_responses = {
+        response.id: response
+        for response in build_smart_controller_responses(list(smart_controllers.values()), actions=actions)
+    }
+
+    responses = []
+    for task in tasks:
+        action = actions.get(ref_id(task.action))
+        smart_controller = smart_controller_responses.get(str(ref_id(task.smart_controller)))
+        if (page.wants("action") and action is None) or (page.wants("smart_controller") and smart_controller is None):
+            logging.warning(f"Task: '{task.id}' refers to a missing controller or action")
+            continue
+        responses.append(page.build(TaskResponse, id=str(task.id), type=task.type,
+                                    action=ActionResponse.from_orm(action) if action else None,
+                                    smart_controller=smart_controller, minute=task.minute, hour=task.hour,
+                                    week_day=task.week_day, month_day=task.month_day))
+    return responses
+
+
 @router.post("/")
 def create_task(task_request: TaskRequest) -> TaskResponse:
-    smart_controller = SmartController.objects(id=task_request.smart_controller_id).first()
+    smart_controller = smart_controller_cache.get(task_request.smart_controller_id)
 
     if smart_controller is None:
         raise HTTPException(status_code=404, detail="Smart controller not found")
 
-    action = Action.objects(id=task_request.action_id).first()
+    action = action_cache.get(task_request.action_id)
     if action is None or task_request.action_id not in [str(action.id) for action in smart_controller.actions]:
         raise HTTPException(status_code=404, detail="Action not found")
 
@@ -36,9 +69,10 @@ def create_task(task_request: TaskRequest) -> TaskResponse:
 
 
 @router.get("/{smart_controller_id}")
-def get_smart_controller_tasks(smart_controller_id: str) -> List[TaskResponse]:
-    tasks = Task.objects(smart_controller=smart_controller_id)
-    return [TaskResponse.from_orm(task) for task in tasks]
+def get_smart_controller_tasks(response: Response, smart_controller_id: str,
+                               page: Page = Depends()) -> List[TaskResponse]:
+    tasks = page.apply(Task.objects(smart_controller=smart_controller_id).no_dereference(), response_model=TaskResponse)
+    return page.respond(response, _build_task_responses(tasks, page=page))
 
 
 @router.get("/{task_id}")
@@ -51,12 +85,19 @@ def get_task(task_id: str) -> TaskResponse:
 
 
 @router.get("/")
-def get_tasks() -> List[TaskResponse]:
-    tasks = Task.objects().all()
-    if not tasks:
+def get_tasks(response: Response, smart_controller_id: Optional[str] = None, type: Optional[TaskType] = None,
+              page: Page = Depends()) -> List[TaskResponse]:
+    query = Task.objects().no_dereference()
+    if smart_controller_id is not None:
+        query = query.filter(smart_controller=smart_controller_id)
+    if type is not None:
+        query = query.filter(type=type)
+
+    tasks = page.apply(query, response_model=TaskResponse)
+    if not tasks and page.after is None:
         raise HTTPException(status_code=404, detail="Tasks not found")
 
-    return [TaskResponse.from_orm(task) for task in tasks]
+    return page.respond(response, _build_task_responses(tasks, page=page))
 
 
 @router.patch("/")
@@ -94,7 +135,12 @@ def delete_task(task_id: str) -> TaskResponse:
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
 
-    scheduler.remove_job(job_id=task.job_id, jobstore="default")
+    # task.job_id is written behind and can still be empty right after the task was created
+    for job_id in {task_job_id(task), task.job_id} - {""}:
+        try:
+            scheduler.remove_job(job_id=job_id, jobstore="default")
+        except JobLookupError:
+            pass
 
     task.delete()
 
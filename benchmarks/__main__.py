@@ -0,0 +1,90 @@
+"""
+Benchmarks against simulated smart controllers, run from the repository root:
+
+    python -m benchmarks run [scenario ...] [--mongo mongomock|<uri>] [--output results.json]
+    python -m benchmarks compare baseline.json results.json
+"""
+import argparse
+import logging
+import random
+import sys
+
+from benchmarks.harness import compare, configure_environment
+
+
+def _parse_sensor(value: str):
+    name, _, spec = value.partition("=")
+    if not spec:
+        raise argparse.ArgumentTypeError(f"Expected <name>=<generator>, got {value}")
+    return name, spec
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Run scenarios and write their results as JSON")
+    run.add_argument("scenarios", nargs="*", help="Scenarios to run, all of them by default")
+    run.add_argument("--mongo", default="mongomock", help="mongomock or the URI of a local mongod")
+    run.add_argument("--output", help="Result file, printed to stdout when omitted")
+    run.add_argument("--controllers", type=int, default=8)
+    run.add_argument("--latency-ms", type=float, default=20.0)
+    run.add_argument("--jitter-ms", type=float, default=5.0)
+    run.add_argument("--failure-rate", type=float, default=0.0)
+    run.add_argument("--sensor", type=_parse_sensor, action="append", default=[],
+                     help="Sensor of every fake controller as <name>=<generator>, e.g. temperature=walk:21:0.5")
+    run.add_argument("--scale", type=float, default=1.0, help="Multiplies the number of operations of every scenario")
+    run.add_argument("--seed", type=int, default=1)
+
+    comparison = commands.add_parser("compare", help="Compare two result files")
+    comparison.add_argument("baseline")
+    comparison.add_argument("current")
+    comparison.add_argument("--threshold", type=float, default=0.10,
+                            help="Relative change counted as a regression, exits with 1 when any is found")
+
+    args = parser.parse_args()
+    if args.command == "compare":
+        sys.exit(1 if compare(args.baseline, args.current, threshold=args.threshold) else 0)
+
+    # The application settings are read on import, the environment must be ready first
+    configure_environment()
+    logging.basicConfig(level=logging.WARNING, format="[%(asctime)s] [%(levelname)s] %(module)s - %(message)s")
+    from benchmarks.fake_controller import ControllerProfile, FakeControllerServer
+    from benchmarks.harness import build_report, connect_database, write_report
+    from benchmarks.scenarios import Context, SCENARIOS
+    from tools.action_executor import executor
+    from db import write_buffer
+
+    unknown = set(args.scenarios) - SCENARIOS.keys()
+    if unknown:
+        parser.error(f"Unknown scenarios {', '.join(sorted(unknown))}, choose from {', '.join(SCENARIOS)}")
+
+    sensors = dict(args.sensor) or {"temperature": "walk:21:0.5", "ramp": "ramp:0:1"}
+    profile = ControllerProfile(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                                failure_rate=args.failure_rate, sensors=sensors)
+    connect_database(args.mongo)
+    executor.start()
+    write_buffer.startup_event()
+
+    measurements = []
+    with FakeControllerServer(count=args.controllers, profile=profile, seed=args.seed) as server:
+        context = Context(server=server, rng=random.Random(args.seed), scale=args.scale)
+        try:
+            for name in args.scenarios or SCENARIOS:
+                logging.warning(f"Running benchmark {name}")
+                result = SCENARIOS[name](context)
+                measurements += result if isinstance(result, list) else [result]
+        finally:
+            write_buffer.shutdown_event()
+            # Closes the keep-alive connections before the fake controllers go away
+            executor.stop()
+
+    report = build_report(measurements, mongo=args.mongo, seed=args.seed)
+    report["meta"]["controllers"] = {"count": args.controllers, "latency_ms": args.latency_ms,
+                                     "jitter_ms": args.jitter_ms, "failure_rate": args.failure_rate,
+                                     "sensors": sensors, "scale": args.scale}
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
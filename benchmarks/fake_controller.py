@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import math
+import random
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+SENSOR_PATH_PREFIX = "/sensor/"
+
+
+def sensor_generator(spec: str, rng: random.Random) -> Callable[[], str]:
+    """
+    Builds a value generator from <spec>:
+        constant:<value>
+        random:<low>:<high>
+        walk:<start>:<step>          random walk
+        ramp:<start>:<step>          grows by <step> on every read, lets loops cross a threshold
+        sine:<mid>:<amplitude>:<period reads>
+        toggle                       alternates true/false
+    """
+    kind, *args = spec.split(":")
+    numbers = [float(arg) for arg in args]
+    if kind == "constant":
+        return lambda: f"{numbers[0]:g}"
+    if kind == "random":
+        return lambda: f"{rng.uniform(numbers[0], numbers[1]):.2f}"
+    if kind in ("walk", "ramp", "sine", "toggle"):
+        state = {"reads": 0, "value": numbers[0] if numbers else 0.0}
+
+        def generate() -> str:
+            state["reads"] += 1
+            if kind == "walk":
+                state["value"] += rng.uniform(-numbers[1], numbers[1])
+            elif kind == "ramp":
+                state["value"] = numbers[0] + numbers[1] * (state["reads"] - 1)
+            elif kind == "sine":
+                state["value"] = numbers[0] + numbers[1] * math.sin(2 * math.pi * state["reads"] / numbers[2])
+            else:
+                return "true" if state["reads"] % 2 else "false"
+            return f"{state['value']:.2f}"
+        return generate
+    raise ValueError(f"Unknown sensor generator {spec}")
+
+
+@dataclass
+class ControllerProfile:
+    # Latency of every response is latency_ms +- jitter_ms
+    latency_ms: float = 20.0
+    jitter_ms: float = 5.0
+    # Share of requests answered with a 500
+    failure_rate: float = 0.0
+    # Sensor name -> generator spec, served at /sensor/<name>
+    sensors: Dict[str, str] = field(default_factory=dict)
+
+
+class FakeController:
+    def __init__(self, profile: ControllerProfile, rng: random.Random):
+        self.profile = profile
+        self.rng = rng
+        self.requests = 0
+        self.failures = 0
+        self.connections = set()
+        self._sensors = {name: sensor_generator(spec, rng) for name, spec in profile.sensors.items()}
+
+    def reset_sensors(self):
+        self._sensors = {name: sensor_generator(spec, self.rng) for name, spec in self.profile.sensors.items()}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections.add(writer)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                if int(headers.get("content-length", 0)):
+                    await reader.readexactly(int(headers["content-length"]))
+
+                path = request_line.decode("latin-1").split(" ")[1].split("?")[0]
+                status, body = await self._respond(path)
+                writer.write(f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                             f"Content-Type: text/plain\r\nContent-Length: {len(body)}\r\n"
+                             f"Connection: keep-alive\r\n\r\n".encode() + body)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+    async def _respond(self, path: str):
+        self.requests += 1
+        delay = max(self.profile.latency_ms + self.rng.uniform(-self.profile.jitter_ms, self.profile.jitter_ms), 0.0)
+        await asyncio.sleep(delay / 1000)
+        if self.rng.random() < self.profile.failure_rate:
+            self.failures += 1
+            return 500, b"simulated failure"
+        if path.startswith(SENSOR_PATH_PREFIX):
+            generate = self._sensors.get(path[len(SENSOR_PATH_PREFIX):])
+            if generate is None:
+                return 404, b"unknown sensor"
+            return 200, generate().encode()
+        return 200, b"ok"
+
+
+class FakeControllerServer:
+    """
+    Serves <count> simulated smart controllers from a background thread, each on its own local port so the action
+    executor treats them as separate controllers.
+    """
+
+    def __init__(self, count: int, profile: ControllerProfile, seed: int = 0):
+        self.controllers: List[FakeController] = [FakeController(profile, random.Random(seed + index))
+                                                  for index in range(count)]
+        self.addresses: List[str] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._servers: List[asyncio.AbstractServer] = []
+
+    def start(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="fake-controllers", daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._listen(), self._loop).result()
+        logging.info(f"Fake controllers listening on {', '.join(self.addresses)}")
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+
+    def reset(self):
+        for controller in self.controllers:
+            controller.requests = controller.failures = 0
+            controller.reset_sensors()
+
+    @property
+    def requests(self) -> int:
+        return sum(controller.requests for controller in self.controllers)
+
+    @property
+    def failures(self) -> int:
+        return sum(controller.failures for controller in self.controllers)
+
+    async def _listen(self):
+        for controller in self.controllers:
+            server = await asyncio.start_server(controller.handle, host="127.0.0.1", port=0)
+            self._servers.append(server)
+            self.addresses.append(f"127.0.0.1:{server.sockets[0].getsockname()[1]}")
+
+    async def _close(self):
+        for server in self._servers:
+            server.close()
+        # Keep-alive connections of the clients would otherwise keep the servers open
+        for controller in self.controllers:
+            for writer in list(controller.connections):
+                writer.close()
+        for server in self._servers:
+            await server.wait_closed()
+        self._servers.clear()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
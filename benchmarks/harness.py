@@ -0,0 +1,180 @@
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+BENCHMARK_DATABASE = "smart_home_benchmark"
+
+# Applied before the application settings are loaded unless already set in the environment
+ENVIRONMENT_DEFAULTS = {
+    "MONGO_USERNAME": "benchmark",
+    "MONGO_PASSWORD": "benchmark",
+    "MONGO_DATABASE": BENCHMARK_DATABASE,
+    "DB_ADDRESS": "localhost:27017",
+    "LOG_LEVEL": "WARNING",
+    # Loops must see a new device value on every iteration to be comparable across runs
+    "SENSOR_CACHE_FRESHNESS": "0",
+    "HEALTH_CHECK_INTERVAL": "3600",
+}
+
+# Settings that change the numbers, recorded with every result file
+RECORDED_SETTINGS = ["MONGO_MAX_POOL_SIZE", "ACTION_MAX_IN_FLIGHT_PER_CONTROLLER", "AUTOMATION_MAX_PARALLEL_BRANCHES",
+                     "SENSOR_CACHE_FRESHNESS", "ACTION_BATCH_MAX_PARALLEL", "PAGE_DEFAULT_LIMIT",
+                     "AUTOMATION_TRACE_PERSIST", "PROFILER_ENABLED"]
+
+
+def configure_environment():
+    for name, value in ENVIRONMENT_DEFAULTS.items():
+        os.environ.setdefault(name, value)
+
+
+def connect_database(mongo: str):
+    """
+    <mongo> is "mongomock" for an in-process fake, or the URI of a local mongod. The benchmark database is dropped
+    first so every run starts from the same data.
+    """
+    from mongoengine import connect, disconnect
+    from mongoengine.connection import get_db
+    from tools.metrics import MongoCommandMetrics
+
+    disconnect()
+    if mongo == "mongomock":
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit("mongomock is not installed, see benchmarks/requirements.txt or pass --mongo <uri>")
+        connection = connect(BENCHMARK_DATABASE, host="mongodb://localhost", mongo_client_class=mongomock.MongoClient)
+    else:
+        connection = connect(BENCHMARK_DATABASE, host=mongo, event_listeners=[MongoCommandMetrics()])
+    # A database named in the URI takes precedence, never drop anything but the benchmark database
+    if get_db().name != BENCHMARK_DATABASE:
+        sys.exit(f"Benchmarks only run against the {BENCHMARK_DATABASE} database, got {get_db().name}")
+    connection.drop_database(BENCHMARK_DATABASE)
+
+    from db.indexes import ensure_indexes
+    ensure_indexes()
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+@dataclass
+class Measurement:
+    """
+    Latencies of the operations of one scenario, plus whatever counters the scenario wants to report.
+    """
+    scenario: str
+    params: Dict[str, Any]
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+    counters: Dict[str, float] = field(default_factory=dict)
+    started: float = field(default_factory=time.perf_counter)
+    finished: Optional[float] = None
+
+    def record(self, seconds: float, error: bool = False):
+        self.latencies.append(seconds)
+        if error:
+            self.errors += 1
+
+    def finish(self) -> "Measurement":
+        self.finished = time.perf_counter()
+        return self
+
+    def to_dict(self) -> dict:
+        duration = (self.finished or time.perf_counter()) - self.started
+        latencies = sorted(self.latencies)
+        return {
+            "scenario": self.scenario,
+            "params": self.params,
+            "operations": len(latencies),
+            "errors": self.errors,
+            "duration_s": round(duration, 4),
+            "throughput_per_s": round(len(latencies) / duration, 2) if duration > 0 else 0.0,
+            "latency_ms": {
+                "mean": round(statistics.fmean(latencies) * 1000, 3) if latencies else 0.0,
+                "p50": round(percentile(latencies, 0.50) * 1000, 3),
+                "p90": round(percentile(latencies, 0.90) * 1000, 3),
+                "p99": round(percentile(latencies, 0.99) * 1000, 3),
+                "max": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+            },
+            "counters": dict(sorted(self.counters.items())),
+        }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def build_report(measurements: List[Measurement], mongo: str, seed: int) -> dict:
+    from config.settings import settings
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "mongo": "mongomock" if mongo == "mongomock" else "mongod",
+            "seed": seed,
+            "settings": {name: getattr(settings, name) for name in RECORDED_SETTINGS},
+        },
+        "results": sorted((measurement.to_dict() for measurement in measurements),
+                          key=lambda result: result["scenario"]),
+    }
+
+
+def write_report(report: dict, path: Optional[str]):
+    text = json.dumps(report, indent=2)
+    if path:
+        with open(path, "w") as f:
+            f.write(text + "\n")
+        logging.warning(f"Benchmark results written to {path}")
+    else:
+        print(text)
+
+
+def compare(baseline_path: str, current_path: str, threshold: float = 0.10) -> int:
+    """
+    Prints the change of every scenario between two result files, returns the number of regressions larger than
+    <threshold> in p50, p99 or throughput.
+    """
+    with open(baseline_path) as f:
+        baseline = {result["scenario"]: result for result in json.load(f)["results"]}
+    with open(current_path) as f:
+        current = {result["scenario"]: result for result in json.load(f)["results"]}
+
+    regressions = 0
+    print(f"{'scenario':<40} {'p50 ms':>28} {'p99 ms':>28} {'ops/s':>28}")
+    for scenario in sorted(baseline.keys() | current.keys()):
+        if scenario not in baseline or scenario not in current:
+            print(f"{scenario:<40} only in {'current' if scenario in current else 'baseline'}")
+            continue
+        old, new = baseline[scenario], current[scenario]
+        if old["params"] != new["params"]:
+            print(f"{scenario:<40} parameters differ, not comparable")
+            continue
+        columns = []
+        for key, lower_is_better in (("p50", True), ("p99", True), ("throughput_per_s", False)):
+            before = old["latency_ms"][key] if key != "throughput_per_s" else old[key]
+            after = new["latency_ms"][key] if key != "throughput_per_s" else new[key]
+            change = (after - before) / before if before else 0.0
+            if (change > threshold) if lower_is_better else (change < -threshold):
+                regressions += 1
+            columns.append(f"{before:>9.1f} -> {after:<9.1f} {change:+6.0%}")
+        print(f"{scenario:<40} " + " ".join(f"{column:>28}" for column in columns))
+    return regressions
@@ -0,0 +1,404 @@
+import asyncio
+import random
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Tuple
+
+import httpx
+import pytz
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED, EVENT_JOB_MISSED, EVENT_JOB_SUBMITTED
+
+from benchmarks.fake_controller import FakeControllerServer, SENSOR_PATH_PREFIX
+from benchmarks.harness import Measurement
+from db.automation import Automation, Condition, ConditionType, GraphEdge, GraphNode, Location, Operator, \
+    ReturnValueType
+from db.document_cache import action_cache, smart_controller_cache
+from db.models import Action, SmartController, Task, TaskType
+from db.sensor_history import SensorRollup, SensorSegment
+from tools.action_executor import executor
+from tools.action_runner.action_runner import dispatch_automations, read_sensor_async, run_async, \
+    wait_for_update_async
+from tools.automation_runner.automation_runner import AutomationRunner
+from tools.automation_runner.compiled_graph import graph_cache
+from tools.automation_runner.trigger_index import trigger_index
+from tools.sensor_cache import sensor_cache
+
+TRIGGER = Condition(condition_type=ConditionType.BY_TRIGGER, value_type=ReturnValueType.BOOLEAN,
+                    operator=Operator.EQUAL, value_boolean=True)
+
+
+@dataclass
+class Context:
+    server: FakeControllerServer
+    rng: random.Random
+    # Scales the number of operations of every scenario, 1.0 are the defaults below
+    scale: float = 1.0
+
+    def count(self, default: int) -> int:
+        return max(int(default * self.scale), 1)
+
+
+def _reset(context: Context):
+    # Every scenario starts from an empty database and cold caches
+    for model in (Automation, Task, SmartController, Action, SensorSegment, SensorRollup):
+        model.objects().delete()
+    action_cache.clear()
+    smart_controller_cache.clear()
+    graph_cache.clear()
+    trigger_index.build()
+    executor.submit(_clear_sensor_cache()).result()
+    context.server.reset()
+
+
+async def _clear_sensor_cache():
+    sensor_cache._readings.clear()
+
+
+def seed_controllers(context: Context, actions_per_controller: int = 4) -> List[SmartController]:
+    """
+    One SmartController per fake controller, each with <actions_per_controller> actions and the sensors of the
+    server's profile.
+    """
+    controllers = []
+    sensors = list(context.server.controllers[0].profile.sensors)
+    for index, address in enumerate(context.server.addresses):
+        actions = [Action(name=f"bench-{index}-action-{number}", path=f"/action/{number}", description="")
+                   for number in range(actions_per_controller)]
+        actions += [Action(name=f"bench-{index}-sensor-{sensor}", path=f"{SENSOR_PATH_PREFIX}{sensor}",
+                           description="", is_sensor=True)
+                    for sensor in sensors]
+        Action.objects.insert(actions, load_bulk=False)
+        controller = SmartController(name=f"bench-controller-{index}", address=address, actions=actions)
+        controller.save()
+        controllers.append(controller)
+    return controllers
+
+
+def seed_automation(name: str, steps: List[Tuple[SmartController, Action]],
+                    edges: List[Tuple[int, int, Condition]], is_sequential: bool = False) -> Automation:
+    nodes = [GraphNode(unique_key=f"{name}-{index}", smart_controller_id=str(controller.id),
+                       action_id=str(action.id), location=Location(x=float(index), y=0.0))
+             for index, (controller, action) in enumerate(steps)]
+    automation = Automation(name=name, is_embedded=True, is_sequential=is_sequential, graph_nodes=nodes,
+                            graph_edges=[GraphEdge(source_id=nodes[source].id, target_id=nodes[target].id,
+                                                   condition=condition)
+                                         for source, target, condition in edges])
+    automation.save()
+    return automation
+
+
+def _actions(controller: SmartController) -> List[Action]:
+    return [action for action in controller.actions if not action.is_sensor]
+
+
+def _sensors(controller: SmartController) -> List[Action]:
+    return [action for action in controller.actions if action.is_sensor]
+
+
+async def _drain():
+    # Waits for the automation runs spawned on the executor loop
+    while executor._background_tasks:
+        await asyncio.gather(*executor._background_tasks, return_exceptions=True)
+
+
+def dispatch(context: Context, automations: int = 50, depth: int = 3, rounds: int = 20) -> Measurement:
+    """
+    One action that triggers <automations> automations of <depth> steps each. Measures the time from dispatch to
+    the end of every run it started.
+    """
+    _reset(context)
+    controllers = seed_controllers(context)
+    trigger_controller, trigger = controllers[0], _actions(controllers[0])[0]
+    for number in range(automations):
+        steps = [(trigger_controller, trigger)]
+        for step in range(depth):
+            controller = controllers[(number + step + 1) % len(controllers)]
+            steps.append((controller, context.rng.choice(_actions(controller))))
+        seed_automation(f"bench-dispatch-{number}", steps, [(index, index + 1, TRIGGER) for index in range(depth)])
+    trigger_index.build()
+
+    measurement = Measurement("dispatch", {"automations": automations, "depth": depth, "rounds": rounds})
+    context.server.reset()
+    dispatch_seconds = 0.0
+    for _ in range(context.count(rounds)):
+        started = time.perf_counter()
+        started_runs = executor.submit(dispatch_automations(controller=trigger_controller, action=trigger,
+                                                            response_text="ok")).result()
+        dispatch_seconds += time.perf_counter() - started
+        executor.submit(_drain()).result()
+        measurement.record(time.perf_counter() - started, error=started_runs != automations)
+    # Time to look up and spawn the runs, without running them
+    measurement.counters["dispatch_mean_ms"] = round(dispatch_seconds / context.count(rounds) * 1000, 3)
+    measurement.counters["device_requests"] = context.server.requests
+    return measurement.finish()
+
+
+async def _http_load(app, paths: List[str], concurrency: int, measurement: Measurement):
+    queue = list(reversed(paths))
+
+    async def worker(client: httpx.AsyncClient):
+        while queue:
+            path = queue.pop()
+            started = time.perf_counter()
+            response = await client.get(path)
+            measurement.record(time.perf_counter() - started, error=not response.is_success)
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        await asyncio.gather(*[worker(client) for _ in range(concurrency)])
+
+
+def actions_run(context: Context, requests: int = 500, concurrency: int = 16,
+                sensor_share: float = 0.2) -> Measurement:
+    """
+    /actions/run/{controller_id}/{action_id} through the whole API stack, <sensor_share> of the requests read a
+    sensor instead of running an action.
+    """
+    from main import app
+
+    _reset(context)
+    controllers = seed_controllers(context)
+    paths = []
+    for _ in range(context.count(requests)):
+        controller = context.rng.choice(controllers)
+        use_sensor = context.rng.random() < sensor_share and _sensors(controller)
+        action = context.rng.choice(_sensors(controller) if use_sensor else _actions(controller))
+        paths.append(f"/actions/run/{controller.id}/{action.id}")
+
+    measurement = Measurement("actions_run", {"requests": requests, "concurrency": concurrency,
+                                              "sensor_share": sensor_share})
+    asyncio.run(_http_load(app, paths, concurrency, measurement))
+    measurement.counters["device_requests"] = context.server.requests
+    return measurement.finish()
+
+
+def scheduler_burst(context: Context, jobs: int = 300, timeout: float = 120.0) -> Measurement:
+    """
+    <jobs> cron tasks due at the same second, like many tasks set for 07:00. Operation latency is the time from
+    the scheduled run time to the end of the job, lag is the time until the job was submitted to the executor.
+    """
+    from tools.scheduler import scheduler as scheduler_module
+
+    _reset(context)
+    controllers = seed_controllers(context)
+    tasks = []
+    for number in range(context.count(jobs)):
+        controller = controllers[number % len(controllers)]
+        tasks.append(Task(type=TaskType.DAILY, smart_controller=controller,
+                          action=context.rng.choice(_actions(controller)), minute=0, hour=7, week_day=0,
+                          month_day=1))
+    Task.objects.insert(tasks, load_bulk=False)
+
+    measurement = Measurement("scheduler_burst", {"jobs": jobs})
+    scheduler = scheduler_module.scheduler
+    run_at = datetime.now(pytz.UTC) + timedelta(seconds=2)
+    pending = {scheduler_module.task_job_id(task) for task in tasks}
+    lags: List[float] = []
+    done = threading.Event()
+
+    def listener(event):
+        if event.job_id not in pending:
+            return
+        now = datetime.now(pytz.UTC)
+        if event.code == EVENT_JOB_SUBMITTED:
+            lags.append((now - run_at).total_seconds())
+            return
+        measurement.record((now - run_at).total_seconds(), error=event.code != EVENT_JOB_EXECUTED)
+        if event.code == EVENT_JOB_MISSED:
+            measurement.counters["missed"] = measurement.counters.get("missed", 0) + 1
+        pending.discard(event.job_id)
+        if not pending:
+            done.set()
+
+    scheduler.add_listener(listener, EVENT_JOB_SUBMITTED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED)
+    if not scheduler.running:
+        scheduler.start()
+    try:
+        for task in tasks:
+            scheduler.add_job(scheduler_module.run_task, "date", run_date=run_at, args=[str(task.id)],
+                              id=scheduler_module.task_job_id(task), replace_existing=True,
+                              executor=scheduler_module.DEVICE_EXECUTOR)
+        if not done.wait(timeout=timeout + 2):
+            measurement.counters["unfinished"] = len(pending)
+    finally:
+        scheduler.remove_listener(listener)
+        for job_id in list(pending):
+            try:
+                scheduler.remove_job(job_id)
+            except Exception:
+                pass
+
+    lags.sort()
+    measurement.counters["submit_lag_p50_ms"] = round(lags[len(lags) // 2] * 1000, 3) if lags else 0.0
+    measurement.counters["submit_lag_max_ms"] = round(lags[-1] * 1000, 3) if lags else 0.0
+    measurement.counters["device_requests"] = context.server.requests
+    return measurement.finish()
+
+
+def list_endpoints(context: Context, actions_per_controller: int = 100, tasks: int = 5000, automations: int = 500,
+                   rounds: int = 10, limit: int = 100) -> List[Measurement]:
+    """
+    The list endpoints against large collections, once unbounded and once with ?limit=<limit>.
+    """
+    from main import app
+
+    _reset(context)
+    controllers = seed_controllers(context, actions_per_controller=actions_per_controller)
+    Task.objects.insert([Task(type=TaskType.DAILY, smart_controller=controllers[number % len(controllers)],
+                              action=_actions(controllers[number % len(controllers)])[0],
+                              minute=number % 60, hour=number % 24, week_day=number % 7, month_day=1)
+                         for number in range(context.count(tasks))], load_bulk=False)
+    for number in range(context.count(automations)):
+        controller = controllers[number % len(controllers)]
+        actions = _actions(controller)
+        seed_automation(f"bench-list-{number}", [(controller, actions[0]), (controller, actions[1])],
+                        [(0, 1, TRIGGER)])
+
+    params = {"actions_per_controller": actions_per_controller, "tasks": tasks, "automations": automations,
+              "rounds": rounds}
+    measurements = []
+    for endpoint in ("/actions/", "/smartControllers/", "/tasks/", "/automations/"):
+        for query in ("", f"?limit={limit}"):
+            name = f"list_endpoints:{endpoint}{'' if not query else ' limit'}"
+            measurement = Measurement(name, {**params, "limit": limit if query else None})
+            asyncio.run(_http_load(app, [f"{endpoint}{query}"] * context.count(rounds), 1, measurement))
+            measurements.append(measurement.finish())
+    return measurements
+
+
+def deep_graph(context: Context, depth: int = 50, fan_out: int = 1, rounds: int = 10) -> Measurement:
+    """
+    A chain of <depth> steps where every step also fans out to <fan_out> - 1 leaves.
+    """
+    _reset(context)
+    controllers = seed_controllers(context)
+    steps, edges = [], []
+    previous_index = 0
+    for level in range(depth):
+        controller = controllers[level % len(controllers)]
+        steps.append((controller, _actions(controller)[0]))
+        chain_index = len(steps) - 1
+        if level:
+            edges.append((previous_index, chain_index, TRIGGER))
+        for leaf in range(fan_out - 1):
+            leaf_controller = controllers[(level + leaf + 1) % len(controllers)]
+            steps.append((leaf_controller, _actions(leaf_controller)[1]))
+            edges.append((chain_index, len(steps) - 1, TRIGGER))
+        previous_index = chain_index
+    automation = seed_automation("bench-deep", steps, edges)
+
+    measurement = Measurement("deep_graph", {"depth": depth, "fan_out": fan_out, "rounds": rounds})
+    _run_automation(context, str(automation.id), rounds, measurement)
+    return measurement.finish()
+
+
+def loop_graph(context: Context, iterations: int = 20, poll_interval: float = 0.01, rounds: int = 5) -> Measurement:
+    """
+    A by-value loop waiting for a ramping sensor to exceed a threshold it reaches after <iterations> reads.
+    """
+    _reset(context)
+    controllers = seed_controllers(context)
+    controller = controllers[0]
+    sensor = next((action for action in _sensors(controller) if action.name.endswith("-ramp")), None)
+    if sensor is None:
+        raise ValueError("loop_graph needs a controller sensor named 'ramp'")
+    condition = Condition(condition_type=ConditionType.BY_VALUE, value_type=ReturnValueType.NUMBER,
+                          operator=Operator.GREATER_EQUAL, value_number=float(iterations), is_loop=True)
+    automation = seed_automation("bench-loop", [(controller, sensor), (controller, _actions(controller)[0])],
+                                 [(0, 1, condition)])
+
+    measurement = Measurement("loop_graph", {"iterations": iterations, "poll_interval": poll_interval,
+                                             "rounds": rounds})
+    _run_automation(context, str(automation.id), rounds, measurement, poll_interval=poll_interval,
+                    first_response="0")
+    return measurement.finish()
+
+
+def _recorded_readings() -> int:
+    return sum(len(segment.values) for segment in SensorSegment.objects().only("values"))
+
+
+def sensor_history(context: Context, values: int = 2000, batch: int = 50, reads: int = 50,
+                   timeout: float = 30.0) -> List[Measurement]:
+    """
+    Pushes <values> sensor values through /sensors/push in batches of <batch>, then reads the history of every
+    sensor back, raw and at the resolution picked for the last day. A read returning fewer points than were pushed
+    counts as an error.
+    """
+    from main import app
+
+    _reset(context)
+    controllers = seed_controllers(context)
+    sensors = [(controller, sensor) for controller in controllers for sensor in _sensors(controller)]
+    items = [{"controller_id": str(controller.id), "action_id": str(sensor.id),
+              "value": round(context.rng.uniform(15.0, 30.0), 2)}
+             for controller, sensor in (context.rng.choice(sensors) for _ in range(context.count(values)))]
+    expected: Dict[Tuple[str, str], int] = {}
+    for item in items:
+        key = (item["controller_id"], item["action_id"])
+        expected[key] = expected.get(key, 0) + 1
+
+    params = {"values": values, "batch": batch, "reads": reads}
+    measurements = []
+
+    async def run():
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            push = Measurement("sensor_history:push", params)
+            for offset in range(0, len(items), batch):
+                started = time.perf_counter()
+                response = await client.post("/sensors/push", json={"items": items[offset:offset + batch]})
+                push.record(time.perf_counter() - started, error=not response.is_success)
+            push.counters["sensors"] = len(expected)
+            measurements.append(push.finish())
+
+            # Readings are recorded on worker threads, wait until the raw history has caught up
+            deadline = time.perf_counter() + timeout
+            while _recorded_readings() < len(items) and time.perf_counter() < deadline:
+                await asyncio.sleep(0.05)
+
+            keys = list(expected)
+            for name, resolution in (("raw", "raw"), ("rollup", None)):
+                measurement = Measurement(f"sensor_history:read {name}", params)
+                query = f"?resolution={resolution}" if resolution else ""
+                for number in range(context.count(reads)):
+                    controller_id, action_id = keys[number % len(keys)]
+                    started = time.perf_counter()
+                    response = await client.get(f"/sensors/{controller_id}/{action_id}/history{query}")
+                    elapsed = time.perf_counter() - started
+                    points = response.json()["points"] if response.is_success else []
+                    read = sum(point["count"] for point in points)
+                    measurement.record(elapsed, error=read != expected[(controller_id, action_id)])
+                measurements.append(measurement.finish())
+
+    asyncio.run(run())
+    return measurements
+
+
+def _run_automation(context: Context, automation_id: str, rounds: int, measurement: Measurement,
+                    first_response: str = "ok", **runner_options):
+    compiled = graph_cache.get(automation_id)
+    runner = AutomationRunner(automation=compiled, run_function=run_async, read_function=read_sensor_async,
+                              wait_function=wait_for_update_async, **runner_options)
+    root = compiled.nodes[compiled.roots[0]]
+    for _ in range(context.count(rounds)):
+        context.server.reset()
+        started = time.perf_counter()
+        state = executor.submit(runner.start(previous_step_response=first_response, node=root)).result()
+        measurement.record(time.perf_counter() - started, error=state.trace.status != "finished")
+        measurement.counters["device_requests"] = context.server.requests
+        measurement.counters["loop_iterations"] = sum(state.loop_iterations.values())
+        measurement.counters["dropped_spans"] = state.trace.dropped_spans
+
+
+SCENARIOS: Dict[str, Callable] = {
+    "dispatch": dispatch,
+    "actions_run": actions_run,
+    "scheduler_burst": scheduler_burst,
+    "list_endpoints": list_endpoints,
+    "deep_graph": deep_graph,
+    "loop_graph": loop_graph,
+    "sensor_history": sensor_history,
+}
@@ -8,7 +8,66 @@ class Settings(BaseSettings):
     MONGO_USERNAME: str
     MONGO_DATABASE: str
     DB_ADDRESS: str
+    MONGO_MAX_POOL_SIZE: int = 32
+    MONGO_MIN_POOL_SIZE: int = 0
+    MONGO_WAIT_QUEUE_TIMEOUT_MS: int = 5000
     LOG_LEVEL: str
+    ACTION_CONNECT_TIMEOUT: float = 3.0
+    ACTION_READ_TIMEOUT: float = 10.0
+    ACTION_MAX_IN_FLIGHT_PER_CONTROLLER: int = 4
+    AUTOMATION_LOOP_POLL_INTERVAL: float = 2.0
+    AUTOMATION_LOOP_MAX_DURATION: float = 600.0
+    AUTOMATION_MAX_PARALLEL_BRANCHES: int = 8
+    # Storage of new automations, "referenced" or "embedded"
+    AUTOMATION_STORAGE: str = "referenced"
+    AUTOMATION_TRACE_BUFFER_SIZE: int = 200
+    AUTOMATION_TRACE_MAX_SPANS: int = 500
+    # Also save finished run traces to MongoDB, kept for AUTOMATION_TRACE_RETENTION_DAYS
+    AUTOMATION_TRACE_PERSIST: bool = False
+    AUTOMATION_TRACE_RETENTION_DAYS: int = 7
+    DOCUMENT_CACHE_TTL: float = 60.0
+    SENSOR_CACHE_FRESHNESS: float = 1.0
+    # How long a value pushed by a controller replaces reading the device
+    SENSOR_PUSH_FRESHNESS: float = 30.0
+    SENSOR_PUSH_MAX_BATCH: int = 1000
+    SENSOR_HISTORY_RAW_RETENTION_DAYS: int = 7
+    SENSOR_HISTORY_MINUTE_RETENTION_DAYS: int = 30
+    SENSOR_HISTORY_HOUR_RETENTION_DAYS: int = 365
+    SENSOR_HISTORY_DAY_RETENTION_DAYS: int = 0
+    # "memory" or "mongo"
+    SCHEDULER_JOB_STORE: str = "memory"
+    SCHEDULER_THREAD_POOL_SIZE: int = 10
+    # Executor of the task jobs calling devices, "loop" runs them on the action executor loop, "threads" on a
+    # dedicated pool of SCHEDULER_DEVICE_POOL_SIZE threads
+    SCHEDULER_DEVICE_EXECUTOR: str = "loop"
+    SCHEDULER_DEVICE_POOL_SIZE: int = 20
+    # 0 leaves only ACTION_MAX_IN_FLIGHT_PER_CONTROLLER
+    SCHEDULER_MAX_JOBS_PER_CONTROLLER: int = 2
+    # Seconds a job may start late before it counts as missed, late runs of a job are merged when coalescing
+    SCHEDULER_MISFIRE_GRACE_TIME: int = 300
+    SCHEDULER_COALESCE: bool = True
+    WRITE_BUFFER_FLUSH_INTERVAL: float = 0.5
+    WRITE_BUFFER_MAX_PENDING: int = 500
+    RETRY_MAX_RETRIES: int = 5
+    RETRY_BASE_DELAY: float = 10.0
+    RETRY_MAX_DELAY: float = 300.0
+    # Seconds past its run time a scheduled task keeps being deferred while its controller is down
+    RETRY_MAX_DEFERRAL: float = 3600.0
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD: int = 5
+    CIRCUIT_BREAKER_RESET_TIMEOUT: float = 30.0
+    HEALTH_CHECK_INTERVAL: float = 30.0
+    HEALTH_CHECK_TIMEOUT: float = 2.0
+    HEALTH_CHECK_DOWN_AFTER: int = 2
+    ACTION_BATCH_MAX_PARALLEL: int = 16
+    # 0 keeps list endpoints returning everything unless the client passes a limit
+    PAGE_DEFAULT_LIMIT: int = 0
+    PAGE_MAX_LIMIT: int = 1000
+    EVENT_QUEUE_SIZE: int = 256
+    # Topics whose last state is replayed to new subscribers
+    EVENT_MAX_RETAINED: int = 10000
+    EVENT_KEEPALIVE_INTERVAL: float = 15.0
+    PROFILER_ENABLED: bool = False
+    PROFILER_QUERY_BUDGET: int = 20
 
     model_config = SettingsConfigDict(env_file=".env")
 
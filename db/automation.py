@@ -1,8 +1,9 @@
 from enum import Enum
 from typing import List
 
+from bson import ObjectId
 from mongoengine import EmbeddedDocumentField, EmbeddedDocument, StringField, EnumField, FloatField, BooleanField, \
-    ListField, ReferenceField
+    ListField, ReferenceField, IntField, ObjectIdField
 
 from db.base_model import MongoModel
 
@@ -40,6 +41,12 @@ class AutomationNode(MongoModel):
     action_id = StringField()
     location = EmbeddedDocumentField(Location)
 
+    meta = {
+        'indexes': [
+            'unique_key'
+        ]
+    }
+
 
 class Condition(EmbeddedDocument):
     condition_type = EnumField(ConditionType)
@@ -60,12 +67,44 @@ class GraphViewport(Location):
     zoom = FloatField()
 
 
+class GraphNode(EmbeddedDocument):
+    """
+    Node of an automation using embedded storage. Keeps the id the node had as an AutomationNode.
+    """
+    id = ObjectIdField(required=True, default=ObjectId)
+    unique_key = StringField()
+    smart_controller_id = StringField()
+    action_id = StringField()
+    location = EmbeddedDocumentField(Location)
+
+
+class GraphEdge(EmbeddedDocument):
+    id = ObjectIdField(required=True, default=ObjectId)
+    source_id = ObjectIdField(required=True)
+    target_id = ObjectIdField(required=True)
+    condition = EmbeddedDocumentField(Condition)
+
+
 class Automation(MongoModel):
     name = StringField(required=True, unique=True)
     nodes = ListField(ReferenceField(AutomationNode))
     edges = ListField(ReferenceField(ConditionEdge))
     viewport = EmbeddedDocumentField(GraphViewport, default=GraphViewport(x=float(0.0), y=float(0.0), zoom=float(1.0)))
     is_active = BooleanField(default=True)
+    # Run sibling edges one after the other instead of concurrently
+    is_sequential = BooleanField(default=False)
+    # Cap on concurrent device calls of one run, 0 falls back to the configured default
+    max_parallel_branches = IntField(min_value=0, default=0)
+    # Embedded automations keep their graph in graph_nodes/graph_edges instead of nodes/edges, see db.automation_graph
+    is_embedded = BooleanField(default=False)
+    graph_nodes = ListField(EmbeddedDocumentField(GraphNode))
+    graph_edges = ListField(EmbeddedDocumentField(GraphEdge))
+
+    meta = {
+        'indexes': [
+            ('is_active', 'id')
+        ]
+    }
 
     def add_node(self, node):
         if node not in self.nodes:
@@ -0,0 +1,185 @@
+import argparse
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Union
+
+from bson import ObjectId
+
+from db.automation import Automation, AutomationNode, ConditionEdge, GraphEdge, GraphNode
+from db.prefetch import fetch_by_ids, ref_id
+
+Node = Union[GraphNode, AutomationNode]
+
+
+@dataclass
+class Graph:
+    """
+    Nodes and edges of one automation, the same shape for both storage modes.
+    """
+    nodes: List[Node] = field(default_factory=list)
+    edges: List[GraphEdge] = field(default_factory=list)
+    # Also holds edge endpoints that are missing from the node list of a referenced automation
+    nodes_by_id: Dict[ObjectId, Node] = field(default_factory=dict)
+
+    def node(self, node_id: ObjectId) -> Optional[Node]:
+        return self.nodes_by_id.get(node_id)
+
+
+def _graph_edge(edge: ConditionEdge) -> GraphEdge:
+    return GraphEdge(id=edge.id, source_id=ref_id(edge.source), target_id=ref_id(edge.target),
+                     condition=edge.condition)
+
+
+def load_graphs(automations: List[Automation], only: Iterable[str] = ()) -> Dict[ObjectId, Graph]:
+    """
+    Graphs of automations loaded with no_dereference(). Embedded automations need no query, the nodes and edges of
+    all referenced automations are read with one query per collection.
+    """
+    graphs = {automation.id: Graph(nodes=list(automation.graph_nodes), edges=list(automation.graph_edges),
+                                   nodes_by_id={node.id: node for node in automation.graph_nodes})
+              for automation in automations if automation.is_embedded}
+
+    referenced = [automation for automation in automations if not automation.is_embedded]
+    edges = fetch_by_ids(ConditionEdge, (ref_id(edge) for automation in referenced for edge in automation.edges))
+    node_ids = {ref_id(node) for automation in referenced for node in automation.nodes}
+    node_ids.update(ref_id(endpoint) for edge in edges.values() for endpoint in (edge.source, edge.target))
+    nodes = fetch_by_ids(AutomationNode, node_ids, only=only)
+    for automation in referenced:
+        graph_edges = [_graph_edge(edges[ref_id(edge)]) for edge in automation.edges if ref_id(edge) in edges]
+        graph_node_ids = {ref_id(node) for node in automation.nodes}
+        graph_node_ids.update(node_id for edge in graph_edges for node_id in (edge.source_id, edge.target_id))
+        graphs[automation.id] = Graph(nodes=[nodes[ref_id(node)] for node in automation.nodes
+                                             if ref_id(node) in nodes],
+                                      edges=graph_edges,
+                                      nodes_by_id={node_id: nodes[node_id] for node_id in graph_node_ids
+                                                   if node_id in nodes})
+    return graphs
+
+
+def load_graph(automation: Automation, only: Iterable[str] = ()) -> Graph:
+    return load_graphs([automation], only=only)[automation.id]
+
+
+def find_node(automation: Automation, node_id: Optional[str] = None,
+              unique_key: Optional[str] = None) -> Optional[Node]:
+    if node_id is not None and not ObjectId.is_valid(node_id):
+        return None
+    filters = {"id": ObjectId(node_id)} if node_id is not None else {"unique_key": unique_key}
+    if automation.is_embedded:
+        return next((node for node in automation.graph_nodes
+                     if all(getattr(node, name) == value for name, value in filters.items())), None)
+
+    node = AutomationNode.objects(**filters).first()
+    if node is None or node.id not in {ref_id(reference) for reference in automation.nodes}:
+        return None
+    return node
+
+
+def find_edge(automation: Automation, edge_id: str) -> Optional[GraphEdge]:
+    if not ObjectId.is_valid(edge_id):
+        return None
+    if automation.is_embedded:
+        return next((edge for edge in automation.graph_edges if edge.id == ObjectId(edge_id)), None)
+
+    edge = ConditionEdge.objects(id=edge_id).no_dereference().first()
+    if edge is None or edge.id not in {ref_id(reference) for reference in automation.edges}:
+        return None
+    return _graph_edge(edge)
+
+
+def add_node(automation: Automation, node: GraphNode):
+    if automation.is_embedded:
+        Automation.objects(id=automation.id).update_one(push__graph_nodes=node)
+        return
+    AutomationNode(id=node.id, unique_key=node.unique_key, smart_controller_id=node.smart_controller_id,
+                   action_id=node.action_id, location=node.location).save()
+    Automation.objects(id=automation.id).update_one(add_to_set__nodes=node.id)
+
+
+def save_node(automation: Automation, node: Node):
+    if automation.is_embedded:
+        Automation.objects(id=automation.id, graph_nodes__id=node.id).update_one(set__graph_nodes__S=node)
+        return
+    AutomationNode.objects(id=node.id).update_one(set__smart_controller_id=node.smart_controller_id,
+                                                  set__action_id=node.action_id, set__location=node.location)
+
+
+def remove_node(automation: Automation, node_id: ObjectId):
+    if automation.is_embedded:
+        Automation.objects(id=automation.id).update_one(pull__graph_nodes__id=node_id)
+        return
+    Automation.objects(id=automation.id).update_one(pull__nodes=node_id)
+    AutomationNode.objects(id=node_id).delete()
+
+
+def add_edge(automation: Automation, edge: GraphEdge):
+    if automation.is_embedded:
+        Automation.objects(id=automation.id).update_one(push__graph_edges=edge)
+        return
+    ConditionEdge(id=edge.id, source=edge.source_id, target=edge.target_id, condition=edge.condition).save()
+    Automation.objects(id=automation.id).update_one(push__edges=edge.id)
+
+
+def save_edge(automation: Automation, edge: GraphEdge):
+    if automation.is_embedded:
+        Automation.objects(id=automation.id, graph_edges__id=edge.id).update_one(set__graph_edges__S=edge)
+        return
+    ConditionEdge.objects(id=edge.id).update_one(set__source=edge.source_id, set__target=edge.target_id,
+                                                 set__condition=edge.condition)
+
+
+def remove_edge(automation: Automation, edge_id: ObjectId):
+    if automation.is_embedded:
+        Automation.objects(id=automation.id).update_one(pull__graph_edges__id=edge_id)
+        return
+    Automation.objects(id=automation.id).update_one(pull__edges=edge_id)
+    ConditionEdge.objects(id=edge_id).delete()
+
+
+def embed(automation: Automation, delete_references: bool = False) -> bool:
+    """
+    Moves the graph of a referenced automation into its document, node and edge ids are kept.
+    Returns False when the automation changed while it was being copied, it is then left as it was.
+    """
+    graph = load_graph(automation)
+    nodes = [GraphNode(id=node.id, unique_key=node.unique_key, smart_controller_id=node.smart_controller_id,
+                       action_id=node.action_id, location=node.location) for node in graph.nodes]
+    node_refs = [ref_id(node) for node in automation.nodes]
+    edge_refs = [ref_id(edge) for edge in automation.edges]
+
+    updates = {"set__is_embedded": True, "set__graph_nodes": nodes, "set__graph_edges": graph.edges}
+    if delete_references:
+        updates.update(unset__nodes=True, unset__edges=True)
+    # The update only matches while the reference lists are still the ones that were copied, empty lists may be
+    # stored or missing
+    unchanged = {"$and": [{name: refs} if refs else {"$or": [{name: None}, {name: {"$size": 0}}]}
+                          for name, refs in (("nodes", node_refs), ("edges", edge_refs))]}
+    updated = Automation.objects(id=automation.id, is_embedded__ne=True, __raw__=unchanged).update_one(**updates)
+    if updated and delete_references:
+        AutomationNode.objects(id__in=node_refs).delete()
+        ConditionEdge.objects(id__in=edge_refs).delete()
+    return bool(updated)
+
+
+def migrate(delete_references: bool = False) -> int:
+    migrated = 0
+    for automation in Automation.objects(is_embedded__ne=True).no_dereference():
+        if embed(automation, delete_references=delete_references):
+            migrated += 1
+        else:
+            logging.warning(f"Automation {automation.name} changed during migration, run the migration again")
+    logging.info(f"Migrated {migrated} automations to embedded storage")
+    return migrated
+
+
+if __name__ == "__main__":
+    from db.database import connect_and_init_db
+
+    parser = argparse.ArgumentParser(description="Move the nodes and edges of automations into their documents")
+    parser.add_argument("--delete-references", action="store_true",
+                        help="Delete the migrated AutomationNode and ConditionEdge documents")
+    args = parser.parse_args()
+
+    asyncio.run(connect_and_init_db())
+    print(f"Migrated {migrate(delete_references=args.delete_references)} automations")
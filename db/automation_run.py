@@ -0,0 +1,28 @@
+from mongoengine import StringField, DateTimeField, FloatField, IntField, ListField, DictField
+
+from db.base_model import MongoModel
+
+
+class AutomationRunTrace(MongoModel):
+    """
+    Persisted execution trace of one automation run, see tools.automation_runner.tracing.
+    """
+    run_id = StringField(required=True)
+    automation_id = StringField(required=True)
+    automation_name = StringField()
+    status = StringField()
+    started_at = DateTimeField()
+    finished_at = DateTimeField()
+    duration_ms = FloatField()
+    spans = ListField(DictField())
+    dropped_spans = IntField(default=0)
+    expires_at = DateTimeField()
+
+    meta = {
+        'collection': 'automation_runs',
+        'indexes': [
+            {'fields': ['run_id'], 'unique': True},
+            ('automation_id', '-started_at'),
+            {'fields': ['expires_at'], 'expireAfterSeconds': 0}
+        ]
+    }
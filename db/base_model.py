@@ -8,5 +8,7 @@ class MongoModel(Document):
 
     meta = {
         'allow_inheritance': True,
-        'abstract': True
+        'abstract': True,
+        # Indexes are created once at startup by db.indexes.ensure_indexes
+        'auto_create_index': False
     }
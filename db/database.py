@@ -2,13 +2,18 @@ from mongoengine import connect
 import logging
 
 from config.settings import settings
+from tools.metrics import MongoCommandMetrics
 
 
 async def connect_and_init_db():
     try:
         print(f"mongodb://{settings.MONGO_USERNAME}:{settings.MONGO_PASSWORD}@{settings.DB_ADDRESS}/{settings.MONGO_DATABASE}?authSource=admin")
         connect(
-            host=f"mongodb://{settings.MONGO_USERNAME}:{settings.MONGO_PASSWORD}@{settings.DB_ADDRESS}/{settings.MONGO_DATABASE}?authSource=admin")
+            host=f"mongodb://{settings.MONGO_USERNAME}:{settings.MONGO_PASSWORD}@{settings.DB_ADDRESS}/{settings.MONGO_DATABASE}?authSource=admin",
+            maxPoolSize=settings.MONGO_MAX_POOL_SIZE,
+            minPoolSize=settings.MONGO_MIN_POOL_SIZE,
+            waitQueueTimeoutMS=settings.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            event_listeners=[MongoCommandMetrics()])
         logging.info('Connected to mongo.')
     except Exception as e:
         logging.exception(f'Could not connect to mongo: {e}')
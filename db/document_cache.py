@@ -0,0 +1,60 @@
+import threading
+import time
+from typing import Dict, Generic, Iterable, Optional, Tuple, Type, TypeVar
+
+from bson import ObjectId
+
+from config.settings import settings
+from db.base_model import MongoModel
+from db.models import Action, SmartController
+
+T = TypeVar("T", bound=MongoModel)
+
+
+class DocumentCache(Generic[T]):
+    """
+    Read-through cache of documents by id. Entries expire after <ttl> seconds or when invalidated.
+    """
+
+    def __init__(self, model: Type[T], ttl: float):
+        self.model = model
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[float, T]] = {}
+
+    def get(self, document_id: str) -> Optional[T]:
+        return self.get_many([document_id]).get(document_id)
+
+    def get_many(self, document_ids: Iterable[str]) -> Dict[str, T]:
+        now = time.monotonic()
+        found: Dict[str, T] = {}
+        missing = set()
+        with self._lock:
+            for document_id in document_ids:
+                entry = self._entries.get(document_id)
+                if entry is not None and entry[0] > now:
+                    found[document_id] = entry[1]
+                elif ObjectId.is_valid(document_id):
+                    missing.add(document_id)
+
+        if missing:
+            documents = self.model.objects(id__in=[ObjectId(document_id) for document_id in missing])
+            with self._lock:
+                for document in documents:
+                    document_id = str(document.id)
+                    self._entries[document_id] = (now + self.ttl, document)
+                    found[document_id] = document
+        return found
+
+    def invalidate(self, document_id: str):
+        with self._lock:
+            self._entries.pop(document_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+smart_controller_cache: DocumentCache[SmartController] = DocumentCache(SmartController,
+                                                                       ttl=settings.DOCUMENT_CACHE_TTL)
+action_cache: DocumentCache[Action] = DocumentCache(Action, ttl=settings.DOCUMENT_CACHE_TTL)
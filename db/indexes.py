@@ -0,0 +1,53 @@
+import asyncio
+import logging
+from typing import Dict, List, Type
+
+from db.automation import Automation, AutomationNode, ConditionEdge
+from db.automation_run import AutomationRunTrace
+from db.base_model import MongoModel
+from db.models import Action, SmartController, Task
+from db.scheduled_task import ScheduledTask
+from db.sensor_history import SensorRollup, SensorSegment
+
+MODELS: List[Type[MongoModel]] = [Action, SmartController, Task, ScheduledTask, Automation, AutomationNode,
+                                  ConditionEdge, SensorSegment, SensorRollup, AutomationRunTrace]
+
+
+def ensure_indexes():
+    """
+    Creates the indexes declared in each model's meta. Existing indexes are left untouched so this is safe to run
+    on every startup.
+    """
+    for model in MODELS:
+        try:
+            model.ensure_indexes()
+        except Exception as e:
+            logging.error(f"Could not create indexes of {model._get_collection_name()}: {e}")
+    logging.info(f"Ensured indexes of {len(MODELS)} collections")
+
+
+def index_stats() -> Dict[str, List[dict]]:
+    stats = {}
+    for model in MODELS:
+        collection = model._get_collection()
+        stats[collection.name] = [
+            {"name": index["name"], "key": dict(index["key"]), "ops": index["accesses"]["ops"],
+             "since": index["accesses"]["since"]}
+            for index in collection.aggregate([{"$indexStats": {}}])
+        ]
+    return stats
+
+
+def print_index_stats():
+    for collection, indexes in index_stats().items():
+        print(collection)
+        for index in sorted(indexes, key=lambda index: index["ops"]):
+            # Indexes that stay at 0 ops are unused, collections without a used secondary index are being scanned
+            print(f"  {index['ops']:>10}  {index['name']:<50} since {index['since']:%Y-%m-%d %H:%M}")
+
+
+if __name__ == "__main__":
+    from db.database import connect_and_init_db
+
+    asyncio.run(connect_and_init_db())
+    print_index_stats()
@@ -12,7 +12,11 @@ class Action(MongoModel):
     description = StringField()
     is_sensor = BooleanField(default=False)
     meta = {
-        'collection': 'actions'
+        'collection': 'actions',
+        'indexes': [
+            ('is_sensor', 'id'),
+            'opposite_action_id'
+        ]
     }
 
 
@@ -29,7 +33,10 @@ class SmartController(MongoModel):
     scheduling = ListField()
 
     meta = {
-        'collection': 'smart_controllers'
+        'collection': 'smart_controllers',
+        'indexes': [
+            ('actions', 'id')
+        ]
     }
 
 
@@ -42,3 +49,10 @@ class Task(MongoModel):
     week_day = IntField(min_value=0, max_value=6)
     month_day = IntField(min_value=1, max_value=31)
     job_id = StringField(required=False, default="")
+
+    meta = {
+        'indexes': [
+            ('smart_controller', 'id'),
+            ('type', 'id')
+        ]
+    }
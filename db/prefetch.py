@@ -0,0 +1,29 @@
+from typing import Dict, Iterable, Optional, Type, TypeVar
+
+from bson import ObjectId
+
+from db.base_model import MongoModel
+
+T = TypeVar("T", bound=MongoModel)
+
+
+def ref_id(reference) -> Optional[ObjectId]:
+    """
+    Id of a reference field value, whether it is still a DBRef/ObjectId or an already dereferenced document.
+    """
+    if reference is None or isinstance(reference, ObjectId):
+        return reference
+    return reference.id
+
+
+def fetch_by_ids(model: Type[T], ids: Iterable[Optional[ObjectId]], only: Iterable[str] = ()) -> Dict[ObjectId, T]:
+    """
+    Loads all the referenced documents of one collection with a single $in query.
+    """
+    ids = {document_id for document_id in ids if document_id is not None}
+    if not ids:
+        return {}
+    query = model.objects(id__in=list(ids)).no_dereference()
+    if only:
+        query = query.only(*only)
+    return {document.id: document for document in query}
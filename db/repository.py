@@ -0,0 +1,73 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Generic, List, Optional, Type, TypeVar
+
+from bson import ObjectId
+
+from config.settings import settings
+from db.automation import Automation
+from db.base_model import MongoModel
+from db.models import Action, SmartController, Task
+from db.scheduled_task import ScheduledTask
+
+T = TypeVar("T", bound=MongoModel)
+R = TypeVar("R")
+
+# pymongo is blocking, async code hands every database call to this pool instead of running it on the event loop.
+# It is sized to the connection pool so a waiting thread always has a connection to wait for.
+_executor = ThreadPoolExecutor(max_workers=settings.MONGO_MAX_POOL_SIZE, thread_name_prefix="mongo")
+
+
+async def run_in_db(function: Callable[..., R], *args, **kwargs) -> R:
+    # The caller's context goes along, so the queries are attributed to the endpoint that made them
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        _executor, functools.partial(context.run, function, *args, **kwargs))
+
+
+class Repository(Generic[T]):
+    """
+    Async access to one collection. Queries run on the database thread pool, documents are fully loaded there so
+    nothing touches the database once they are back on the event loop. References are only dereferenced when asked.
+    """
+
+    def __init__(self, model: Type[T]):
+        self.model = model
+
+    async def get(self, document_id: str, dereference: bool = False) -> Optional[T]:
+        if not ObjectId.is_valid(document_id):
+            return None
+        return await self.first(dereference=dereference, id=document_id)
+
+    async def first(self, dereference: bool = False, **filters) -> Optional[T]:
+        documents = await run_in_db(self._load, self.model.objects(**filters).limit(1), dereference)
+        return documents[0] if documents else None
+
+    async def find(self, dereference: bool = False, **filters) -> List[T]:
+        return await run_in_db(self._load, self.model.objects(**filters), dereference)
+
+    async def save(self, document: T) -> T:
+        return await run_in_db(document.save)
+
+    async def update(self, document: T, **updates) -> int:
+        """
+        Atomic update of one document with mongoengine update operators, e.g. push__nodes=node.
+        """
+        return await run_in_db(self.model.objects(id=document.id).update_one, **updates)
+
+    async def delete(self, document: T):
+        await run_in_db(document.delete)
+
+    @staticmethod
+    def _load(query, dereference: bool) -> list:
+        # select_related resolves every reference up front, no_dereference documents never resolve them lazily
+        return list(query.select_related()) if dereference else list(query.no_dereference())
+
+
+actions: Repository[Action] = Repository(Action)
+smart_controllers: Repository[SmartController] = Repository(SmartController)
+tasks: Repository[Task] = Repository(Task)
+scheduled_tasks: Repository[ScheduledTask] = Repository(ScheduledTask)
+automations: Repository[Automation] = Repository(Automation)
@@ -1,5 +1,5 @@
 
-from mongoengine import ReferenceField, IntField, BooleanField, StringField
+from mongoengine import ReferenceField, IntField, BooleanField, StringField, FloatField
 
 from db.base_model import MongoModel
 from db.models import SmartController, Action
@@ -12,3 +12,12 @@ class ScheduledTask(MongoModel):
     is_active = BooleanField(default=True)
     retires_count = IntField(required=False, default=0)
     job_id = StringField(required=False, default="")
+    # Per task overrides of the default retry policy
+    max_retries = IntField(required=False, null=True, min_value=0)
+    retry_base_delay = FloatField(required=False, null=True, min_value=0)
+
+    meta = {
+        'indexes': [
+            ('is_active', 'id')
+        ]
+    }
@@ -0,0 +1,56 @@
+from enum import Enum
+
+from mongoengine import StringField, EnumField, DateTimeField, IntField, FloatField, ListField
+
+from db.base_model import MongoModel
+
+
+class Resolution(str, Enum):
+    RAW = "raw"
+    MINUTE = "1m"
+    HOUR = "1h"
+    DAY = "1d"
+
+
+class SensorSegment(MongoModel):
+    """
+    Raw readings of one sensor for one hour, stored as parallel arrays.
+    """
+    smart_controller_id = StringField(required=True)
+    action_id = StringField(required=True)
+    bucket_start = DateTimeField(required=True)
+    timestamps = ListField(DateTimeField())
+    values = ListField(FloatField())
+    expires_at = DateTimeField()
+
+    meta = {
+        'collection': 'sensor_segments',
+        'indexes': [
+            {'fields': ['smart_controller_id', 'action_id', 'bucket_start'], 'unique': True},
+            {'fields': ['expires_at'], 'expireAfterSeconds': 0}
+        ]
+    }
+
+
+class SensorRollup(MongoModel):
+    smart_controller_id = StringField(required=True)
+    action_id = StringField(required=True)
+    resolution = EnumField(Resolution, required=True)
+    bucket_start = DateTimeField(required=True)
+    count = IntField(default=0)
+    total = FloatField(default=0.0)
+    min = FloatField()
+    max = FloatField()
+    expires_at = DateTimeField()
+
+    meta = {
+        'collection': 'sensor_rollups',
+        'indexes': [
+            {'fields': ['smart_controller_id', 'action_id', 'resolution', 'bucket_start'], 'unique': True},
+            {'fields': ['expires_at'], 'expireAfterSeconds': 0}
+        ]
+    }
+
+    @property
+    def avg(self) -> float:
+        return self.total / self.count if self.count else 0.0
@@ -0,0 +1,166 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from config.settings import settings
+from db.base_model import MongoModel
+from tools.metrics.metrics import write_buffer_batch_size, write_buffer_flush_seconds, write_buffer_requeued
+
+PendingKey = Tuple[Type[MongoModel], Any]
+
+
+@dataclass
+class WriteBufferStats:
+    flushes: int = 0
+    documents_written: int = 0
+    failed_flushes: int = 0
+    last_batch_size: int = 0
+    max_batch_size: int = 0
+    last_flush_seconds: float = 0.0
+    max_flush_seconds: float = 0.0
+    total_flush_seconds: float = 0.0
+    requeued: int = 0
+
+    def observe(self, batch_size: int, seconds: float):
+        self.flushes += 1
+        self.documents_written += batch_size
+        self.last_batch_size = batch_size
+        self.max_batch_size = max(self.max_batch_size, batch_size)
+        self.last_flush_seconds = seconds
+        self.max_flush_seconds = max(self.max_flush_seconds, seconds)
+        self.total_flush_seconds += seconds
+        write_buffer_batch_size.observe(batch_size)
+        write_buffer_flush_seconds.observe(seconds)
+
+
+class WriteBuffer:
+    """
+    Write-behind buffer of partial document updates. Updates to the same document are merged ($set values are
+    overwritten, $inc values are summed) and flushed in one bulk write per collection on a short interval.
+    """
+
+    def __init__(self, flush_interval: float, max_pending: int):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.stats = WriteBufferStats()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending: Dict[PendingKey, Dict[str, Dict[str, Any]]] = {}
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def set(self, document: MongoModel, **fields):
+        for name, value in fields.items():
+            setattr(document, name, value)
+        self._add(document, "$set", fields, merge=lambda old, new: new)
+
+    def inc(self, document: MongoModel, **fields):
+        for name, value in fields.items():
+            setattr(document, name, (getattr(document, name) or 0) + value)
+        self._add(document, "$inc", fields, merge=lambda old, new: old + new)
+
+    def _add(self, document: MongoModel, operator: str, fields: Dict[str, Any], merge):
+        if self._thread is None:
+            self.start()
+        with self._lock:
+            update = self._pending.setdefault((type(document), document.pk), {})
+            values = update.setdefault(operator, {})
+            for name, value in fields.items():
+                db_field = document._fields[name].db_field
+                values[db_field] = merge(values[db_field], value) if db_field in values else value
+            if len(self._pending) >= self.max_pending:
+                self._wakeup.set()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+
+            by_model: Dict[Type[MongoModel], List[PendingKey]] = defaultdict(list)
+            for key in pending:
+                by_model[key[0]].append(key)
+
+            started = time.perf_counter()
+            failed: Dict[PendingKey, Dict[str, Dict[str, Any]]] = {}
+            for model, keys in by_model.items():
+                try:
+                    model._get_collection().bulk_write([UpdateOne({"_id": key[1]}, pending[key]) for key in keys],
+                                                       ordered=False)
+                except BulkWriteError as e:
+                    # The other updates of an unordered bulk write were applied, only the failed ones are retried
+                    failed.update((keys[error["index"]], pending[keys[error["index"]]])
+                                  for error in e.details.get("writeErrors", []))
+                    logging.error(f"Write buffer flush of {model._get_collection_name()} failed: {e}")
+                except Exception as e:
+                    failed.update((key, pending[key]) for key in keys)
+                    logging.error(f"Write buffer flush of {model._get_collection_name()} failed: {e}")
+            elapsed = time.perf_counter() - started
+
+            if failed:
+                self.stats.failed_flushes += 1
+                self.stats.requeued += len(failed)
+                write_buffer_requeued.inc(len(failed))
+                self._requeue(failed)
+                logging.warning(f"Write buffer kept {len(failed)} documents for the next flush")
+            self.stats.observe(batch_size=len(pending) - len(failed), seconds=elapsed)
+            logging.debug(f"Write buffer flushed {len(pending) - len(failed)} documents in {elapsed * 1000:.1f}ms")
+
+    def _requeue(self, failed: Dict[PendingKey, Dict[str, Dict[str, Any]]]):
+        # Updates added since the flush started are newer, their $set values win and their $inc values add up
+        with self._lock:
+            for key, update in failed.items():
+                newer = self._pending.get(key)
+                if newer is None:
+                    self._pending[key] = update
+                    continue
+                for operator, values in update.items():
+                    newer_values = newer.setdefault(operator, {})
+                    for name, value in values.items():
+                        if operator == "$inc":
+                            newer_values[name] = newer_values.get(name, 0) + value
+                        else:
+                            newer_values.setdefault(name, value)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._flush_loop, name="write-buffer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _flush_loop(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+
+write_buffer = WriteBuffer(flush_interval=settings.WRITE_BUFFER_FLUSH_INTERVAL,
+                           max_pending=settings.WRITE_BUFFER_MAX_PENDING)
+
+
+def startup_event():
+    write_buffer.start()
+
+
+def shutdown_event():
+    write_buffer.stop()
+    logging.info(f"Write buffer stopped: {write_buffer.stats}")
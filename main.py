@@ -4,9 +4,15 @@ from fastapi.openapi.utils import get_openapi
 from fastapi.middleware.cors import CORSMiddleware
 
 from config.logging import setup_logging
+from config.settings import settings
+from db import write_buffer
 from db.database import connect_and_init_db
-from api.v1 import actions, smart_controllers, tasks, automations
+from db.indexes import ensure_indexes
+from api.v1 import actions, smart_controllers, tasks, automations, sensors, events, metrics
 from tools.scheduler import scheduler as scheduler
+from tools import action_executor, health_monitor
+from tools.metrics import MetricsMiddleware, ProfilerMiddleware
+from tools.automation_runner.trigger_index import build_trigger_index
 
 setup_logging()
 
@@ -14,17 +20,25 @@ app = FastAPI()
 
 
 app.add_event_handler("startup", connect_and_init_db)
+app.add_event_handler("startup", ensure_indexes)
+app.add_event_handler("startup", build_trigger_index)
+app.add_event_handler("startup", action_executor.startup_event)
+app.add_event_handler("startup", write_buffer.startup_event)
+app.add_event_handler("startup", health_monitor.startup_event)
 app.add_event_handler("startup", scheduler.startup_event)
 app.add_event_handler("shutdown", scheduler.shutdown_event)
+app.add_event_handler("shutdown", health_monitor.shutdown_event)
+app.add_event_handler("shutdown", action_executor.shutdown_event)
+app.add_event_handler("shutdown", write_buffer.shutdown_event)
 
 
 app.include_router(actions.router, prefix="/actions")
 app.include_router(smart_controllers.router, prefix="/smartControllers")
 app.include_router(tasks.router, prefix="/tasks")
 app.include_router(automations.router, prefix="/automations")
-
-# Start the scheduler
-scheduler.scheduler.start()
+app.include_router(sensors.router, prefix="/sensors")
+app.include_router(events.router, prefix="/events")
+app.include_router(metrics.router)
 
 
 def custom_openapi():
@@ -49,7 +63,11 @@ app.add_middleware(
    allow_credentials=True,
    allow_methods=["*"],
    allow_headers=["*"],
+   expose_headers=["Age", "X-Sensor-Cache", "X-Next-Cursor"],
 )
+if settings.PROFILER_ENABLED:
+    app.add_middleware(ProfilerMiddleware, query_budget=settings.PROFILER_QUERY_BUDGET)
+app.add_middleware(MetricsMiddleware)
 
 
 app.openapi = custom_openapi
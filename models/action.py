@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import List, Optional
 
 from pydantic import BaseModel, Field
 
@@ -28,3 +28,29 @@ class ActionResponse(Base):
     opposite_action_id: str = Field()
     description: str = Field()
     is_sensor: bool = Field(default=None)
+
+
+class ActionRunItem(BaseModel):
+    controller_id: str = Field()
+    action_id: str = Field()
+
+
+class ActionBatchRunRequest(BaseModel):
+    items: List[ActionRunItem] = Field()
+    max_parallel: Optional[int] = Field(default=None, ge=1)
+
+
+class ActionRunResult(BaseModel):
+    controller_id: str = Field()
+    action_id: str = Field()
+    # ok, failed, not_found or unavailable
+    status: str = Field()
+    status_code: Optional[int] = Field(default=None)
+    value: Optional[float] = Field(default=None)
+    detail: Optional[str] = Field(default=None)
+    elapsed_ms: float = Field(default=0.0)
+
+
+class ActionBatchRunResponse(BaseModel):
+    results: List[ActionRunResult] = Field()
+    elapsed_ms: float = Field()
@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 from datetime import datetime
 
 from pydantic import BaseModel, Field
@@ -99,6 +99,9 @@ class AutomationRequest(BaseModel):
 class AutomationUpdateRequest(BaseModel):
     name: str = Field(default='')
     is_active: bool = Field()
+    # Left unchanged when omitted
+    is_sequential: Optional[bool] = Field(default=None)
+    max_parallel_branches: Optional[int] = Field(default=None, ge=0)
     viewport: GraphViewport = Field()
 
 
@@ -108,9 +111,39 @@ class AutomationResponse(Base):
     nodes: List[AutomationNodeResponse] = Field()
     edges: List[AutomationEdgeResponse] = Field()
     is_active: bool = Field()
+    is_sequential: bool = Field(default=False)
+    max_parallel_branches: int = Field(default=0)
     viewport: GraphViewport = Field(default=GraphViewport(x=0.0, y=0.0, zoom=0.0))
 
     class Config:
         json_encoders = {
             datetime: lambda v: v.isoformat()
         }
+
+
+class AutomationRunSpanResponse(BaseModel):
+    span_id: str = Field()
+    parent_id: Optional[str] = Field(default=None)
+    kind: str = Field()
+    name: str = Field()
+    started_at: datetime = Field()
+    duration_ms: Optional[float] = Field(default=None)
+    attributes: Dict[str, Any] = Field(default_factory=dict)
+
+    class Config:
+        from_attributes = True
+
+
+class AutomationRunResponse(BaseModel):
+    run_id: str = Field()
+    automation_id: str = Field()
+    automation_name: Optional[str] = Field(default=None)
+    status: str = Field()
+    started_at: datetime = Field()
+    finished_at: Optional[datetime] = Field(default=None)
+    duration_ms: Optional[float] = Field(default=None)
+    spans: List[AutomationRunSpanResponse] = Field(default_factory=list)
+    dropped_spans: int = Field(default=0)
+
+    class Config:
+        from_attributes = True
@@ -0,0 +1,50 @@
+from datetime import datetime
+from typing import List, Union
+
+from pydantic import BaseModel, Field
+
+from db.sensor_history import Resolution
+
+
+class SensorHistoryPoint(BaseModel):
+    time: datetime = Field()
+    min: float = Field()
+    max: float = Field()
+    avg: float = Field()
+    count: int = Field()
+
+    class Config:
+        from_attributes = True
+
+
+class SensorHistoryResponse(BaseModel):
+    smart_controller_id: str = Field()
+    action_id: str = Field()
+    resolution: Resolution = Field()
+    points: List[SensorHistoryPoint] = Field()
+
+
+class SensorPushItem(BaseModel):
+    controller_id: str = Field()
+    action_id: str = Field()
+    # The text the controller answers the action with, numbers and booleans are accepted as well
+    value: Union[bool, float, str] = Field()
+
+    @property
+    def text(self) -> str:
+        return str(self.value).lower() if isinstance(self.value, bool) else str(self.value)
+
+
+class SensorPushRequest(BaseModel):
+    items: List[SensorPushItem] = Field()
+
+
+class SensorPushRejection(BaseModel):
+    index: int = Field()
+    detail: str = Field()
+
+
+class SensorPushResponse(BaseModel):
+    accepted: int = Field()
+    rejected: List[SensorPushRejection] = Field(default=[])
+    automations_started: int = Field(default=0)
@@ -1,3 +1,4 @@
+from datetime import datetime
 from typing import List, Optional
 
 from pydantic import BaseModel, Field
@@ -23,3 +24,16 @@ class SmartControllerResponse(Base):
     name: str
     address: str
     actions: List[ActionResponse]
+
+
+class SmartControllerHealthResponse(BaseModel):
+    id: str
+    name: str
+    address: str
+    is_alive: Optional[bool] = Field(default=None)
+    consecutive_failures: int = Field(default=0)
+    last_checked: Optional[datetime] = Field(default=None)
+    last_error: Optional[str] = Field(default=None)
+    latency_p50_ms: Optional[float] = Field(default=None)
+    latency_p90_ms: Optional[float] = Field(default=None)
+    latency_p99_ms: Optional[float] = Field(default=None)
@@ -0,0 +1,23 @@
+import os
+
+import pytest
+
+# The application settings are read on import, the environment must be ready first
+for name, value in {"MONGO_USERNAME": "test", "MONGO_PASSWORD": "test", "MONGO_DATABASE": "smart_home_test",
+                    "DB_ADDRESS": "localhost:27017", "LOG_LEVEL": "WARNING"}.items():
+    os.environ.setdefault(name, value)
+
+
+@pytest.fixture
+def database():
+    """
+    Fresh in-process mongomock database per test.
+    """
+    import mongomock
+    from mongoengine import connect, disconnect
+
+    disconnect()
+    connect("smart_home_test", host="mongodb://localhost", mongo_client_class=mongomock.MongoClient,
+            uuidRepresentation="standard")
+    yield
+    disconnect()
@@ -0,0 +1,82 @@
+from bson import ObjectId
+
+from db import automation_graph
+from db.automation import Automation, AutomationNode, Condition, ConditionEdge, ConditionType, GraphEdge, \
+    GraphNode, Location
+
+
+def _condition() -> Condition:
+    return Condition(condition_type=ConditionType.BY_TRIGGER)
+
+
+def _referenced(name: str) -> Automation:
+    source = AutomationNode(unique_key="a", smart_controller_id="c", action_id="on").save()
+    target = AutomationNode(unique_key="b", smart_controller_id="c", action_id="off").save()
+    edge = ConditionEdge(source=source, target=target, condition=_condition()).save()
+    return Automation(name=name, nodes=[source, target], edges=[edge]).save()
+
+
+def _stored(automation: Automation) -> Automation:
+    return Automation.objects(id=automation.id).no_dereference().get()
+
+
+def test_embedded_graph_is_updated_in_place(database):
+    automation = Automation(name="embedded", is_embedded=True).save()
+    source = GraphNode(unique_key="a", smart_controller_id="c", action_id="on")
+    target = GraphNode(unique_key="b", smart_controller_id="c", action_id="off")
+    edge = GraphEdge(source_id=source.id, target_id=target.id, condition=_condition())
+    automation_graph.add_node(automation, source)
+    automation_graph.add_node(automation, target)
+    automation_graph.add_edge(automation, edge)
+
+    target.location = Location(x=1.0, y=2.0)
+    automation_graph.save_node(automation, target)
+    graph = automation_graph.load_graph(_stored(automation))
+    assert [node.id for node in graph.nodes] == [source.id, target.id]
+    assert graph.node(target.id).location.x == 1.0
+    assert [(edge.source_id, edge.target_id) for edge in graph.edges] == [(source.id, target.id)]
+
+    automation_graph.remove_edge(automation, edge.id)
+    automation_graph.remove_node(automation, source.id)
+    stored = _stored(automation)
+    assert [node.id for node in stored.graph_nodes] == [target.id] and stored.graph_edges == []
+    # Nothing is written to the referenced collections
+    assert AutomationNode.objects.count() == 0 and ConditionEdge.objects.count() == 0
+
+
+def test_embed_keeps_ids_and_deletes_references_when_asked(database):
+    automation = _referenced("referenced")
+    before = automation_graph.load_graph(automation)
+
+    assert automation_graph.embed(_stored(automation), delete_references=True)
+    stored = _stored(automation)
+    assert stored.is_embedded and not stored.nodes and not stored.edges
+    after = automation_graph.load_graph(stored)
+    assert [node.id for node in after.nodes] == [node.id for node in before.nodes]
+    assert [(edge.id, edge.source_id, edge.target_id) for edge in after.edges] == \
+        [(edge.id, edge.source_id, edge.target_id) for edge in before.edges]
+    assert AutomationNode.objects.count() == 0 and ConditionEdge.objects.count() == 0
+
+
+def test_embed_leaves_an_automation_changed_while_copying(database):
+    automation = _referenced("racing")
+    copied = _stored(automation)
+    # Another request adds a node between loading and embedding
+    automation_graph.add_node(copied, GraphNode(id=ObjectId(), unique_key="c"))
+
+    assert not automation_graph.embed(copied, delete_references=True)
+    stored = _stored(automation)
+    assert not stored.is_embedded and len(stored.nodes) == 3 and stored.graph_nodes == []
+    assert AutomationNode.objects.count() == 3 and ConditionEdge.objects.count() == 1
+
+
+def test_migrate_embeds_every_referenced_automation_once(database):
+    _referenced("first")
+    Automation(name="empty").save()
+    Automation(name="embedded", is_embedded=True).save()
+
+    assert automation_graph.migrate() == 2
+    assert Automation.objects(is_embedded=True).count() == 3
+    assert automation_graph.migrate() == 0
+    # References are kept unless asked otherwise
+    assert AutomationNode.objects.count() == 2
@@ -0,0 +1,173 @@
+import asyncio
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Tuple
+
+from db.automation import Condition, ConditionType, Operator, ReturnValueType
+from db.models import Action, SmartController
+from tools.automation_runner.automation_runner import AutomationRunner
+from tools.automation_runner.compiled_graph import CompiledAutomation, CompiledEdge, CompiledNode
+from tools.sensor_cache.sensor_cache import SensorReading
+
+TRIGGER = Condition(condition_type=ConditionType.BY_TRIGGER, value_type=ReturnValueType.BOOLEAN,
+                    operator=Operator.EQUAL, value_boolean=True)
+
+
+def above(value: float, is_loop: bool = True) -> Condition:
+    return Condition(condition_type=ConditionType.BY_VALUE, value_type=ReturnValueType.NUMBER,
+                     operator=Operator.GREATER, value_number=value, is_loop=is_loop)
+
+
+def compile_graph(nodes: List[str], edges: List[Tuple[str, str, Condition]], sensors=(), **options):
+    """
+    Automation over the nodes named in <nodes>, the nodes in <sensors> are sensor reads.
+    """
+    controller = SmartController(name="controller", address="controller.test")
+    automation = CompiledAutomation(id="automation", name="automation", is_active=True, **options)
+    for name in nodes:
+        automation.nodes[name] = CompiledNode(id=name, smart_controller_id="controller", action_id=name,
+                                              smart_controller=controller,
+                                              action=Action(name=name, path=f"/{name}", is_sensor=name in sensors))
+    for number, (source, target, condition) in enumerate(edges):
+        automation.edges_by_source.setdefault(source, []).append(
+            CompiledEdge(id=f"edge-{number}", source_id=source, target_id=target, condition=condition))
+    automation.roots = [nodes[0]]
+    return automation
+
+
+class Devices:
+    """
+    Stub device calls recording what ran, with per action delays, failures and sensor values.
+    """
+
+    def __init__(self, delays: Optional[Dict[str, float]] = None, failing=(), readings=None):
+        self.delays = delays or {}
+        self.failing = set(failing)
+        self.readings = {name: list(values) for name, values in (readings or {}).items()}
+        self.events: List[Tuple[str, str]] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def run(self, controller, action, is_part_of_automation):
+        self.events.append(("start", action.name))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delays.get(action.name, 0))
+            if action.name in self.failing:
+                raise ConnectionError(f"{action.name} failed")
+        finally:
+            self.in_flight -= 1
+            self.events.append(("end", action.name))
+        return SimpleNamespace(status_code=200, text="ok")
+
+    async def read(self, controller, action):
+        self.events.append(("read", action.name))
+        values = self.readings[action.name]
+        return SensorReading(text=values.pop(0) if len(values) > 1 else values[0], read_at=0.0, cached=False)
+
+    def ran(self) -> List[str]:
+        return [name for event, name in self.events if event == "start"]
+
+
+def run(automation: CompiledAutomation, devices: Devices, **options):
+    runner = AutomationRunner(automation=automation, run_function=devices.run, read_function=devices.read,
+                              poll_interval=0, **options)
+    return asyncio.run(runner.start(previous_step_response="ok", node=automation.get_roots()[0]))
+
+
+def test_sequential_branches_run_one_after_another_in_edge_order():
+    automation = compile_graph(["root", "a", "b", "c"], [("root", "a", TRIGGER), ("root", "b", TRIGGER),
+                                                        ("root", "c", TRIGGER)], is_sequential=True)
+    devices = Devices(delays={"a": 0.02, "b": 0.01})
+    run(automation, devices)
+
+    assert devices.events == [("start", "a"), ("end", "a"), ("start", "b"), ("end", "b"),
+                              ("start", "c"), ("end", "c")]
+
+
+def test_parallel_branches_are_bounded_by_max_parallel_branches():
+    branches = [f"branch-{number}" for number in range(6)]
+    automation = compile_graph(["root"] + branches, [("root", branch, TRIGGER) for branch in branches],
+                               max_parallel_branches=2)
+    devices = Devices(delays={branch: 0.02 for branch in branches})
+    run(automation, devices)
+
+    assert sorted(devices.ran()) == branches
+    assert devices.max_in_flight == 2
+
+
+def test_parallel_branches_run_concurrently_without_a_limit():
+    branches = [f"branch-{number}" for number in range(4)]
+    automation = compile_graph(["root"] + branches, [("root", branch, TRIGGER) for branch in branches])
+    devices = Devices(delays={branch: 0.02 for branch in branches})
+    run(automation, devices)
+
+    assert devices.max_in_flight == 4
+
+
+def test_failing_branch_does_not_stop_its_siblings_in_either_mode():
+    for is_sequential in (True, False):
+        automation = compile_graph(["root", "broken", "after-broken", "healthy"],
+                                   [("root", "broken", TRIGGER), ("broken", "after-broken", TRIGGER),
+                                    ("root", "healthy", TRIGGER)], is_sequential=is_sequential)
+        devices = Devices(failing={"broken"})
+        state = run(automation, devices)
+
+        assert sorted(devices.ran()) == ["broken", "healthy"]
+        assert state.trace.status == "finished"
+        [broken_edge] = [span for span in state.trace.spans if span.name == "root -> broken"]
+        assert broken_edge.attributes["error"] == "broken failed"
+
+
+def test_loop_polls_the_source_until_the_condition_is_met():
+    automation = compile_graph(["temperature", "fan"], [("temperature", "fan", above(20))], sensors={"temperature"})
+    devices = Devices(readings={"temperature": ["19", "21"]})
+    runner = AutomationRunner(automation=automation, run_function=devices.run, read_function=devices.read,
+                              poll_interval=0)
+    state = asyncio.run(runner.start(previous_step_response="18", node=automation.nodes["temperature"]))
+
+    assert devices.events == [("read", "temperature"), ("read", "temperature"), ("start", "fan"), ("end", "fan")]
+    assert state.loop_iterations == {"edge-0": 2}
+    [edge] = [span for span in state.trace.spans if span.kind == "edge"]
+    assert edge.attributes["condition_met"] is True and edge.attributes["iterations"] == 2
+
+
+def test_loop_uses_pushed_values_before_polling():
+    automation = compile_graph(["temperature", "fan"], [("temperature", "fan", above(20))], sensors={"temperature"})
+    devices = Devices(readings={"temperature": ["0"]})
+    pushed = ["19", None, "25"]
+
+    async def wait(controller, action, timeout):
+        return pushed.pop(0)
+
+    runner = AutomationRunner(automation=automation, run_function=devices.run, read_function=devices.read,
+                              wait_function=wait, poll_interval=0)
+    state = asyncio.run(runner.start(previous_step_response="18", node=automation.nodes["temperature"]))
+
+    # Only the wait that timed out fell back to reading the device
+    assert devices.events == [("read", "temperature"), ("start", "fan"), ("end", "fan")]
+    assert state.loop_iterations == {"edge-0": 3}
+    assert [span.attributes["pushed"] for span in state.trace.spans if span.kind == "wait"] == [True, False, True]
+
+
+def test_loop_gives_up_after_max_loop_duration():
+    automation = compile_graph(["temperature", "fan"], [("temperature", "fan", above(20))], sensors={"temperature"})
+    devices = Devices(readings={"temperature": ["18"]})
+    runner = AutomationRunner(automation=automation, run_function=devices.run, read_function=devices.read,
+                              poll_interval=0.01, max_loop_duration=0.05)
+    state = asyncio.run(runner.start(previous_step_response="18", node=automation.nodes["temperature"]))
+
+    assert devices.ran() == []
+    assert 1 <= state.loop_iterations["edge-0"] <= 6
+    [edge] = [span for span in state.trace.spans if span.kind == "edge"]
+    assert edge.attributes["timed_out"] is True and edge.attributes["condition_met"] is False
+
+
+def test_unmet_condition_without_loop_ends_the_branch():
+    automation = compile_graph(["temperature", "fan"], [("temperature", "fan", above(20, is_loop=False))],
+                               sensors={"temperature"})
+    devices = Devices(readings={"temperature": ["18"]})
+    runner = AutomationRunner(automation=automation, run_function=devices.run, read_function=devices.read)
+    state = asyncio.run(runner.start(previous_step_response="18", node=automation.nodes["temperature"]))
+
+    assert devices.events == [] and state.loop_iterations == {}
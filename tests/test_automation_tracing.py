@@ -0,0 +1,67 @@
+import asyncio
+from types import SimpleNamespace
+
+from db.automation import Automation, Condition, ConditionType, GraphEdge, GraphNode, Location, Operator, \
+    ReturnValueType
+from db.document_cache import action_cache, smart_controller_cache
+from db.models import Action, SmartController
+from tools.automation_runner.automation_runner import AutomationRunner
+from tools.automation_runner.compiled_graph import compile_automation
+from tools.automation_runner.tracing import trace_store
+from tools.sensor_cache.sensor_cache import SensorReading
+
+
+def _seed_automation() -> Automation:
+    actions = [Action(name="trigger", path="/trigger"), Action(name="temperature", path="/t", is_sensor=True),
+               Action(name="fan", path="/fan")]
+    for action in actions:
+        action.save()
+    controller = SmartController(name="living-room", address="controller.test", actions=actions)
+    controller.save()
+    nodes = [GraphNode(unique_key=action.name, smart_controller_id=str(controller.id), action_id=str(action.id),
+                       location=Location(x=0.0, y=0.0))
+             for action in actions]
+    by_trigger = Condition(condition_type=ConditionType.BY_TRIGGER, value_type=ReturnValueType.BOOLEAN,
+                           operator=Operator.EQUAL, value_boolean=True)
+    by_value = Condition(condition_type=ConditionType.BY_VALUE, value_type=ReturnValueType.NUMBER,
+                         operator=Operator.GREATER, value_number=20.0)
+    automation = Automation(name="cool down", is_embedded=True, graph_nodes=nodes,
+                            graph_edges=[GraphEdge(source_id=nodes[0].id, target_id=nodes[1].id, condition=by_trigger),
+                                         GraphEdge(source_id=nodes[1].id, target_id=nodes[2].id, condition=by_value)])
+    automation.save()
+    return automation
+
+
+def test_run_records_a_span_per_step(database):
+    action_cache.clear()
+    smart_controller_cache.clear()
+    compiled = compile_automation(str(_seed_automation().id))
+    called = []
+
+    async def run_function(controller, action, is_part_of_automation):
+        called.append(action.name)
+        return SimpleNamespace(status_code=200, text="on")
+
+    async def read_function(controller, action):
+        called.append(action.name)
+        return SensorReading(text="22.5", read_at=0.0, cached=False)
+
+    runner = AutomationRunner(automation=compiled, run_function=run_function, read_function=read_function)
+    state = asyncio.run(runner.start(previous_step_response="ok", node=compiled.get_roots()[0]))
+
+    assert called == ["temperature", "fan"]
+    trace = trace_store.get(state.run_id)
+    assert trace.status == "finished" and trace.automation_name == "cool down"
+    assert [span.kind for span in trace.spans] == ["edge", "node", "edge", "node"]
+
+    trigger_edge, sensor, value_edge, fan = trace.spans
+    assert (trigger_edge.kind, trigger_edge.parent_id) == ("edge", None)
+    assert trigger_edge.attributes["condition_type"] == "by_trigger"
+    assert (sensor.kind, sensor.name, sensor.parent_id) == ("node", "temperature", trigger_edge.span_id)
+    assert sensor.attributes["step"] == "sensor" and sensor.attributes["response"] == "22.5"
+    assert (value_edge.kind, value_edge.parent_id) == ("edge", trigger_edge.span_id)
+    assert value_edge.attributes["condition_type"] == "by_value"
+    assert value_edge.attributes["condition_met"] is True and value_edge.attributes["value"] == "22.5"
+    assert (fan.kind, fan.name, fan.parent_id) == ("node", "fan", value_edge.span_id)
+    assert fan.attributes["step"] == "action" and fan.attributes["status_code"] == 200
+    assert all(span.duration_ms is not None for span in trace.spans)
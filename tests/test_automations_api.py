@@ -0,0 +1,34 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.v1 import automations
+from db.automation import Automation
+
+
+def _client() -> TestClient:
+    app = FastAPI()
+    app.include_router(automations.router, prefix="/automations")
+    return TestClient(app)
+
+
+def test_update_leaves_execution_settings_unchanged_when_omitted(database):
+    client = _client()
+    created = client.post("/automations/", json={"name": "evening"}).json()
+    viewport = {"x": 0.0, "y": 0.0, "zoom": 1.0}
+    response = client.put(f"/automations/{created['id']}",
+                          json={"name": "evening", "is_active": True, "is_sequential": True,
+                                "max_parallel_branches": 2, "viewport": viewport})
+    assert response.status_code == 200
+
+    response = client.put(f"/automations/{created['id']}",
+                          json={"name": "night", "is_active": False, "viewport": viewport})
+    assert response.status_code == 200
+    automation = Automation.objects.get(id=created["id"])
+    assert (automation.name, automation.is_active) == ("night", False)
+    assert (automation.is_sequential, automation.max_parallel_branches) == (True, 2)
+
+    client.put(f"/automations/{created['id']}",
+               json={"name": "night", "is_active": False, "is_sequential": False, "max_parallel_branches": 0,
+                     "viewport": viewport})
+    automation.reload()
+    assert (automation.is_sequential, automation.max_parallel_branches) == (False, 0)
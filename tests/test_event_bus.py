@@ -0,0 +1,38 @@
+import asyncio
+
+from tools.event_bus.event_bus import EventBus
+
+
+def test_retained_events_keep_the_last_state_per_topic():
+    bus = EventBus(max_queued=10, max_retained=100)
+    bus.publish("sensors/c/a", "sensor_reading", retain=True, text="1")
+    bus.publish("sensors/c/a", "sensor_reading", retain=True, text="2")
+    bus.publish("actions/c/a", "action_run", text="ignored")
+
+    assert [event.data["text"] for event in bus.retained(["sensors"])] == ["2"]
+    assert bus.publish("sensors/c/a", "sensor_reading", retain=True, only_changes=True, text="2") is None
+    assert bus.publish("sensors/c/a", "sensor_reading", retain=True, only_changes=True, text="3") is not None
+
+
+def test_final_event_is_delivered_and_not_retained():
+    async def run():
+        bus = EventBus(max_queued=10, max_retained=100)
+        bus.publish("scheduled_tasks/1", "retry_scheduled", retain=True, attempts=1)
+        subscription = bus.subscribe(["scheduled_tasks"])
+        bus.publish("scheduled_tasks/1", "succeeded", final=True, attempts=2)
+        return await subscription.get(timeout=1), bus.retained(["scheduled_tasks"])
+
+    delivered, retained = asyncio.run(run())
+    assert delivered.type == "succeeded"
+    assert retained == []
+
+
+def test_least_recently_updated_topics_are_dropped_past_the_limit():
+    bus = EventBus(max_queued=10, max_retained=3)
+    for number in range(3):
+        bus.publish(f"scheduled_tasks/{number}", "retry_scheduled", retain=True)
+    bus.publish("scheduled_tasks/0", "deferred", retain=True)
+    bus.publish("scheduled_tasks/3", "retry_scheduled", retain=True)
+
+    assert sorted(event.topic for event in bus.retained(["scheduled_tasks"])) == \
+        ["scheduled_tasks/0", "scheduled_tasks/2", "scheduled_tasks/3"]
@@ -0,0 +1,35 @@
+
+from tools.action_executor.action_executor import ActionExecutor
+from tools.metrics.instrumentation import _request_scope, endpoint_label
+from tools.metrics.profiler import RequestProfile, _profile, record_device_call
+
+
+def test_spawned_work_is_not_counted_towards_the_request():
+    executor = ActionExecutor(connect_timeout=1, read_timeout=1, max_in_flight_per_controller=1)
+    profile = RequestProfile()
+    seen = {}
+
+    async def background():
+        record_device_call(0.5)
+        seen["background"] = (endpoint_label(), _profile.get())
+
+    async def handler():
+        record_device_call(0.1)
+        seen["request"] = endpoint_label()
+        await executor.spawn(background())
+        # The spawned task did not change the request's own context
+        seen["after"] = (endpoint_label(), _profile.get())
+
+    scope_token = _request_scope.set({"route": type("Route", (), {"path": "/sensors/push"})()})
+    profile_token = _profile.set(profile)
+    try:
+        executor.submit(handler()).result(timeout=5)
+    finally:
+        _request_scope.reset(scope_token)
+        _profile.reset(profile_token)
+        executor.stop()
+
+    assert seen["request"] == "/sensors/push"
+    assert seen["background"] == ("background", None)
+    assert seen["after"] == ("/sensors/push", profile)
+    assert profile.device_calls == 1
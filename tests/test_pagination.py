@@ -0,0 +1,85 @@
+import json
+
+import pytest
+from fastapi import HTTPException, Response
+
+from api.v1.pagination import NEXT_CURSOR_HEADER, Page
+from db.models import Action
+from models.action import ActionResponse
+
+
+@pytest.fixture
+def actions(database):
+    actions = [Action(name=f"action-{number}", path=f"/{number}", description="", is_sensor=number % 2 == 0)
+               for number in range(5)]
+    for action in actions:
+        action.save()
+    return actions
+
+
+def _page(after=None, limit=None, fields=None) -> Page:
+    return Page(after=after, limit=limit, fields=fields)
+
+
+def test_cursor_walks_every_document_once(actions):
+    names, after = [], None
+    for _ in range(len(actions)):
+        page = _page(after=after, limit=2)
+        names += [action.name for action in page.apply(Action.objects(), response_model=ActionResponse)]
+        after = page.next_cursor
+        if after is None:
+            break
+    assert names == [action.name for action in actions]
+
+
+def test_cursor_is_set_only_while_more_documents_follow(actions):
+    page = _page(limit=2)
+    assert len(page.apply(Action.objects(), response_model=ActionResponse)) == 2
+    assert page.next_cursor == str(actions[1].id)
+
+    page = _page(after=str(actions[2].id), limit=2)
+    assert [action.name for action in page.apply(Action.objects(), response_model=ActionResponse)] == \
+        ["action-3", "action-4"]
+    assert page.next_cursor is None
+
+    page = _page()
+    assert len(page.apply(Action.objects(is_sensor=True), response_model=ActionResponse)) == 3
+    assert page.next_cursor is None
+
+
+def test_invalid_cursor_is_rejected():
+    with pytest.raises(HTTPException) as error:
+        _page(after="not-an-id")
+    assert error.value.status_code == 400
+
+
+def test_fields_only_load_and_return_the_selected_fields(actions):
+    page = _page(fields="name, is_sensor")
+    assert page.fields == {"id", "name", "is_sensor"}
+    [first, *_] = page.apply(Action.objects(), response_model=ActionResponse)
+    assert first.name == "action-0" and first.path is None
+
+    items = [page.build(ActionResponse, id=str(action.id), name=action.name, is_sensor=action.is_sensor)
+             for action in [first]]
+    response = page.respond(Response(), items)
+    assert json.loads(response.body) == [{"id": str(first.id), "name": "action-0", "is_sensor": True}]
+
+
+def test_fields_are_loaded_from_their_sources(actions):
+    page = _page(fields="description")
+    [first, *_] = page.apply(Action.objects(), response_model=ActionResponse, sources={"description": ["path"]})
+    assert first.path == "/0" and first.name is None
+
+
+def test_unknown_fields_are_rejected(actions):
+    with pytest.raises(HTTPException) as error:
+        _page(fields="name,password").apply(Action.objects(), response_model=ActionResponse)
+    assert error.value.status_code == 400 and "password" in error.value.detail
+
+
+def test_next_cursor_is_returned_in_a_header(actions):
+    page = _page(limit=1)
+    page.apply(Action.objects(), response_model=ActionResponse)
+    response = Response()
+    page.respond(response, [])
+    assert response.headers[NEXT_CURSOR_HEADER] == str(actions[0].id)
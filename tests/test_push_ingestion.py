@@ -0,0 +1,139 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from db.automation import Automation, Condition, ConditionType, GraphEdge, GraphNode, Location, Operator, \
+    ReturnValueType
+from db.document_cache import action_cache, smart_controller_cache
+from db.models import Action, SmartController
+from db.sensor_history import Resolution
+from tools.action_executor import executor
+from tools.action_runner.action_runner import ingest_async
+from tools.automation_runner.compiled_graph import graph_cache
+from tools.automation_runner.trigger_index import trigger_index
+from tools.event_bus import event_bus
+from tools.sensor_cache import sensor_cache
+from tools.sensor_history import get_history
+
+
+@pytest.fixture
+def home(database, monkeypatch):
+    """
+    A controller with a temperature sensor and a fan, device calls to the fan are recorded instead of sent.
+    """
+    for cache in (action_cache, smart_controller_cache, graph_cache):
+        cache.clear()
+    temperature = Action(name="temperature", path="/temperature", is_sensor=True)
+    fan = Action(name="fan", path="/fan")
+    for action in (temperature, fan):
+        action.save()
+    controller = SmartController(name="living-room", address="living-room.test", actions=[temperature, fan])
+    controller.save()
+    fired = []
+
+    async def run_async(controller, action, is_part_of_automation=False):
+        fired.append(action.name)
+        return SimpleNamespace(status_code=200, text="ok", is_success=True)
+
+    monkeypatch.setattr("tools.action_runner.action_runner.run_async", run_async)
+    yield SimpleNamespace(controller=controller, temperature=temperature, fan=fan, fired=fired)
+    executor.submit(_clear_sensor_cache()).result()
+    executor.stop()
+
+
+async def _clear_sensor_cache():
+    sensor_cache._readings.clear()
+
+
+def _automation(home, condition: Condition):
+    nodes = [GraphNode(unique_key=action.name, smart_controller_id=str(home.controller.id), action_id=str(action.id),
+                       location=Location(x=0.0, y=0.0))
+             for action in (home.temperature, home.fan)]
+    Automation(name="cool down", is_embedded=True, graph_nodes=nodes,
+               graph_edges=[GraphEdge(source_id=nodes[0].id, target_id=nodes[1].id, condition=condition)]).save()
+    trigger_index.build()
+
+
+def _above_20(is_loop: bool) -> Condition:
+    return Condition(condition_type=ConditionType.BY_VALUE, value_type=ReturnValueType.NUMBER,
+                     operator=Operator.GREATER, value_number=20.0, is_loop=is_loop)
+
+
+async def _push(home, *texts, pause: float = 0.02):
+    started = []
+    for text in texts:
+        started.append(await ingest_async(controller=home.controller, action=home.temperature, text=text))
+        await asyncio.sleep(pause)
+    while executor._background_tasks:
+        await asyncio.gather(*executor._background_tasks, return_exceptions=True)
+    return started
+
+
+def test_pushed_value_is_cached_recorded_published_and_dispatched(home):
+    _automation(home, _above_20(is_loop=False))
+    subscription = executor.submit(_subscribe()).result()
+
+    started = executor.submit(_push(home, "18", "22")).result()
+
+    assert started == [1, 1]
+    assert home.fired == ["fan"]
+    key = (str(home.controller.id), str(home.temperature.id))
+    reading = sensor_cache._readings[key]
+    assert (reading.text, reading.pushed) == ("22", True)
+    events = executor.submit(_drain_events(subscription)).result()
+    assert [event.data["text"] for event in events] == ["18", "22"]
+
+    # History is written on a worker thread
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        points = get_history(*key, start=datetime.utcnow() - timedelta(hours=1), end=datetime.utcnow(),
+                             resolution=Resolution.RAW)
+        if len(points) == 2:
+            break
+        time.sleep(0.01)
+    assert [point.avg for point in points] == [18.0, 22.0]
+
+
+def test_pushes_feed_the_running_loop_instead_of_starting_new_runs(home):
+    _automation(home, _above_20(is_loop=True))
+
+    started = executor.submit(_push(home, "18", "19", "21")).result()
+
+    assert started == [1, 0, 0]
+    assert home.fired == ["fan"]
+
+    # Once the loop is over a new push starts a new run
+    assert executor.submit(_push(home, "25")).result() == [1]
+    assert home.fired == ["fan", "fan"]
+
+
+def test_values_pushed_together_start_a_single_looping_run(home):
+    _automation(home, _above_20(is_loop=True))
+
+    async def push_batch():
+        started = await asyncio.gather(*[ingest_async(controller=home.controller, action=home.temperature, text=text)
+                                         for text in ("18", "19", "21")])
+        while executor._background_tasks:
+            await asyncio.gather(*executor._background_tasks, return_exceptions=True)
+        return started
+
+    assert sum(executor.submit(push_batch()).result()) == 1
+    assert home.fired == ["fan"]
+
+
+async def _subscribe():
+    return event_bus.subscribe(["sensors"])
+
+
+async def _drain_events(subscription):
+    events = []
+    while True:
+        event = await subscription.get(timeout=0.01)
+        if event is None:
+            event_bus.unsubscribe(subscription)
+            return events
+        events.append(event)
+
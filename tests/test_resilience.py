@@ -0,0 +1,83 @@
+import pytest
+
+from db.scheduled_task import ScheduledTask
+from tools.resilience import CircuitBreaker, RetryPolicy
+from tools.resilience.circuit_breaker import CircuitState
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("tools.resilience.circuit_breaker.time.monotonic", lambda: now[0])
+    return now
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("controller", failure_threshold=3, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.CLOSED and breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+    assert not breaker.allow()
+    assert breaker.retry_after() == 30
+
+    clock[0] += 10
+    assert not breaker.allow() and breaker.retry_after() == 20
+
+
+def test_half_open_breaker_lets_a_single_probe_through(clock):
+    breaker = CircuitBreaker("controller", failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock[0] += 30
+    assert breaker.state == CircuitState.HALF_OPEN
+
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CircuitState.CLOSED
+    assert breaker.allow() and breaker.allow()
+
+
+def test_failed_probe_opens_the_breaker_again(clock):
+    breaker = CircuitBreaker("controller", failure_threshold=5, reset_timeout=30)
+    for _ in range(5):
+        breaker.record_failure()
+    clock[0] += 31
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN and not breaker.allow()
+    assert breaker.retry_after() == 30
+
+
+def test_retry_delay_backs_off_exponentially_up_to_the_maximum():
+    policy = RetryPolicy(max_retries=5, base_delay=10, max_delay=60, jitter=0)
+    assert [policy.delay(attempt) for attempt in range(4)] == [10, 20, 40, 60]
+
+    jittered = RetryPolicy(base_delay=10, max_delay=60, jitter=0.5)
+    delays = [jittered.delay(1) for _ in range(200)]
+    assert all(10 <= delay <= 20 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+def test_retry_policy_is_exhausted_after_max_retries():
+    policy = RetryPolicy(max_retries=2)
+    assert not policy.exhausted(0) and not policy.exhausted(1)
+    assert policy.exhausted(2)
+    assert RetryPolicy(max_retries=0).exhausted(0)
+
+
+def test_retry_policy_of_a_task_applies_its_overrides():
+    default = RetryPolicy()
+    assert RetryPolicy.for_task(ScheduledTask()) == default
+
+    policy = RetryPolicy.for_task(ScheduledTask(max_retries=0, retry_base_delay=2.5))
+    assert (policy.max_retries, policy.base_delay, policy.max_delay) == (0, 2.5, default.max_delay)
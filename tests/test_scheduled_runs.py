@@ -0,0 +1,73 @@
+from datetime import timedelta
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from config.settings import settings
+from db.models import Action, SmartController
+from db.scheduled_task import ScheduledTask
+from tools.action_runner import action_runner
+
+
+class Scheduler:
+    def __init__(self):
+        self.jobs = []
+
+    def add_job(self, func, trigger, **kwargs):
+        self.jobs.append(kwargs)
+        return SimpleNamespace(id=kwargs["id"])
+
+
+@pytest.fixture
+def events(database, monkeypatch):
+    published = []
+    monkeypatch.setattr(action_runner.event_bus, "publish",
+                        lambda topic, event_type, **kwargs: published.append((event_type, kwargs.get("attempts"))))
+    # Nothing buffered reaches the database, like a flush that has not happened yet
+    monkeypatch.setattr(action_runner.write_buffer, "set", lambda document, **fields: None)
+    monkeypatch.setattr(action_runner.write_buffer, "inc", lambda document, **fields: None)
+    return published
+
+
+@pytest.fixture
+def task(database):
+    action = Action(name="valve open", path="/open", description="").save()
+    controller = SmartController(name="garden", address="garden.test", actions=[action]).save()
+    return ScheduledTask(smart_controller=controller, action=action, minutes_to_run=5, max_retries=2,
+                         retry_base_delay=0).save()
+
+
+def reload(task: ScheduledTask) -> ScheduledTask:
+    return ScheduledTask.objects.get(id=task.id)
+
+
+def test_retries_see_spent_attempts_without_a_buffer_flush(events, task):
+    scheduler = Scheduler()
+    for _ in range(2):
+        current = reload(task)
+        assert action_runner._start_scheduled_run(current, scheduler)
+        action_runner._finish_scheduled_run(current, scheduler, httpx.Response(status_code=500))
+
+    assert reload(task).retires_count == 2
+    assert not action_runner._start_scheduled_run(reload(task), scheduler)
+    assert events == [("retry_scheduled", 1), ("retry_scheduled", 2), ("retries_exhausted", 2)]
+
+
+def test_success_counts_attempts_like_retries(events, task):
+    scheduler = Scheduler()
+    action_runner._finish_scheduled_run(reload(task), scheduler, httpx.Response(status_code=500))
+    action_runner._finish_scheduled_run(reload(task), scheduler, httpx.Response(status_code=200))
+    assert events == [("retry_scheduled", 1), ("succeeded", 2)]
+
+
+def test_deferral_gives_up_once_the_task_is_too_late(events, task, monkeypatch):
+    monkeypatch.setattr(action_runner.health_monitor, "is_down", lambda controller_id: True)
+    scheduler = Scheduler()
+    assert not action_runner._start_scheduled_run(reload(task), scheduler)
+    assert events == [("deferred", None)] and len(scheduler.jobs) == 1
+
+    task.inserted_at -= timedelta(minutes=task.minutes_to_run, seconds=settings.RETRY_MAX_DEFERRAL)
+    task.save()
+    assert not action_runner._start_scheduled_run(reload(task), scheduler)
+    assert events[-1] == ("deferral_expired", 0) and len(scheduler.jobs) == 1
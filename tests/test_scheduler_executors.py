@@ -0,0 +1,68 @@
+import asyncio
+import threading
+import time
+from collections import Counter
+
+import pytest
+from apscheduler.events import EVENT_JOB_EXECUTED
+from apscheduler.schedulers.background import BackgroundScheduler
+
+from tools.action_executor import executor
+from tools.scheduler.executors import ActionLoopExecutor, ControllerLimiter
+
+
+@pytest.fixture
+def action_loop():
+    yield
+    executor.stop()
+
+
+def test_loop_executor_starts_a_burst_of_jobs_together(action_loop):
+    started = []
+    done = threading.Event()
+
+    async def job():
+        started.append(time.monotonic())
+        await asyncio.sleep(0.3)
+
+    def executed(event):
+        if len(started) == 20:
+            done.set()
+
+    scheduler = BackgroundScheduler(executors={"devices": ActionLoopExecutor(lambda job_id: "task")})
+    scheduler.add_listener(executed, EVENT_JOB_EXECUTED)
+    scheduler.start()
+    try:
+        for number in range(20):
+            scheduler.add_job(job, executor="devices", id=f"task:{number}")
+        assert done.wait(timeout=2)
+    finally:
+        scheduler.shutdown(wait=True)
+
+    # No worker thread is held while a job waits, all of them run at once
+    assert len(started) == 20
+    assert max(started) - min(started) < 0.2
+
+
+def test_controller_limiter_caps_jobs_per_controller(action_loop):
+    limiter = ControllerLimiter(limit=2)
+    running = Counter()
+    peaks = Counter()
+
+    async def job(controller_id: str):
+        async with limiter.slot(controller_id, kind="task"):
+            running[controller_id] += 1
+            peaks[controller_id] = max(peaks[controller_id], running[controller_id])
+            await asyncio.sleep(0.01)
+            running[controller_id] -= 1
+
+    async def burst(controller_ids):
+        await asyncio.gather(*(job(controller_id) for controller_id in controller_ids))
+
+    executor.submit(burst(["hall"] * 6 + ["garden"] * 3)).result(timeout=2)
+    assert peaks == {"hall": 2, "garden": 2}
+
+    limiter.limit = 0
+    peaks.clear()
+    executor.submit(burst(["hall"] * 6)).result(timeout=2)
+    assert peaks == {"hall": 6}
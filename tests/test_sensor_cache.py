@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from tools.sensor_cache.sensor_cache import SensorCache
+
+KEY = ("controller", "temperature")
+
+
+def test_concurrent_reads_share_one_device_request():
+    async def run():
+        cache = SensorCache(freshness=60, push_freshness=60)
+        release = asyncio.Event()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await release.wait()
+            return "21.5"
+
+        readers = [asyncio.create_task(cache.read(KEY, fetch)) for _ in range(5)]
+        await asyncio.sleep(0)
+        release.set()
+        readings = await asyncio.gather(*readers)
+        return calls, readings, await cache.read(KEY, fetch)
+
+    calls, readings, later = asyncio.run(run())
+    assert len(calls) == 1
+    assert [reading.text for reading in readings] == ["21.5"] * 5
+    assert [reading.cached for reading in readings].count(False) == 1
+    assert later.cached and len(calls) == 1
+
+
+def test_stale_reading_is_fetched_again():
+    async def run():
+        cache = SensorCache(freshness=0, push_freshness=60)
+        values = iter(["1", "2"])
+
+        async def fetch():
+            return next(values)
+
+        first = await cache.read(KEY, fetch)
+        await asyncio.sleep(0.01)
+        return first, await cache.read(KEY, fetch)
+
+    first, second = asyncio.run(run())
+    assert (first.text, second.text) == ("1", "2")
+    assert not second.cached
+
+
+def test_failed_fetch_is_raised_to_every_waiting_reader_and_not_cached():
+    async def run():
+        cache = SensorCache(freshness=60, push_freshness=60)
+        release = asyncio.Event()
+
+        async def failing_fetch():
+            await release.wait()
+            raise ConnectionError("device unreachable")
+
+        async def fetch():
+            return "ok"
+
+        readers = [asyncio.create_task(cache.read(KEY, failing_fetch)) for _ in range(3)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*readers, return_exceptions=True)
+        return results, await cache.read(KEY, fetch)
+
+    results, after = asyncio.run(run())
+    assert all(isinstance(result, ConnectionError) for result in results)
+    assert after.text == "ok" and not after.cached
+
+
+def test_pushed_value_stays_fresh_and_wakes_waiters():
+    async def run():
+        cache = SensorCache(freshness=0, push_freshness=60)
+        waiter = asyncio.create_task(cache.wait_for_update(KEY, timeout=1))
+        await asyncio.sleep(0)
+        cache.store(KEY, "30", pushed=True)
+
+        async def fetch():
+            pytest.fail("A pushed value must not be read from the device")
+
+        return await waiter, await cache.read(KEY, fetch), await cache.wait_for_update(KEY, timeout=0.01)
+
+    woken, reading, timed_out = asyncio.run(run())
+    assert woken.text == "30" and woken.pushed
+    assert reading.text == "30" and reading.cached
+    assert timed_out is None
@@ -0,0 +1,20 @@
+from datetime import datetime, timedelta
+
+from db.sensor_history import Resolution
+from tools.sensor_history.sensor_history import get_history, record_reading
+
+
+def test_recorded_readings_are_read_back(database):
+    start = datetime(2024, 1, 1, 12, 0, 10)
+    for offset, text in enumerate(["20.5", "21.5", "true", "not a number"]):
+        record_reading("controller", "action", text, timestamp=start + timedelta(seconds=offset))
+
+    raw = get_history("controller", "action", start, start + timedelta(minutes=5), Resolution.RAW)
+    assert [point.avg for point in raw] == [20.5, 21.5, 1.0]
+
+    [minute] = get_history("controller", "action", start, start + timedelta(minutes=5), Resolution.MINUTE)
+    assert (minute.time, minute.count, minute.min, minute.max) == (datetime(2024, 1, 1, 12, 0), 3, 1.0, 21.5)
+    assert minute.avg == 43.0 / 3
+
+    assert get_history("other", "action", start, start + timedelta(minutes=5), Resolution.RAW) == []
+
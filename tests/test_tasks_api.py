@@ -0,0 +1,38 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.v1 import tasks
+from db.document_cache import action_cache, smart_controller_cache
+from db.models import Action, SmartController, Task, TaskType
+from tools.scheduler.scheduler import scheduler, task_job_id
+
+
+def test_task_deleted_before_its_job_id_is_written(database, monkeypatch):
+    action_cache.clear()
+    smart_controller_cache.clear()
+    # Leaves job_id empty in the database like a write buffer that was not flushed yet
+    monkeypatch.setattr("tools.scheduler.scheduler.write_buffer.set", lambda document, **fields: None)
+    action = Action(name="light on", path="/on", description="")
+    action.save()
+    controller = SmartController(name="hall", address="hall.test", actions=[action])
+    controller.save()
+
+    app = FastAPI()
+    app.include_router(tasks.router, prefix="/tasks")
+    client = TestClient(app)
+    created = client.post("/tasks/", json={"type": "daily", "action_id": str(action.id),
+                                           "smart_controller_id": str(controller.id), "minute": 0, "hour": 7,
+                                           "week_day": 0, "month_day": 1}).json()
+    assert Task.objects.get(id=created["id"]).job_id == ""
+    assert scheduler.get_job(f"task:{created['id']}") is not None
+
+    response = client.delete("/tasks/", params={"task_id": created["id"]})
+    assert response.status_code == 200
+    assert scheduler.get_job(f"task:{created['id']}") is None
+    assert Task.objects(id=created["id"]).count() == 0
+
+    # A task whose job is already gone is still deleted
+    task = Task(smart_controller=controller, action=action, type=TaskType.DAILY, minute=0, hour=8, week_day=0,
+                month_day=1, job_id="task:stale").save()
+    assert client.delete("/tasks/", params={"task_id": str(task.id)}).status_code == 200
+    assert scheduler.get_job(task_job_id(task)) is None
@@ -0,0 +1,78 @@
+from types import SimpleNamespace
+
+import pytest
+
+from tools.automation_runner.compiled_graph import CompiledAutomation, CompiledNode
+from tools.automation_runner.trigger_index import TriggerIndex
+
+
+def _automation(automation_id: str, roots, is_active: bool = True) -> CompiledAutomation:
+    nodes = {node_id: CompiledNode(id=node_id, smart_controller_id=controller_id, action_id=action_id,
+                                   smart_controller=None, action=None)
+             for node_id, controller_id, action_id in roots}
+    return CompiledAutomation(id=automation_id, name=automation_id, is_active=is_active, nodes=nodes,
+                              roots=list(nodes))
+
+
+@pytest.fixture
+def graphs(monkeypatch):
+    graphs = {}
+    monkeypatch.setattr("tools.automation_runner.trigger_index.graph_cache",
+                        SimpleNamespace(get=lambda automation_id: graphs.get(automation_id)))
+    return graphs
+
+
+def test_refresh_indexes_the_roots_of_an_automation(graphs):
+    index = TriggerIndex()
+    graphs["a"] = _automation("a", [("a-1", "controller", "on"), ("a-2", "controller", "on"),
+                                    ("a-3", "controller", "off")])
+    graphs["b"] = _automation("b", [("b-1", "controller", "on")])
+    index.refresh("a")
+    index.refresh("b")
+
+    assert sorted(index.lookup("controller", "on")) == [("a", ["a-1", "a-2"]), ("b", ["b-1"])]
+    assert index.lookup("controller", "off") == [("a", ["a-3"])]
+    assert index.lookup("other", "on") == []
+
+
+def test_refresh_replaces_the_previous_roots(graphs):
+    index = TriggerIndex()
+    graphs["a"] = _automation("a", [("a-1", "controller", "on")])
+    index.refresh("a")
+    graphs["a"] = _automation("a", [("a-1", "controller", "off")])
+    index.refresh("a")
+
+    assert index.lookup("controller", "on") == []
+    assert index.lookup("controller", "off") == [("a", ["a-1"])]
+    assert dict(index._roots).keys() == {("controller", "off")}
+
+
+def test_inactive_and_deleted_automations_are_dropped(graphs):
+    index = TriggerIndex()
+    graphs["a"] = _automation("a", [("a-1", "controller", "on")])
+    graphs["b"] = _automation("b", [("b-1", "controller", "on")])
+    index.refresh("a")
+    index.refresh("b")
+
+    graphs["a"] = _automation("a", [("a-1", "controller", "on")], is_active=False)
+    index.refresh("a")
+    assert index.lookup("controller", "on") == [("b", ["b-1"])]
+
+    del graphs["b"]
+    index.refresh("b")
+    assert index.lookup("controller", "on") == []
+
+    index.remove("missing")
+    assert not index._roots and not index._keys_by_automation
+
+
+def test_remove_leaves_other_automations_on_the_same_trigger(graphs):
+    index = TriggerIndex()
+    graphs["a"] = _automation("a", [("a-1", "controller", "on")])
+    graphs["b"] = _automation("b", [("b-1", "controller", "on"), ("b-2", "controller", "off")])
+    index.refresh("a")
+    index.refresh("b")
+
+    index.remove("b")
+    assert index.lookup("controller", "on") == [("a", ["a-1"])]
+    assert index.lookup("controller", "off") == []
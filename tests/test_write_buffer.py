@@ -0,0 +1,50 @@
+from pymongo.errors import AutoReconnect
+
+from db.scheduled_task import ScheduledTask
+from db.write_buffer import WriteBuffer
+
+
+def _buffer() -> WriteBuffer:
+    buffer = WriteBuffer(flush_interval=60, max_pending=100)
+    # Flushed by the tests only
+    buffer._thread = object()
+    return buffer
+
+
+def test_updates_to_one_document_are_merged(database):
+    task = ScheduledTask(minutes_to_run=5)
+    task.save()
+    buffer = _buffer()
+    buffer.inc(task, retires_count=1)
+    buffer.inc(task, retires_count=2)
+    buffer.set(task, job_id="first")
+    buffer.set(task, job_id="second", is_active=False)
+    buffer.flush()
+
+    task.reload()
+    assert (task.retires_count, task.job_id, task.is_active) == (3, "second", False)
+    assert buffer.stats.documents_written == 1
+
+
+def test_failed_flush_is_retried_without_losing_newer_updates(database, monkeypatch):
+    task = ScheduledTask(minutes_to_run=5)
+    task.save()
+    buffer = _buffer()
+    buffer.inc(task, retires_count=1)
+    buffer.set(task, job_id="old", is_active=False)
+
+    def failing_bulk_write(*args, **kwargs):
+        # Updates added by another thread while the batch is being written
+        buffer.inc(task, retires_count=1)
+        buffer.set(task, job_id="new")
+        raise AutoReconnect("connection lost")
+
+    monkeypatch.setattr(type(ScheduledTask._get_collection()), "bulk_write", failing_bulk_write)
+    buffer.flush()
+    monkeypatch.undo()
+    assert buffer.stats.requeued == 1
+    assert ScheduledTask.objects.get(id=task.id).retires_count == 0
+
+    buffer.flush()
+    task.reload()
+    assert (task.retires_count, task.job_id, task.is_active) == (2, "new", False)
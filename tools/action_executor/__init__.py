@@ -0,0 +1 @@
+from .action_executor import executor, startup_event, shutdown_event
@@ -0,0 +1,160 @@
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import time
+import urllib.parse
+from typing import Coroutine, Dict, Optional, Set
+
+import httpx
+
+from config.settings import settings
+from db.models import Action, SmartController
+from tools.metrics.instrumentation import without_request
+from tools.metrics.metrics import device_request_seconds
+from tools.metrics.profiler import record_device_call
+from tools.resilience import CircuitOpenError, circuit_breakers
+
+
+class ActionExecutor:
+    """
+    Runs device HTTP calls on a dedicated asyncio loop. Each controller address gets its own pooled,
+    keep-alive client and a semaphore bounding the number of requests in flight against it.
+    """
+
+    def __init__(self, connect_timeout: float, read_timeout: float, max_in_flight_per_controller: int):
+        self.timeout = httpx.Timeout(connect=connect_timeout, read=read_timeout, write=read_timeout, pool=None)
+        self.max_in_flight_per_controller = max_in_flight_per_controller
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._background_tasks: Set[asyncio.Task] = set()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None:
+            self.start()
+        return self._loop
+
+    def start(self):
+        with self._start_lock:
+            if self._loop is not None:
+                return
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._loop.run_forever, name="action-executor", daemon=True)
+            self._thread.start()
+        logging.info("Action executor started")
+
+    def stop(self):
+        with self._start_lock:
+            if self._loop is None:
+                return
+            asyncio.run_coroutine_threadsafe(self._close_clients(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._loop = None
+            self._thread = None
+        logging.info("Action executor stopped")
+
+    def submit(self, coroutine: Coroutine) -> concurrent.futures.Future:
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def spawn(self, coroutine: Coroutine) -> asyncio.Task:
+        # Must be called from the executor loop. Keeps a reference so fire-and-forget tasks are not collected.
+        # Spawned work outlives the request that started it and is not counted towards it
+        task = self.loop.create_task(without_request(coroutine))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+
+    def run_sync(self, coroutine: Coroutine):
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("Blocking call on the action executor loop, await the coroutine instead")
+        return self.submit(coroutine).result()
+
+    async def execute_async(self, controller: SmartController, action: Action) -> httpx.Response:
+        breaker = circuit_breakers.get(str(controller.id))
+        if not breaker.allow():
+            raise CircuitOpenError(f"Controller {controller.name} is unavailable, "
+                                   f"retry in {breaker.retry_after():.0f}s")
+
+        url = urllib.parse.urljoin(f"http://{controller.address}", action.path)
+        try:
+            async with self._semaphore(controller.address):
+                started = time.perf_counter()
+                try:
+                    response = await self._client(controller.address).get(url)
+                except httpx.TransportError as e:
+                    elapsed = time.perf_counter() - started
+                    device_request_seconds.observe(elapsed, controller=controller.name, action=action.name,
+                                                   status=type(e).__name__)
+                    record_device_call(elapsed)
+                    raise
+                elapsed = time.perf_counter() - started
+                device_request_seconds.observe(elapsed, controller=controller.name, action=action.name,
+                                               status=response.status_code)
+                record_device_call(elapsed)
+        except httpx.TransportError:
+            breaker.record_failure()
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
+
+    async def probe(self, address: str, timeout: float) -> float:
+        """
+        Cheap reachability check of a controller address, returns the round trip in seconds.
+        Any HTTP response counts as reachable.
+        """
+        started = time.perf_counter()
+        await self._client(address).get(f"http://{address}/", timeout=timeout)
+        return time.perf_counter() - started
+
+    def execute(self, controller: SmartController, action: Action) -> httpx.Response:
+        return self.run_sync(self.execute_async(controller=controller, action=action))
+
+    def _client(self, address: str) -> httpx.AsyncClient:
+        client = self._clients.get(address)
+        if client is None:
+            limits = httpx.Limits(max_connections=self.max_in_flight_per_controller,
+                                  max_keepalive_connections=self.max_in_flight_per_controller)
+            client = httpx.AsyncClient(timeout=self.timeout, limits=limits)
+            self._clients[address] = client
+        return client
+
+    def _semaphore(self, address: str) -> asyncio.Semaphore:
+        semaphore = self._semaphores.get(address)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_in_flight_per_controller)
+            self._semaphores[address] = semaphore
+        return semaphore
+
+    async def _close_clients(self):
+        for task in list(self._background_tasks):
+            task.cancel()
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+        self._semaphores.clear()
+
+
+executor = ActionExecutor(connect_timeout=settings.ACTION_CONNECT_TIMEOUT,
+                          read_timeout=settings.ACTION_READ_TIMEOUT,
+                          max_in_flight_per_controller=settings.ACTION_MAX_IN_FLIGHT_PER_CONTROLLER)
+
+
+def startup_event():
+    executor.start()
+
+
+def shutdown_event():
+    executor.stop()
@@ -1,87 +1,215 @@
-import random
+import asyncio
 import urllib.parse
 import logging
 from datetime import datetime, timedelta
-from typing import Callable, Any, List
+from typing import Awaitable, Callable, Any, Optional
 
 import pytz
-import requests
+import httpx
 from apscheduler.job import Job
 from apscheduler.schedulers.background import BackgroundScheduler
 
-from db.automation import Automation, AutomationNode
+from config.settings import settings
 from db.models import Action, SmartController
 from db.scheduled_task import ScheduledTask
+from db.write_buffer import write_buffer
+from tools.action_executor import executor
 from tools.automation_runner.automation_runner import AutomationRunner
+from tools.automation_runner.compiled_graph import graph_cache
+from tools.automation_runner.trigger_index import trigger_index
+from tools.event_bus import event_bus, ACTIONS, SCHEDULED_TASKS, SENSORS
+from tools.metrics.metrics import scheduled_task_runs, sensor_reads
+from tools.health_monitor import health_monitor
+from tools.resilience import ControllerUnavailableError, RetryPolicy, circuit_breakers
+from tools.sensor_cache import sensor_cache, SensorReading
+from tools.sensor_history import record_reading_safe
 
-RETRY_THRESHOLD = 5
-RETRY_WINDOW = 10
+# Referenced by name so the retry job stays serializable for persistent job stores
+SCHEDULED_TASK_JOB = "tools.scheduler.scheduler:run_scheduled_task"
+# Alias of the scheduler executor for device jobs, tools.scheduler.scheduler.DEVICE_EXECUTOR
+SCHEDULED_TASK_EXECUTOR = "devices"
+SCHEDULED_TASK_JOB_PREFIX = "scheduled_task:"
 
 
-def run(controller: SmartController, action: Action, is_part_of_automation=False):
+def _ensure_reachable(controller: SmartController):
+    if health_monitor.is_down(str(controller.id)):
+        raise ControllerUnavailableError(f"Controller {controller.name} is down according to its health checks")
+
+
+async def run_async(controller: SmartController, action: Action, is_part_of_automation=False) -> httpx.Response:
+    response = await _execute(controller=controller, action=action)
+    event_bus.publish(f"{ACTIONS}/{controller.id}/{action.id}", "action_run", retain=True,
+                      status_code=response.status_code, is_success=response.is_success,
+                      is_part_of_automation=is_part_of_automation)
+    if response.is_success and not is_part_of_automation:
+        try:
+            await dispatch_automations(controller=controller, action=action, response_text=response.text)
+        except Exception as e:
+            logging.error(e)
+    return response
+
+
+async def _execute(controller: SmartController, action: Action) -> httpx.Response:
     try:
+        _ensure_reachable(controller=controller)
         url = urllib.parse.urljoin(f"http://{controller.address}", action.path)
         logging.info(f"Running action: {action.name} on controller: {controller.name} -> {url}")
-        response = requests.get(url)
-        if response.ok and not is_part_of_automation:
-            controller_id_str = str(controller.id)
-            action_id_str = str(action.id)
-
-            all_automations = Automation.objects()
-            automations = [automation for automation in all_automations if
-                           len([node.smart_controller_id == controller_id_str and node.action_id == action_id_str for
-                                node
-                                in automation.nodes]) > 0]
-            logging.info(
-                f"Found {len(automations)} automations with action: {action.name} of controller: {controller.name}")
-            for automation in automations:
-                roots: List[AutomationNode] = automation.get_roots()
-                try:
-                    relevant_node = next(iter([node for node in roots if
-                                               node.smart_controller_id == controller_id_str and node.action_id == action_id_str]),
-                                         None)
-                except StopIteration:
-                    relevant_node = None
-                if relevant_node:
-                    runner = AutomationRunner(automation=automation, run_function=run)
-                    runner.next(previous_step_response=response.text, node=relevant_node)
-        return response
+        return await executor.execute_async(controller=controller, action=action)
 
+    except ControllerUnavailableError as e:
+        logging.warning(e)
+        return httpx.Response(status_code=503)
     except Exception as e:
         logging.error(e)
-        fake_response = requests.Response()
-        fake_response.status_code = 500
-        return fake_response
+        return httpx.Response(status_code=500)
 
 
-def scheduled_run(run_func: Callable, task: ScheduledTask, scheduler: BackgroundScheduler) -> Any:
-    if task.retires_count == RETRY_THRESHOLD:
-        task.is_active = False
-        task.save()
-        return
+def run(controller: SmartController, action: Action, is_part_of_automation=False) -> httpx.Response:
+    return executor.run_sync(run_async(controller=controller, action=action,
+                                       is_part_of_automation=is_part_of_automation))
+
 
-    result = run_func(task.smart_controller, task.action)
+async def dispatch_automations(controller: SmartController, action: Action, response_text: str) -> int:
+    matches = trigger_index.lookup(smart_controller_id=str(controller.id), action_id=str(action.id))
+    logging.info(f"Found {len(matches)} automations with action: {action.name} of controller: {controller.name}")
+    started = 0
+    for automation_id, root_ids in matches:
+        automation = graph_cache.get_cached(automation_id)
+        if automation is None:
+            # Compiling hits the database, keep it off the executor loop
+            automation = await asyncio.get_running_loop().run_in_executor(None, graph_cache.get, automation_id)
+        if not automation:
+            continue
+        runner = AutomationRunner(automation=automation, run_function=run_async, read_function=read_sensor_async,
+                                  wait_function=wait_for_update_async)
+        for node_id in root_ids:
+            node = automation.nodes.get(node_id)
+            if node is None:
+                continue
+            if runner.feeds_active_loop(node):
+                # The value reaches the looping run through the sensor cache, see wait_for_update_async
+                logging.debug(f"Automation {automation.name} is already looping on {node.id}, no new run")
+                continue
+            state = runner.begin(node)
+            executor.spawn(runner.start(previous_step_response=response_text, node=node, state=state))
+            started += 1
+    return started
 
-    if result.ok:
-        task.is_active = False
+
+async def ingest_async(controller: SmartController, action: Action, text: str) -> int:
+    """
+    Handles a value pushed by the controller like a fresh read of <action>, without calling the device.
+    Returns the number of automation runs it started.
+    """
+    sensor_cache.store(key=(str(controller.id), str(action.id)), text=text, pushed=True)
+    if action.is_sensor:
+        asyncio.get_running_loop().run_in_executor(None, record_reading_safe, str(controller.id), str(action.id),
+                                                   text)
+        event_bus.publish(f"{SENSORS}/{controller.id}/{action.id}", "sensor_reading", retain=True,
+                          only_changes=True, text=text)
     else:
-        task.retires_count += 1
+        event_bus.publish(f"{ACTIONS}/{controller.id}/{action.id}", "state_pushed", retain=True,
+                          only_changes=True, text=text)
+    return await dispatch_automations(controller=controller, action=action, response_text=text)
+
+
+async def wait_for_update_async(controller: SmartController, action: Action, timeout: float) -> Optional[str]:
+    reading = await sensor_cache.wait_for_update(key=(str(controller.id), str(action.id)), timeout=timeout)
+    return reading.text if reading is not None else None
 
-        job: Job = scheduler.add_job(scheduled_run, 'date',
-                                     run_date=datetime.now(pytz.UTC) + timedelta(seconds=RETRY_WINDOW),
-                                     args=[run_func, task, scheduler],
-                                     name=f"{task.smart_controller.name}->{task.action.name}")
-        task.job_id = job.id
-    task.save()
 
+async def scheduled_run_async(run_func: Callable[..., Awaitable[httpx.Response]], task: ScheduledTask,
+                              scheduler: BackgroundScheduler) -> Any:
+    loop = asyncio.get_running_loop()
+    # Both steps may add a retry job, which writes to the job store when it is persistent
+    if not await loop.run_in_executor(None, _start_scheduled_run, task, scheduler):
+        return
+    result = await run_func(task.smart_controller, task.action)
+    await loop.run_in_executor(None, _finish_scheduled_run, task, scheduler, result)
     return result
 
 
-def read_sensor(controller: SmartController, action: Action) -> float:
-    url = urllib.parse.urljoin(f"http://{controller.address}", action.path)
-    # logging.info(f"Running sensor reading: {action.name} on controller: {controller.name} -> {url}")
-    response = requests.get(url)
-    if response.ok:
-        return float(response.text)
+def _start_scheduled_run(task: ScheduledTask, scheduler: BackgroundScheduler) -> bool:
+    topic = f"{SCHEDULED_TASKS}/{task.id}"
+    policy = RetryPolicy.for_task(task)
+    if policy.exhausted(attempts=task.retires_count):
+        write_buffer.set(task, is_active=False)
+        scheduled_task_runs.inc(outcome="retries_exhausted")
+        event_bus.publish(topic, "retries_exhausted", final=True, attempts=task.retires_count)
+        return False
+
+    if health_monitor.is_down(str(task.smart_controller.id)):
+        due = task.inserted_at + timedelta(minutes=task.minutes_to_run)
+        if (datetime.utcnow() - due).total_seconds() >= settings.RETRY_MAX_DEFERRAL:
+            logging.warning(f"Giving up scheduled task: '{task.id}', controller {task.smart_controller.name} "
+                            f"stayed down")
+            write_buffer.set(task, is_active=False)
+            scheduled_task_runs.inc(outcome="deferral_expired")
+            event_bus.publish(topic, "deferral_expired", final=True, attempts=task.retires_count)
+            return False
+        # Defer without spending an attempt, the controller is known to be unreachable
+        logging.info(f"Deferring scheduled task: '{task.id}', controller {task.smart_controller.name} is down")
+        _schedule_retry(task=task, scheduler=scheduler, delay=health_monitor.interval)
+        scheduled_task_runs.inc(outcome="deferred")
+        event_bus.publish(topic, "deferred", retain=True, delay=health_monitor.interval)
+        return False
+    return True
+
+
+def _finish_scheduled_run(task: ScheduledTask, scheduler: BackgroundScheduler, result: httpx.Response):
+    topic = f"{SCHEDULED_TASKS}/{task.id}"
+    # Attempts are the device calls made so far, this one included
+    attempts = task.retires_count + 1
+    if result.is_success:
+        write_buffer.set(task, is_active=False)
+        scheduled_task_runs.inc(outcome="succeeded")
+        event_bus.publish(topic, "succeeded", final=True, attempts=attempts)
     else:
-        raise Exception(f"Failed to read sensor {action.name} on url {action.path}")
+        delay = RetryPolicy.for_task(task).delay(attempt=task.retires_count)
+        # No point retrying before the controller's circuit lets a probe through
+        delay = max(delay, circuit_breakers.get(str(task.smart_controller.id)).retry_after())
+        # Not buffered, the retry job reloads the task and must see the spent attempt however soon it runs
+        ScheduledTask.objects(id=task.id).update_one(inc__retires_count=1)
+        task.retires_count = attempts
+        _schedule_retry(task=task, scheduler=scheduler, delay=delay)
+        scheduled_task_runs.inc(outcome="retry_scheduled")
+        event_bus.publish(topic, "retry_scheduled", retain=True, attempts=attempts, delay=delay,
+                          status_code=result.status_code)
+
+
+def _schedule_retry(task: ScheduledTask, scheduler: BackgroundScheduler, delay: float):
+    job: Job = scheduler.add_job(SCHEDULED_TASK_JOB, 'date',
+                                 run_date=datetime.now(pytz.UTC) + timedelta(seconds=delay),
+                                 args=[str(task.id)],
+                                 id=f"{SCHEDULED_TASK_JOB_PREFIX}{task.id}",
+                                 executor=SCHEDULED_TASK_EXECUTOR,
+                                 replace_existing=True,
+                                 misfire_grace_time=None,
+                                 name=f"{task.smart_controller.name}->{task.action.name}")
+    if task.job_id != job.id:
+        write_buffer.set(task, job_id=job.id)
+
+
+async def read_sensor_async(controller: SmartController, action: Action) -> SensorReading:
+    async def fetch() -> str:
+        _ensure_reachable(controller=controller)
+        url = urllib.parse.urljoin(f"http://{controller.address}", action.path)
+        # logging.info(f"Running sensor reading: {action.name} on controller: {controller.name} -> {url}")
+        response = await executor.execute_async(controller=controller, action=action)
+        if response.is_success:
+            # Only fresh device readings are recorded, never cache hits
+            asyncio.get_running_loop().run_in_executor(None, record_reading_safe, str(controller.id),
+                                                       str(action.id), response.text)
+            event_bus.publish(f"{SENSORS}/{controller.id}/{action.id}", "sensor_reading", retain=True,
+                              only_changes=True, text=response.text)
+            return response.text
+        else:
+            raise Exception(f"Failed to read sensor {action.name} on url {action.path}")
+
+    reading = await sensor_cache.read(key=(str(controller.id), str(action.id)), fetch=fetch)
+    sensor_reads.inc(cache="miss" if not reading.cached else "pushed" if reading.pushed else "hit")
+    return reading
+
+
+def read_sensor(controller: SmartController, action: Action) -> SensorReading:
+    return executor.run_sync(read_sensor_async(controller=controller, action=action))
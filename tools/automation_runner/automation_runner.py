@@ -1,64 +1,241 @@
+import asyncio
 import logging
 import time
-from typing import Callable
+import uuid
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Optional, Tuple
 
-from db.automation import Automation, AutomationNode, ConditionType, ReturnValueType, ConditionEdge
-from db.models import SmartController, Action
+from config.settings import settings
+from db.automation import ConditionType, ReturnValueType
+from tools.automation_runner.compiled_graph import CompiledAutomation, CompiledNode, CompiledEdge
+from tools.automation_runner.tracing import RunTrace, Span, trace_store
 from tools.automation_runner.utils import _string_to_bool, _string_to_float, _apply_comparison
+from tools.event_bus import event_bus, AUTOMATIONS
+from tools.metrics.metrics import automation_run_seconds, automation_step_seconds
+
+
+@dataclass
+class AutomationRun:
+    """
+    State of one execution of an automation, shared by every branch of that execution.
+    """
+    automation_id: str
+    run_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    started_at: float = field(default_factory=time.monotonic)
+    root_id: str = ""
+    loop_iterations: Dict[str, int] = field(default_factory=dict)
+    trace: Optional[RunTrace] = None
+
+
+# Runs in progress per (automation id, root node id), only used on the loop running the automations
+_active_runs: Dict[Tuple[str, str], int] = {}
 
 
 class AutomationRunner:
-    def __init__(self, automation: Automation, run_function: Callable):
-        self.automation: Automation = automation
+    def __init__(self, automation: CompiledAutomation, run_function: Callable[..., Awaitable],
+                 read_function: Callable[..., Awaitable],
+                 wait_function: Optional[Callable[..., Awaitable[Optional[str]]]] = None,
+                 poll_interval: float = settings.AUTOMATION_LOOP_POLL_INTERVAL,
+                 max_loop_duration: float = settings.AUTOMATION_LOOP_MAX_DURATION):
+        self.automation: CompiledAutomation = automation
         self.run_function = run_function
+        self.read_function = read_function
+        # Waits up to <timeout> for a new value of a node, lets loops react to pushed values instead of polling
+        self.wait_function = wait_function
+        self.poll_interval = poll_interval
+        self.max_loop_duration = max_loop_duration
+        self.max_parallel_branches = automation.max_parallel_branches or settings.AUTOMATION_MAX_PARALLEL_BRANCHES
+        self._semaphore = None
+
+    def feeds_active_loop(self, node: CompiledNode) -> bool:
+        """
+        True while an earlier run started from <node> is in progress and <node> is the source of a loop edge. New
+        values of <node> reach that run through wait_function, a run started for them would act on them again.
+        """
+        return _active_runs.get((self.automation.id, node.id), 0) > 0 and any(
+            edge.condition.is_loop for edge in self.automation.get_edges(node_id=node.id))
+
+    def begin(self, node: CompiledNode) -> AutomationRun:
+        """
+        Registers a run from <node>, to be passed to start(). Callers that spawn the run register it before it
+        starts so feeds_active_loop sees it right away.
+        """
+        state = AutomationRun(automation_id=self.automation.id, root_id=node.id)
+        state.trace = trace_store.start(run_id=state.run_id, automation_id=self.automation.id,
+                                        automation_name=self.automation.name)
+        key = (self.automation.id, node.id)
+        _active_runs[key] = _active_runs.get(key, 0) + 1
+        return state
 
-    def next(self, previous_step_response, node: AutomationNode):
+    async def start(self, previous_step_response, node: CompiledNode,
+                    state: Optional[AutomationRun] = None) -> AutomationRun:
+        state = state or self.begin(node)
+        try:
+            return await self._start(previous_step_response=previous_step_response, node=node, state=state)
+        finally:
+            key = (self.automation.id, state.root_id)
+            _active_runs[key] -= 1
+            if not _active_runs[key]:
+                del _active_runs[key]
+
+    async def _start(self, previous_step_response, node: CompiledNode, state: AutomationRun) -> AutomationRun:
+        self._publish(state, "run_started", trigger_node_id=node.id)
+        try:
+            await self.next(previous_step_response=previous_step_response, node=node, state=state)
+        except Exception as e:
+            logging.exception(f"Automation {self.automation.name} run {state.run_id} failed: {e}")
+            automation_run_seconds.observe(time.monotonic() - state.started_at, automation=self.automation.name,
+                                           outcome="failed")
+            trace_store.finish(state.trace, status="failed")
+            self._publish(state, "run_failed", error=str(e))
+            return state
+        duration = time.monotonic() - state.started_at
+        automation_run_seconds.observe(duration, automation=self.automation.name, outcome="finished")
+        trace_store.finish(state.trace, status="finished")
+        self._publish(state, "run_finished", duration=round(duration, 3))
+        return state
+
+    def _publish(self, state: AutomationRun, event_type: str, **data):
+        event_bus.publish(f"{AUTOMATIONS}/{self.automation.id}/{state.run_id}", event_type,
+                          automation_id=self.automation.id, run_id=state.run_id, **data)
+
+    async def next(self, previous_step_response, node: CompiledNode, state: AutomationRun):
         # All the edges that their source is <node>
-        edges = self.automation.get_edges(node=node)
+        edges = self.automation.get_edges(node_id=node.id)
+
+        # A failing branch is logged and does not stop its siblings, in sequential and parallel mode alike
+        if self.automation.is_sequential or len(edges) <= 1:
+            for edge in edges:
+                try:
+                    await self._follow(previous_step_response=previous_step_response, edge=edge, node=node,
+                                       state=state)
+                except Exception as e:
+                    self._branch_failed(edge=edge, state=state, error=e)
+            return
+
+        # Independent branches run concurrently, the fan-out takes as long as its slowest branch
+        results = await asyncio.gather(*[
+            self._follow(previous_step_response=previous_step_response, edge=edge, node=node, state=state)
+            for edge in edges
+        ], return_exceptions=True)
+        for edge, result in zip(edges, results):
+            if isinstance(result, Exception):
+                self._branch_failed(edge=edge, state=state, error=result)
 
-        for edge in edges:
+    def _branch_failed(self, edge: CompiledEdge, state: AutomationRun, error: Exception):
+        logging.error(f"Automation {self.automation.name} run {state.run_id}: edge {edge.id} failed: {error}")
+
+    async def _follow(self, previous_step_response, edge: CompiledEdge, node: CompiledNode, state: AutomationRun):
+        # The edge span covers everything downstream of it, the target node and its edges are its children
+        with state.trace.span("edge", f"{edge.source_id} -> {edge.target_id}", edge_id=edge.id,
+                              condition_type=edge.condition.condition_type.value) as span:
             if edge.condition.condition_type == ConditionType.BY_TRIGGER:
-                self._handle_by_trigger(edge=edge)
+                await self._handle_by_trigger(edge=edge, state=state)
             elif edge.condition.condition_type == ConditionType.BY_VALUE:
-                self._handle_by_value(previous_step_response=previous_step_response, edge=edge, node=node)
+                await self._handle_by_value(previous_step_response=previous_step_response, edge=edge, node=node,
+                                            state=state, span=span)
             else:
                 raise ValueError(f"Unsupported condition type {edge.condition.condition_type}")
 
-    def _handle_by_trigger(self, edge: ConditionEdge):
-        response = self._run(edge.target.smart_controller_id, edge.target.action_id)
-        self.next(previous_step_response=response, node=edge.target)
+    async def _handle_by_trigger(self, edge: CompiledEdge, state: AutomationRun):
+        target = self.automation.nodes[edge.target_id]
+        response = await self._run(node=target, state=state)
+        await self.next(previous_step_response=response, node=target, state=state)
 
-    def _handle_by_value(self, previous_step_response, edge: ConditionEdge, node: AutomationNode):
-        if edge.condition.value_type == ReturnValueType.BOOLEAN:
+    async def _handle_by_value(self, previous_step_response, edge: CompiledEdge, node: CompiledNode,
+                               state: AutomationRun, span: Span):
+        target = self.automation.nodes[edge.target_id]
+        loop_deadline = time.monotonic() + self.max_loop_duration
+        while True:
             try:
-                if _string_to_bool(string=previous_step_response) == edge.condition.value_boolean:
-                    response = self._run(edge.target.smart_controller_id, edge.target.action_id)
-                    self.next(previous_step_response=response, node=edge.target)
-                elif edge.condition.is_loop:
-                    time.sleep(2)
-                    response = self._run(smart_controller_id=node.smart_controller_id, action_id=node.action_id)
-                    self.next(previous_step_response=response, node=node)
-
+                condition_met = self._is_condition_met(edge=edge, response=previous_step_response)
             except ValueError as e:
                 logging.info(f"{e}: "
-                             f"{previous_step_response} from action: {edge.target.action_id} "
-                             f"of smart controller: {edge.target.smart_controller_id}")
+                             f"{previous_step_response} from action: {node.action_id} "
+                             f"of smart controller: {node.smart_controller_id}")
+                span.attributes.update(condition_met=False, error=str(e), value=previous_step_response)
+                return
+
+            span.attributes.update(condition_met=condition_met, value=previous_step_response,
+                                   iterations=state.loop_iterations.get(edge.id, 0))
+            if condition_met:
+                response = await self._run(node=target, state=state)
+                await self.next(previous_step_response=response, node=target, state=state)
+                return
+            if not edge.condition.is_loop:
+                self._publish(state, "condition_not_met", edge_id=edge.id)
+                return
+            if time.monotonic() >= loop_deadline:
+                logging.info(f"Automation {self.automation.name} run {state.run_id}: loop on edge {edge.id} "
+                             f"gave up after {state.loop_iterations.get(edge.id, 0)} iterations")
+                self._publish(state, "loop_timed_out", edge_id=edge.id,
+                              iterations=state.loop_iterations.get(edge.id, 0))
+                span.attributes["timed_out"] = True
+                return
+
+            # Wait for the source node to change without holding a thread or growing the stack
+            state.loop_iterations[edge.id] = state.loop_iterations.get(edge.id, 0) + 1
+            previous_step_response = await self._wait_for_update(node=node, state=state)
+            if previous_step_response is None:
+                # Nothing was pushed within the poll interval, poll the source node
+                previous_step_response = await self._run(node=node, state=state)
+
+    async def _wait_for_update(self, node: CompiledNode, state: AutomationRun) -> Optional[str]:
+        if self.wait_function is None or node.smart_controller is None or node.action is None:
+            await asyncio.sleep(self.poll_interval)
+            return None
+        with state.trace.span("wait", node.id, node_id=node.id) as span:
+            response = await self.wait_function(controller=node.smart_controller, action=node.action,
+                                                timeout=self.poll_interval)
+            span.attributes["pushed"] = response is not None
+        if response is not None:
+            self._publish(state, "step", node_id=node.id, response=response, pushed=True)
+        return response
+
+    @staticmethod
+    def _is_condition_met(edge: CompiledEdge, response: str) -> bool:
+        if edge.condition.value_type == ReturnValueType.BOOLEAN:
+            return _string_to_bool(string=response) == edge.condition.value_boolean
         elif edge.condition.value_type == ReturnValueType.NUMBER:
-            try:
-                # convert response to float
-                number = _string_to_float(previous_step_response)
-
-                if _apply_comparison(edge.condition.operator, number, edge.condition.value_number):
-                    response = self._run(edge.target.smart_controller_id, edge.target.action_id)
-                    self.next(previous_step_response=response, node=edge.target)
-                elif edge.condition.is_loop:
-                    time.sleep(2)
-                    response = self._run(smart_controller_id=node.smart_controller_id, action_id=node.action_id)
-                    self.next(previous_step_response=response, node=node)
-            except ValueError as e:
-                logging.info(e)
+            # convert response to float
+            number = _string_to_float(response)
+            if number is None:
+                raise ValueError("Non number value returned")
+            return _apply_comparison(edge.condition.operator, number, edge.condition.value_number)
+        raise ValueError(f"Unsupported value type {edge.condition.value_type}")
+
+    async def _run(self, node: CompiledNode, state: AutomationRun) -> str:
+        if node.smart_controller is None or node.action is None:
+            logging.warning(f"Automation {self.automation.name}: node {node.id} "
+                            f"refers to a missing controller or action")
+            return ""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_parallel_branches)
+        kind = "sensor" if node.action.is_sensor else "action"
+        with automation_step_seconds.time(automation=self.automation.name, kind=kind), \
+                state.trace.span("node", node.action.name, node_id=node.id, step=kind,
+                                 smart_controller=node.smart_controller.name) as span:
+            return await self._run_step(node=node, state=state, span=span)
 
-    def _run(self, smart_controller_id: str, action_id: str):
-        smart_controller = SmartController.objects(id=smart_controller_id).first()
-        action = Action.objects(id=action_id).first()
-        return self.run_function(controller=smart_controller, action=action, is_part_of_automation=True).text
+    async def _run_step(self, node: CompiledNode, state: AutomationRun, span: Span) -> str:
+        # Only device calls hold a slot, so nested fan-outs and loop waits cannot starve each other
+        queued = time.perf_counter()
+        async with self._semaphore:
+            span.attributes["queued_ms"] = round((time.perf_counter() - queued) * 1000, 3)
+            if node.action.is_sensor:
+                # Sensor reads go through the shared sensor cache so polling loops coalesce with other readers
+                try:
+                    reading = await self.read_function(controller=node.smart_controller, action=node.action)
+                except Exception as e:
+                    logging.error(e)
+                    span.attributes["error"] = str(e)
+                    self._publish(state, "step_failed", node_id=node.id, error=str(e))
+                    return ""
+                span.attributes.update(response=reading.text, cached=reading.cached, pushed=reading.pushed)
+                self._publish(state, "step", node_id=node.id, response=reading.text)
+                return reading.text
+            response = await self.run_function(controller=node.smart_controller, action=node.action,
+                                               is_part_of_automation=True)
+        span.attributes.update(status_code=response.status_code, response=response.text)
+        self._publish(state, "step", node_id=node.id, status_code=response.status_code, response=response.text)
+        return response.text
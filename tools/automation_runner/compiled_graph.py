@@ -0,0 +1,121 @@
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from db.automation import Automation, Condition
+from db.automation_graph import load_graph
+from db.document_cache import action_cache, smart_controller_cache
+from db.models import SmartController, Action
+
+
+@dataclass(frozen=True)
+class CompiledNode:
+    id: str
+    smart_controller_id: str
+    action_id: str
+    smart_controller: Optional[SmartController]
+    action: Optional[Action]
+
+
+@dataclass(frozen=True)
+class CompiledEdge:
+    id: str
+    source_id: str
+    target_id: str
+    condition: Condition
+
+
+@dataclass
+class CompiledAutomation:
+    """
+    Read-only, fully resolved form of an automation graph. Walking it never touches the database.
+    """
+    id: str
+    name: str
+    is_active: bool
+    is_sequential: bool = False
+    max_parallel_branches: int = 0
+    nodes: Dict[str, CompiledNode] = field(default_factory=dict)
+    edges_by_source: Dict[str, List[CompiledEdge]] = field(default_factory=dict)
+    roots: List[str] = field(default_factory=list)
+
+    def get_edges(self, node_id: str) -> List[CompiledEdge]:
+        return self.edges_by_source.get(node_id, [])
+
+    def get_roots(self) -> List[CompiledNode]:
+        return [self.nodes[node_id] for node_id in self.roots]
+
+
+def compile_automation(automation_id: str) -> Optional[CompiledAutomation]:
+    automation = Automation.objects(id=automation_id).no_dereference().first()
+    if not automation:
+        return None
+
+    # One read for embedded automations, one per collection for referenced ones
+    graph = load_graph(automation)
+
+    controllers = smart_controller_cache.get_many({node.smart_controller_id for node in graph.nodes})
+    actions = action_cache.get_many({node.action_id for node in graph.nodes})
+
+    compiled = CompiledAutomation(id=str(automation.id), name=automation.name, is_active=automation.is_active,
+                                  is_sequential=automation.is_sequential,
+                                  max_parallel_branches=automation.max_parallel_branches)
+    for node in graph.nodes:
+        compiled.nodes[str(node.id)] = CompiledNode(id=str(node.id),
+                                                    smart_controller_id=node.smart_controller_id,
+                                                    action_id=node.action_id,
+                                                    smart_controller=controllers.get(node.smart_controller_id),
+                                                    action=actions.get(node.action_id))
+
+    targets = set()
+    for edge in graph.edges:
+        source_id, target_id = str(edge.source_id), str(edge.target_id)
+        if source_id not in compiled.nodes or target_id not in compiled.nodes:
+            continue
+        compiled.edges_by_source.setdefault(source_id, []).append(
+            CompiledEdge(id=str(edge.id), source_id=source_id, target_id=target_id, condition=edge.condition))
+        targets.add(target_id)
+
+    compiled.roots = [node_id for node_id in compiled.nodes if node_id not in targets]
+    return compiled
+
+
+class GraphCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._graphs: Dict[str, CompiledAutomation] = {}
+        # Bumped on every invalidation so a compile racing with a change is not cached
+        self._version = 0
+
+    def get(self, automation_id: str) -> Optional[CompiledAutomation]:
+        with self._lock:
+            compiled = self._graphs.get(automation_id)
+            version = self._version
+        if compiled is not None:
+            return compiled
+
+        compiled = compile_automation(automation_id)
+        if compiled is not None:
+            with self._lock:
+                if version == self._version:
+                    self._graphs[automation_id] = compiled
+            logging.debug(f"Compiled automation: {compiled.name} ({len(compiled.nodes)} nodes)")
+        return compiled
+
+    def get_cached(self, automation_id: str) -> Optional[CompiledAutomation]:
+        with self._lock:
+            return self._graphs.get(automation_id)
+
+    def invalidate(self, automation_id: str):
+        with self._lock:
+            self._graphs.pop(automation_id, None)
+            self._version += 1
+
+    def clear(self):
+        with self._lock:
+            self._graphs.clear()
+            self._version += 1
+
+
+graph_cache = GraphCache()
@@ -0,0 +1,141 @@
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from config.settings import settings
+from db.automation_run import AutomationRunTrace
+
+# Span the running branch is in, concurrent branches are separate tasks and each get their own copy
+_current_span: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("automation_span", default=None)
+
+
+@dataclass
+class Span:
+    span_id: str
+    parent_id: Optional[str]
+    # "edge", "node" or "wait"
+    kind: str
+    name: str
+    started_at: datetime
+    duration_ms: Optional[float] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class RunTrace:
+    run_id: str
+    automation_id: str
+    automation_name: str
+    started_at: datetime = field(default_factory=datetime.utcnow)
+    status: str = "running"
+    finished_at: Optional[datetime] = None
+    duration_ms: Optional[float] = None
+    spans: List[Span] = field(default_factory=list)
+    # Spans past max_spans are counted but not kept, long loops would otherwise grow a trace without bound
+    dropped_spans: int = 0
+    max_spans: int = settings.AUTOMATION_TRACE_MAX_SPANS
+
+    @contextmanager
+    def span(self, kind: str, name: str, **attributes):
+        span = Span(span_id=uuid.uuid4().hex[:16], parent_id=_current_span.get(), kind=kind, name=name,
+                    started_at=datetime.utcnow(), attributes=attributes)
+        if len(self.spans) < self.max_spans:
+            self.spans.append(span)
+        else:
+            self.dropped_spans += 1
+        token = _current_span.set(span.span_id)
+        started = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.attributes["error"] = str(e) or type(e).__name__
+            raise
+        finally:
+            span.duration_ms = round((time.perf_counter() - started) * 1000, 3)
+            _current_span.reset(token)
+
+    def finish(self, status: str):
+        self.status = status
+        self.finished_at = datetime.utcnow()
+        self.duration_ms = round((self.finished_at - self.started_at).total_seconds() * 1000, 3)
+
+
+def _to_document(trace: RunTrace, retention_days: int) -> AutomationRunTrace:
+    return AutomationRunTrace(run_id=trace.run_id, automation_id=trace.automation_id,
+                              automation_name=trace.automation_name, status=trace.status,
+                              started_at=trace.started_at, finished_at=trace.finished_at,
+                              duration_ms=trace.duration_ms, spans=[asdict(span) for span in trace.spans],
+                              dropped_spans=trace.dropped_spans,
+                              expires_at=trace.started_at + timedelta(days=retention_days))
+
+
+def _from_document(document: AutomationRunTrace) -> RunTrace:
+    return RunTrace(run_id=document.run_id, automation_id=document.automation_id,
+                    automation_name=document.automation_name, started_at=document.started_at,
+                    status=document.status, finished_at=document.finished_at, duration_ms=document.duration_ms,
+                    spans=[Span(**span) for span in document.spans], dropped_spans=document.dropped_spans)
+
+
+class TraceStore:
+    """
+    Ring buffer of the traces of the last <capacity> runs. With <persist> finished traces are also saved to the
+    automation_runs collection and looked up there once they left the buffer.
+    """
+
+    def __init__(self, capacity: int, persist: bool, retention_days: int):
+        self.capacity = capacity
+        self.persist = persist
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        self._traces: "OrderedDict[str, RunTrace]" = OrderedDict()
+
+    def start(self, run_id: str, automation_id: str, automation_name: str) -> RunTrace:
+        trace = RunTrace(run_id=run_id, automation_id=automation_id, automation_name=automation_name)
+        with self._lock:
+            self._traces[run_id] = trace
+            while len(self._traces) > self.capacity:
+                self._traces.popitem(last=False)
+        return trace
+
+    def finish(self, trace: RunTrace, status: str):
+        trace.finish(status)
+        if self.persist:
+            # Called on the action executor loop, the write goes to a worker thread
+            asyncio.get_running_loop().run_in_executor(None, self._save, trace)
+
+    def get(self, run_id: str) -> Optional[RunTrace]:
+        with self._lock:
+            trace = self._traces.get(run_id)
+        if trace is None and self.persist:
+            document = AutomationRunTrace.objects(run_id=run_id).first()
+            trace = _from_document(document) if document else None
+        return trace
+
+    def list(self, automation_id: str, limit: int) -> List[RunTrace]:
+        with self._lock:
+            traces = [trace for trace in reversed(self._traces.values()) if trace.automation_id == automation_id]
+        traces = traces[:limit]
+        if self.persist and len(traces) < limit:
+            seen = {trace.run_id for trace in traces}
+            query = AutomationRunTrace.objects(automation_id=automation_id, run_id__nin=list(seen))
+            query = query.order_by("-started_at").limit(limit - len(traces))
+            traces += [_from_document(document) for document in query]
+        return traces
+
+    def _save(self, trace: RunTrace):
+        try:
+            _to_document(trace, retention_days=self.retention_days).save()
+        except Exception as e:
+            logging.error(f"Could not save trace of automation run {trace.run_id}: {e}")
+
+
+trace_store = TraceStore(capacity=settings.AUTOMATION_TRACE_BUFFER_SIZE, persist=settings.AUTOMATION_TRACE_PERSIST,
+                         retention_days=settings.AUTOMATION_TRACE_RETENTION_DAYS)
@@ -0,0 +1,68 @@
+import logging
+import threading
+from collections import defaultdict
+from typing import Dict, List, Set, Tuple
+
+from db.automation import Automation
+from tools.automation_runner.compiled_graph import CompiledAutomation, graph_cache
+
+TriggerKey = Tuple[str, str]
+
+
+class TriggerIndex:
+    """
+    In-memory index of the root nodes of active automations, keyed by (smart_controller_id, action_id).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._roots: Dict[TriggerKey, Dict[str, List[str]]] = defaultdict(dict)
+        self._keys_by_automation: Dict[str, Set[TriggerKey]] = {}
+
+    def build(self):
+        compiled_automations = [graph_cache.get(str(automation.id))
+                                for automation in Automation.objects(is_active=True).only('id')]
+        with self._lock:
+            self._roots.clear()
+            self._keys_by_automation.clear()
+            for compiled in compiled_automations:
+                if compiled is not None:
+                    self._add(compiled)
+        logging.info(f"Trigger index built for {len(self._keys_by_automation)} automations")
+
+    def refresh(self, automation_id: str):
+        compiled = graph_cache.get(automation_id)
+        with self._lock:
+            self._remove(automation_id)
+            if compiled is not None and compiled.is_active:
+                self._add(compiled)
+
+    def remove(self, automation_id: str):
+        with self._lock:
+            self._remove(automation_id)
+
+    def lookup(self, smart_controller_id: str, action_id: str) -> List[Tuple[str, List[str]]]:
+        with self._lock:
+            roots = self._roots.get((smart_controller_id, action_id), {})
+            return [(automation_id, list(node_ids)) for automation_id, node_ids in roots.items()]
+
+    def _add(self, compiled: CompiledAutomation):
+        keys = set()
+        for node in compiled.get_roots():
+            key = (node.smart_controller_id, node.action_id)
+            self._roots[key].setdefault(compiled.id, []).append(node.id)
+            keys.add(key)
+        self._keys_by_automation[compiled.id] = keys
+
+    def _remove(self, automation_id: str):
+        for key in self._keys_by_automation.pop(automation_id, set()):
+            self._roots[key].pop(automation_id, None)
+            if not self._roots[key]:
+                del self._roots[key]
+
+
+trigger_index = TriggerIndex()
+
+
+def build_trigger_index():
+    trigger_index.build()
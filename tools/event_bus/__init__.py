@@ -0,0 +1 @@
+from .event_bus import event_bus, Event, Subscription, ACTIONS, SENSORS, SCHEDULED_TASKS, AUTOMATIONS, TOPICS
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from config.settings import settings
+
+# Top level topics, events are published on "<topic>/<id>/..." sub topics
+ACTIONS = "actions"
+SENSORS = "sensors"
+SCHEDULED_TASKS = "scheduled_tasks"
+AUTOMATIONS = "automations"
+TOPICS = (ACTIONS, SENSORS, SCHEDULED_TASKS, AUTOMATIONS)
+
+
+@dataclass
+class Event:
+    topic: str
+    type: str
+    data: Dict[str, Any] = field(default_factory=dict)
+    timestamp: float = field(default_factory=time.time)
+
+    def to_dict(self) -> dict:
+        return {"topic": self.topic, "type": self.type, "data": self.data, "timestamp": self.timestamp}
+
+
+def _matches(topic: str, subscribed: str) -> bool:
+    return topic == subscribed or topic.startswith(subscribed + "/")
+
+
+class Subscription:
+    """
+    Queue of the events of the subscribed topics, consumed on the event loop that created it.
+    A slow consumer loses its oldest events instead of slowing down publishers.
+    """
+
+    def __init__(self, topics: Iterable[str], max_queued: int):
+        self.topics: Set[str] = set(topics)
+        self.dropped = 0
+        self._loop = asyncio.get_running_loop()
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queued)
+
+    def wants(self, topic: str) -> bool:
+        return any(_matches(topic, subscribed) for subscribed in self.topics)
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[Event]:
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def _put(self, event: Event):
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(event)
+
+    def deliver(self, event: Event):
+        self._loop.call_soon_threadsafe(self._put, event)
+
+
+class EventBus:
+    """
+    In-process publish/subscribe of state changes. Publishing is thread safe and never blocks.
+    State events (device and task state) are retained per sub topic so new subscribers start from the current state,
+    up to <max_retained> topics, the least recently updated are dropped first.
+    """
+
+    def __init__(self, max_queued: int, max_retained: int):
+        self.max_queued = max_queued
+        self.max_retained = max_retained
+        self._lock = threading.Lock()
+        self._subscriptions: List[Subscription] = []
+        self._retained: "OrderedDict[str, Event]" = OrderedDict()
+
+    def publish(self, topic: str, event_type: str, retain: bool = False, only_changes: bool = False,
+                final: bool = False, **data) -> Optional[Event]:
+        """
+        Retained events are replayed to new subscribers, with <only_changes> an event equal to the retained one of
+        its topic is not published again. A <final> event ends its topic (e.g. a finished task), it is delivered
+        and nothing stays retained for the topic.
+        """
+        event = Event(topic=topic, type=event_type, data=data)
+        with self._lock:
+            if final:
+                self._retained.pop(topic, None)
+            elif retain:
+                previous = self._retained.get(topic)
+                if only_changes and previous is not None and previous.type == event_type and previous.data == data:
+                    return None
+                self._retained[topic] = event
+                self._retained.move_to_end(topic)
+                while len(self._retained) > self.max_retained:
+                    self._retained.popitem(last=False)
+            subscriptions = [subscription for subscription in self._subscriptions if subscription.wants(topic)]
+        for subscription in subscriptions:
+            try:
+                subscription.deliver(event)
+            except RuntimeError:
+                # The subscriber's loop is closed, it is removed on unsubscribe
+                pass
+        return event
+
+    def subscribe(self, topics: Iterable[str]) -> Subscription:
+        subscription = Subscription(topics=topics, max_queued=self.max_queued)
+        with self._lock:
+            self._subscriptions.append(subscription)
+        logging.debug(f"Event subscription to {subscription.topics}, {len(self._subscriptions)} subscribers")
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+
+    def update(self, subscription: Subscription, add: Iterable[str] = (), remove: Iterable[str] = ()):
+        with self._lock:
+            subscription.topics = (subscription.topics | set(add)) - set(remove)
+
+    def retained(self, topics: Iterable[str]) -> List[Event]:
+        topics = list(topics)
+        with self._lock:
+            return [event for topic, event in self._retained.items()
+                    if any(_matches(topic, subscribed) for subscribed in topics)]
+
+
+event_bus = EventBus(max_queued=settings.EVENT_QUEUE_SIZE, max_retained=settings.EVENT_MAX_RETAINED)
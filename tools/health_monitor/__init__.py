@@ -0,0 +1 @@
+from .health_monitor import health_monitor, ControllerHealth, startup_event, shutdown_event
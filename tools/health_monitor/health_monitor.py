@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass, field, replace
+from datetime import datetime
+from typing import Deque, Dict, List, Optional
+
+import httpx
+
+from config.settings import settings
+from db.models import SmartController
+from tools.action_executor import executor
+
+
+@dataclass
+class ControllerHealth:
+    controller_id: str
+    name: str
+    address: str
+    is_alive: Optional[bool] = None
+    consecutive_failures: int = 0
+    last_checked: Optional[datetime] = None
+    last_error: Optional[str] = None
+    latencies: Deque[float] = field(default_factory=lambda: deque(maxlen=100))
+
+    def latency_percentile(self, percentile: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(int(len(ordered) * percentile / 100), len(ordered) - 1)]
+
+
+class HealthMonitor:
+    """
+    Probes every smart controller on an interval and caches its liveness and latency.
+    The probing runs on the action executor loop.
+    """
+
+    def __init__(self, interval: float, timeout: float, down_after: int):
+        self.interval = interval
+        self.timeout = timeout
+        self.down_after = down_after
+        self._lock = threading.Lock()
+        self._health: Dict[str, ControllerHealth] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def is_down(self, controller_id: str) -> bool:
+        # Controllers that were never probed are assumed reachable
+        with self._lock:
+            health = self._health.get(controller_id)
+            return health is not None and health.is_alive is False
+
+    def get_all(self) -> List[ControllerHealth]:
+        # Snapshots, the probes keep mutating the live entries
+        with self._lock:
+            return [replace(health, latencies=deque(health.latencies)) for health in self._health.values()]
+
+    def start(self):
+        executor.loop.call_soon_threadsafe(self._start)
+
+    def stop(self):
+        if self._task is not None:
+            executor.loop.call_soon_threadsafe(self._task.cancel)
+
+    def _start(self):
+        if self._task is None or self._task.done():
+            self._task = executor.spawn(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await self.check_all()
+            except Exception as e:
+                logging.exception(f"Controller health check failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def check_all(self):
+        controllers = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: list(SmartController.objects().only('id', 'name', 'address')))
+        known_ids = {str(controller.id) for controller in controllers}
+        with self._lock:
+            for controller_id in self._health.keys() - known_ids:
+                del self._health[controller_id]
+        await asyncio.gather(*[self._check(controller) for controller in controllers])
+
+    async def _check(self, controller: SmartController):
+        controller_id = str(controller.id)
+        with self._lock:
+            health = self._health.get(controller_id)
+            if health is None:
+                health = ControllerHealth(controller_id=controller_id, name=controller.name,
+                                          address=controller.address)
+                self._health[controller_id] = health
+            health.name = controller.name
+            health.address = controller.address
+
+        try:
+            latency = await executor.probe(address=controller.address, timeout=self.timeout)
+        except httpx.PoolTimeout:
+            # Every connection to the controller is busy with real calls, which says nothing about liveness
+            return
+        except Exception as e:
+            with self._lock:
+                health.consecutive_failures += 1
+                health.last_error = str(e) or type(e).__name__
+                health.last_checked = datetime.utcnow()
+                if health.consecutive_failures >= self.down_after:
+                    if health.is_alive is not False:
+                        logging.warning(f"Controller {controller.name} at {controller.address} is down")
+                    health.is_alive = False
+            return
+
+        with self._lock:
+            if health.is_alive is False:
+                logging.info(f"Controller {controller.name} at {controller.address} is back up")
+            health.is_alive = True
+            health.consecutive_failures = 0
+            health.last_error = None
+            health.last_checked = datetime.utcnow()
+            health.latencies.append(latency)
+
+
+health_monitor = HealthMonitor(interval=settings.HEALTH_CHECK_INTERVAL,
+                               timeout=settings.HEALTH_CHECK_TIMEOUT,
+                               down_after=settings.HEALTH_CHECK_DOWN_AFTER)
+
+
+def startup_event():
+    health_monitor.start()
+
+
+def shutdown_event():
+    health_monitor.stop()
@@ -0,0 +1,3 @@
+from .metrics import registry, Counter, Histogram
+from .instrumentation import MetricsMiddleware, MongoCommandMetrics, endpoint_label, without_request
+from .profiler import ProfilerMiddleware, RequestProfile
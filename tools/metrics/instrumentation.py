@@ -0,0 +1,80 @@
+import contextvars
+import time
+from typing import Awaitable, Optional
+
+from pymongo import monitoring
+
+from tools.metrics.metrics import http_request_seconds, mongo_command_failures, mongo_command_seconds
+from tools.metrics.profiler import _profile, record_db_command
+
+# ASGI scope of the API request being handled, None for background work (scheduler, automations, health checks)
+_request_scope: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("request_scope", default=None)
+
+
+def endpoint_label() -> str:
+    scope = _request_scope.get()
+    if scope is None:
+        return "background"
+    # FastAPI puts the matched route in the scope once routing is done
+    route = scope.get("route")
+    return getattr(route, "path", "unmatched")
+
+
+async def without_request(coroutine: Awaitable):
+    """
+    Awaits <coroutine> as background work, for tasks spawned by a request that outlive it. Must be the coroutine of
+    its own task, tasks run in a copy of the context so the request's context is left untouched.
+    """
+    _request_scope.set(None)
+    _profile.set(None)
+    return await coroutine
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware timing every API request and tagging the work it does with its route.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        token = _request_scope.set(scope)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_request_seconds.observe(time.perf_counter() - started, method=scope["method"],
+                                         endpoint=endpoint_label(), status=status["code"])
+            _request_scope.reset(token)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """
+    Runs on the thread issuing the command, so the request context of the calling endpoint is visible.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        seconds = event.duration_micros / 1_000_000
+        mongo_command_seconds.observe(seconds, endpoint=endpoint_label(), command=event.command_name)
+        record_db_command(seconds)
+
+    def failed(self, event):
+        seconds = event.duration_micros / 1_000_000
+        mongo_command_seconds.observe(seconds, endpoint=endpoint_label(), command=event.command_name)
+        mongo_command_failures.inc(endpoint=endpoint_label(), command=event.command_name)
+        record_db_command(seconds)
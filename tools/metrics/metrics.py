@@ -0,0 +1,190 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Sequence, Tuple
+
+# Seconds, from a cached sensor read up to a slow device or a long automation loop
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels: Dict[str, object]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in values]
+
+
+class Histogram(_Metric):
+    """
+    Cumulative histogram with fixed buckets. Observing is a bisect and three additions under a lock.
+    """
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # Per label values: counts per bucket (non cumulative, the last one is +Inf), sum
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._label_values(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][index] += 1
+            entry[1][0] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = [(key, list(counts), total[0]) for key, (counts, total) in self._values.items()]
+        samples = []
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                labels = _format_labels(self.label_names, key, f'le="{le}"')
+                samples.append(f"{self.name}_bucket{labels} {cumulative}")
+            samples.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(total)}")
+            samples.append(f"{self.name}_count{_format_labels(self.label_names, key)} {cumulative}")
+        return samples
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, label_names))
+
+    def histogram(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, label_names, buckets))
+
+    def _register(self, metric: _Metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """
+        Prometheus text exposition format.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+device_request_seconds = registry.histogram(
+    "device_request_seconds", "Latency of HTTP requests to smart controllers",
+    ["controller", "action", "status"])
+mongo_command_seconds = registry.histogram(
+    "mongo_command_seconds", "Latency of MongoDB commands by the API endpoint that issued them",
+    ["endpoint", "command"])
+mongo_command_failures = registry.counter(
+    "mongo_command_failures_total", "Failed MongoDB commands",
+    ["endpoint", "command"])
+http_request_seconds = registry.histogram(
+    "http_request_seconds", "Latency of API requests",
+    ["method", "endpoint", "status"])
+sensor_reads = registry.counter(
+    "sensor_reads_total", "Sensor reads by whether they reached the device",
+    ["cache"])
+automation_step_seconds = registry.histogram(
+    "automation_step_seconds", "Duration of automation steps, waiting for a free branch slot included",
+    ["automation", "kind"])
+automation_run_seconds = registry.histogram(
+    "automation_run_seconds", "Duration of automation runs",
+    ["automation", "outcome"])
+scheduler_job_lag_seconds = registry.histogram(
+    "scheduler_job_lag_seconds", "Delay between the scheduled and the actual fire time of scheduler jobs",
+    ["kind"])
+scheduler_job_queue_seconds = registry.histogram(
+    "scheduler_job_queue_seconds", "Delay between the scheduled run time and the start of scheduler jobs",
+    ["executor", "kind"])
+scheduler_controller_wait_seconds = registry.histogram(
+    "scheduler_controller_wait_seconds", "Time scheduler jobs waited for a free slot on their controller",
+    ["kind"])
+scheduler_jobs = registry.counter(
+    "scheduler_jobs_total", "Finished scheduler jobs",
+    ["kind", "outcome"])
+query_budget_exceeded = registry.counter(
+    "query_budget_exceeded_total", "Requests that issued more MongoDB commands than PROFILER_QUERY_BUDGET",
+    ["endpoint"])
+scheduled_task_runs = registry.counter(
+    "scheduled_task_runs_total", "Outcomes of scheduled task attempts, retries included",
+    ["outcome"])
+write_buffer_batch_size = registry.histogram(
+    "write_buffer_batch_size", "Documents written per write buffer flush",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000))
+write_buffer_flush_seconds = registry.histogram(
+    "write_buffer_flush_seconds", "Duration of write buffer flushes")
+write_buffer_requeued = registry.counter(
+    "write_buffer_requeued_total", "Buffered document updates kept for the next flush after a failed write")
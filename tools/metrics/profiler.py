@@ -0,0 +1,93 @@
+import contextvars
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from tools.metrics.metrics import query_budget_exceeded
+
+_profile: contextvars.ContextVar[Optional["RequestProfile"]] = contextvars.ContextVar("request_profile", default=None)
+
+
+@dataclass
+class RequestProfile:
+    """
+    Database and device work done on behalf of one API request. Updated from the database thread pool and the
+    action executor loop, both inherit the request's context.
+    """
+    db_commands: int = 0
+    db_seconds: float = 0.0
+    device_calls: int = 0
+    device_seconds: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add_db_command(self, seconds: float):
+        with self._lock:
+            self.db_commands += 1
+            self.db_seconds += seconds
+
+    def add_device_call(self, seconds: float):
+        with self._lock:
+            self.device_calls += 1
+            self.device_seconds += seconds
+
+    def server_timing(self, total_seconds: float) -> str:
+        return (f'db;desc="{self.db_commands} queries";dur={self.db_seconds * 1000:.1f}, '
+                f'device;desc="{self.device_calls} calls";dur={self.device_seconds * 1000:.1f}, '
+                f'total;dur={total_seconds * 1000:.1f}')
+
+
+def record_db_command(seconds: float):
+    profile = _profile.get()
+    if profile is not None:
+        profile.add_db_command(seconds)
+
+
+def record_device_call(seconds: float):
+    profile = _profile.get()
+    if profile is not None:
+        profile.add_device_call(seconds)
+
+
+class ProfilerMiddleware:
+    """
+    Opt-in, see PROFILER_ENABLED. Adds a Server-Timing header with the number and duration of the MongoDB commands
+    and device calls of each request, and warns about requests over <query_budget> commands.
+    """
+
+    def __init__(self, app, query_budget: int):
+        self.app = app
+        self.query_budget = query_budget
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile()
+        started = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                timing = profile.server_timing(total_seconds=time.perf_counter() - started)
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", timing.encode())]
+            await send(message)
+
+        token = _profile.set(profile)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _profile.reset(token)
+            self._report(scope, profile, elapsed=time.perf_counter() - started)
+
+    def _report(self, scope, profile: RequestProfile, elapsed: float):
+        endpoint = getattr(scope.get("route"), "path", scope["path"])
+        summary = (f"{scope['method']} {endpoint}: {profile.db_commands} queries ({profile.db_seconds * 1000:.1f}ms), "
+                   f"{profile.device_calls} device calls ({profile.device_seconds * 1000:.1f}ms), "
+                   f"{elapsed * 1000:.1f}ms total")
+        if profile.db_commands > self.query_budget:
+            query_budget_exceeded.inc(endpoint=endpoint)
+            logging.warning(f"Query budget of {self.query_budget} exceeded by {summary}")
+        else:
+            logging.debug(summary)
@@ -0,0 +1,2 @@
+from .circuit_breaker import CircuitBreaker, CircuitOpenError, ControllerUnavailableError, circuit_breakers
+from .retry_policy import RetryPolicy
@@ -0,0 +1,111 @@
+import logging
+import threading
+import time
+from enum import Enum
+from typing import Dict
+
+from config.settings import settings
+
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class ControllerUnavailableError(Exception):
+    pass
+
+
+class CircuitOpenError(ControllerUnavailableError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Opens after <failure_threshold> consecutive failures and rejects calls for <reset_timeout> seconds. After that
+    a single probe call is let through (half open): success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = CircuitState.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> CircuitState:
+        with self._lock:
+            if self._state == CircuitState.OPEN and self.retry_after() == 0:
+                return CircuitState.HALF_OPEN
+            return self._state
+
+    def retry_after(self) -> float:
+        """
+        Seconds until an open circuit lets a probe through, 0 if calls are allowed now.
+        """
+        if self._state != CircuitState.OPEN:
+            return 0.0
+        return max(self._opened_at + self.reset_timeout - time.monotonic(), 0.0)
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == CircuitState.CLOSED:
+                return True
+            if self._state == CircuitState.OPEN:
+                if self.retry_after() > 0:
+                    return False
+                self._state = CircuitState.HALF_OPEN
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def release(self):
+        # The call ended without a verdict (e.g. cancelled), let another probe through
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CircuitState.CLOSED:
+                logging.info(f"Circuit of {self.name} closed")
+            self._state = CircuitState.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == CircuitState.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != CircuitState.OPEN:
+                    logging.warning(f"Circuit of {self.name} opened after {self._failures} failures")
+                self._state = CircuitState.OPEN
+                self._opened_at = time.monotonic()
+
+
+class CircuitBreakerRegistry:
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, name: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(name=name, failure_threshold=self.failure_threshold,
+                                         reset_timeout=self.reset_timeout)
+                self._breakers[name] = breaker
+            return breaker
+
+
+# One breaker per smart controller id
+circuit_breakers = CircuitBreakerRegistry(failure_threshold=settings.CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+                                          reset_timeout=settings.CIRCUIT_BREAKER_RESET_TIMEOUT)
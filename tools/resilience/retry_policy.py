@@ -0,0 +1,34 @@
+import random
+from dataclasses import dataclass
+
+from config.settings import settings
+from db.scheduled_task import ScheduledTask
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_retries: int = settings.RETRY_MAX_RETRIES
+    base_delay: float = settings.RETRY_BASE_DELAY
+    max_delay: float = settings.RETRY_MAX_DELAY
+    multiplier: float = 2.0
+    # Fraction of each delay that is randomized, so tasks failing together do not retry in lockstep
+    jitter: float = 0.5
+
+    def delay(self, attempt: int) -> float:
+        """
+        Seconds to wait before retry number <attempt> (0 based).
+        """
+        delay = min(self.max_delay, self.base_delay * self.multiplier ** attempt)
+        return delay * (1 - self.jitter) + random.uniform(0, delay * self.jitter)
+
+    def exhausted(self, attempts: int) -> bool:
+        return attempts >= self.max_retries
+
+    @classmethod
+    def for_task(cls, task: ScheduledTask) -> "RetryPolicy":
+        overrides = {}
+        if task.max_retries is not None:
+            overrides["max_retries"] = task.max_retries
+        if task.retry_base_delay is not None:
+            overrides["base_delay"] = task.retry_base_delay
+        return cls(**overrides)
@@ -0,0 +1,122 @@
+import asyncio
+import concurrent.futures
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Callable, Dict, List
+
+import pytz
+from apscheduler.executors.base import BaseExecutor, run_job
+from apscheduler.executors.base_py3 import run_coroutine_job
+from apscheduler.executors.pool import BasePoolExecutor
+from apscheduler.job import Job
+from apscheduler.util import iscoroutinefunction_partial
+
+from tools.action_executor import executor
+from tools.metrics.metrics import scheduler_controller_wait_seconds, scheduler_job_queue_seconds
+
+
+class _QueueDelayMixin:
+    """
+    Records how late a job starts compared to its scheduled run time. Measured when the job actually starts, so the
+    time spent waiting for a free worker is included, unlike the lag recorded on submission.
+    """
+
+    def __init__(self, job_kind: Callable[[str], str], *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._job_kind = job_kind
+        self._alias = None
+
+    def start(self, scheduler, alias):
+        super().start(scheduler, alias)
+        self._alias = alias
+
+    def _record_queue_delay(self, job: Job, run_times: List[datetime]):
+        delay = (datetime.now(pytz.UTC) - run_times[-1]).total_seconds()
+        scheduler_job_queue_seconds.observe(max(delay, 0.0), executor=self._alias, kind=self._job_kind(job.id))
+
+    def _run_done(self, job: Job, future):
+        try:
+            events = future.result()
+        except BaseException:
+            self._run_job_error(job.id, *sys.exc_info()[1:])
+        else:
+            self._run_job_success(job.id, events)
+
+
+class TimedThreadPoolExecutor(_QueueDelayMixin, BasePoolExecutor):
+    """
+    Thread pool of <max_workers> threads. Coroutine jobs run on the action executor loop while their worker blocks,
+    which bounds the ones running at once.
+    """
+
+    def __init__(self, job_kind: Callable[[str], str], max_workers: int, thread_name_prefix: str = "scheduler"):
+        super().__init__(job_kind, ThreadPoolExecutor(max_workers, thread_name_prefix=thread_name_prefix))
+
+    def _do_submit_job(self, job, run_times):
+        def run():
+            self._record_queue_delay(job, run_times)
+            if iscoroutinefunction_partial(job.func):
+                return executor.run_sync(run_coroutine_job(job, job._jobstore_alias, run_times, self._logger.name))
+            return run_job(job, job._jobstore_alias, run_times, self._logger.name)
+
+        self._pool.submit(run).add_done_callback(lambda future: self._run_done(job, future))
+
+
+class ActionLoopExecutor(_QueueDelayMixin, BaseExecutor):
+    """
+    Runs coroutine jobs on the action executor loop. Jobs waiting on devices do not hold a thread, so a burst of jobs
+    firing together all start on time however slow the controllers are.
+    """
+
+    def __init__(self, job_kind: Callable[[str], str]):
+        super().__init__(job_kind)
+        self._pending = set()
+
+    def shutdown(self, wait=True):
+        if wait:
+            concurrent.futures.wait(list(self._pending))
+        else:
+            for future in list(self._pending):
+                future.cancel()
+        self._pending.clear()
+
+    def _do_submit_job(self, job, run_times):
+        async def run():
+            self._record_queue_delay(job, run_times)
+            return await run_coroutine_job(job, job._jobstore_alias, run_times, self._logger.name)
+
+        def done(future):
+            self._pending.discard(future)
+            self._run_done(job, future)
+
+        future = executor.submit(run())
+        self._pending.add(future)
+        future.add_done_callback(done)
+
+
+class ControllerLimiter:
+    """
+    Caps the scheduler jobs running against one controller, the jobs over the limit wait without holding a thread.
+    Kept below ACTION_MAX_IN_FLIGHT_PER_CONTROLLER it leaves room for API calls while a burst of jobs drains.
+    Must be used from the action executor loop, a limit of 0 disables it.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    @asynccontextmanager
+    async def slot(self, controller_id: str, kind: str):
+        if self.limit <= 0:
+            yield
+            return
+        semaphore = self._semaphores.get(controller_id)
+        if semaphore is None:
+            semaphore = self._semaphores[controller_id] = asyncio.Semaphore(self.limit)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        async with semaphore:
+            scheduler_controller_wait_seconds.observe(loop.time() - started, kind=kind)
+            yield
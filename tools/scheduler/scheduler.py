@@ -1,21 +1,111 @@
+import functools
 import logging
 from datetime import datetime, timedelta
+from typing import Dict, List
 
 import pytz
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED, EVENT_JOB_MISSED, EVENT_JOB_SUBMITTED, \
+    JobEvent, JobExecutionEvent, JobSubmissionEvent
 from apscheduler.job import Job
+from apscheduler.jobstores.mongodb import MongoDBJobStore
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.base import BaseTrigger
 from apscheduler.triggers.cron import CronTrigger
+from mongoengine.connection import get_connection
+from pymongo import UpdateOne
 from pytz import utc
 
-from db.models import Task, TaskType
+from config.settings import settings
+from db import repository
+from db.document_cache import action_cache, smart_controller_cache
+from db.models import Action, SmartController, Task, TaskType
 
-import tools.action_runner as action_runner
 from db.scheduled_task import ScheduledTask
-from tools.action_runner.action_runner import scheduled_run, run
+from db.write_buffer import write_buffer
+from tools.health_monitor import health_monitor
+from tools.action_runner.action_runner import SCHEDULED_TASK_EXECUTOR, SCHEDULED_TASK_JOB_PREFIX, run_async, \
+    scheduled_run_async
+from tools.metrics.metrics import scheduler_job_lag_seconds, scheduler_jobs
+from tools.scheduler.executors import ActionLoopExecutor, ControllerLimiter, TimedThreadPoolExecutor
 
-scheduler = BackgroundScheduler(timezone=utc)
 THRESHOLD_SECONDS = 10
 
+TASK_JOB_PREFIX = "task:"
+# Executor of the jobs calling devices, the default one is left to plain jobs
+DEVICE_EXECUTOR = SCHEDULED_TASK_EXECUTOR
+
+
+def _job_kind(job_id: str) -> str:
+    if job_id.startswith(TASK_JOB_PREFIX):
+        return "task"
+    if job_id.startswith(SCHEDULED_TASK_JOB_PREFIX):
+        return "scheduled_task"
+    return "other"
+
+
+def _build_executors() -> dict:
+    if settings.SCHEDULER_DEVICE_EXECUTOR == "threads":
+        devices = TimedThreadPoolExecutor(_job_kind, max_workers=settings.SCHEDULER_DEVICE_POOL_SIZE,
+                                          thread_name_prefix="scheduler-devices")
+    else:
+        devices = ActionLoopExecutor(_job_kind)
+    return {
+        "default": TimedThreadPoolExecutor(_job_kind, max_workers=settings.SCHEDULER_THREAD_POOL_SIZE),
+        DEVICE_EXECUTOR: devices,
+    }
+
+
+scheduler = BackgroundScheduler(timezone=utc, executors=_build_executors(),
+                                job_defaults={"misfire_grace_time": settings.SCHEDULER_MISFIRE_GRACE_TIME,
+                                              "coalesce": settings.SCHEDULER_COALESCE})
+controller_limiter = ControllerLimiter(limit=settings.SCHEDULER_MAX_JOBS_PER_CONTROLLER)
+
+
+def task_job_id(task: Task) -> str:
+    return f"{TASK_JOB_PREFIX}{task.id}"
+
+
+def scheduled_task_job_id(task: ScheduledTask) -> str:
+    return f"{SCHEDULED_TASK_JOB_PREFIX}{task.id}"
+
+
+async def _run_limited(controller: SmartController, action: Action, kind: str):
+    async with controller_limiter.slot(str(controller.id), kind=kind):
+        return await run_async(controller, action)
+
+
+async def run_task(task_id: str):
+    task = await repository.tasks.get(task_id, dereference=True)
+    if task is None:
+        logging.warning(f"Task: '{task_id}' no longer exists, skipping run")
+        return
+    if health_monitor.is_down(str(task.smart_controller.id)):
+        logging.info(f"Skipping task: '{task_id}', controller {task.smart_controller.name} is down")
+        return
+    return await _run_limited(task.smart_controller, task.action, kind="task")
+
+
+async def run_scheduled_task(task_id: str):
+    task = await repository.scheduled_tasks.get(task_id, dereference=True)
+    if task is None or not task.is_active:
+        logging.warning(f"Scheduled task: '{task_id}' no longer active, skipping run")
+        return
+    return await scheduled_run_async(functools.partial(_run_limited, kind="scheduled_task"), task, scheduler)
+
+
+def _record_job_event(event: JobEvent):
+    kind = _job_kind(event.job_id)
+    if isinstance(event, JobSubmissionEvent):
+        now = datetime.now(pytz.UTC)
+        for run_time in event.scheduled_run_times:
+            scheduler_job_lag_seconds.observe(max((now - run_time).total_seconds(), 0.0), kind=kind)
+    elif isinstance(event, JobExecutionEvent):
+        outcome = {EVENT_JOB_EXECUTED: "executed", EVENT_JOB_ERROR: "error", EVENT_JOB_MISSED: "missed"}[event.code]
+        scheduler_jobs.inc(kind=kind, outcome=outcome)
+
+
+scheduler.add_listener(_record_job_event, EVENT_JOB_SUBMITTED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED)
+
 
 def build_cron_expression(task: Task) -> CronTrigger:
     if task.type == TaskType.DAILY:
@@ -40,15 +130,98 @@ def build_cron_expression(task: Task) -> CronTrigger:
     return cron
 
 
+def configure_job_store():
+    if settings.SCHEDULER_JOB_STORE == "mongo":
+        job_store = MongoDBJobStore(database=settings.MONGO_DATABASE, collection="scheduler_jobs",
+                                    client=get_connection())
+        scheduler.add_jobstore(job_store, alias="default")
+        logging.info("Scheduler using the mongo job store")
+
+
+def _job_names(tasks) -> Dict[str, str]:
+    # Resolves every controller and action with one query per collection instead of one per task
+    controllers = smart_controller_cache.get_many({str(task.smart_controller.id) for task in tasks})
+    actions = action_cache.get_many({str(task.action.id) for task in tasks})
+    names = {}
+    for task in tasks:
+        controller = controllers.get(str(task.smart_controller.id))
+        action = actions.get(str(task.action.id))
+        names[str(task.id)] = f"{controller.name if controller else '?'}->{action.name if action else '?'}"
+    return names
+
+
+def _trigger_changed(job: Job, trigger: BaseTrigger) -> bool:
+    return str(job.trigger) != str(trigger)
+
+
+def _job_options(job: Job, **desired) -> dict:
+    # Options of a job restored from a persistent job store that differ from the current configuration
+    return {name: value for name, value in desired.items() if getattr(job, name) != value}
+
+
 def schedule_tasks():
-    tasks_to_schedule = Task.objects().all()
-    for task in tasks_to_schedule:
-        schedule_long_term_tasks(task=task)
+    """
+    Reconciles the jobs in the job store with the Task and ScheduledTask collections, touching only the
+    jobs and documents that differ.
+    """
+    existing_jobs = {job.id: job for job in scheduler.get_jobs(jobstore="default")}
+    desired_job_ids = set()
+    added = modified = 0
 
-    scheduled_tasks = ScheduledTask.objects(is_active=True)
+    tasks: List[Task] = list(Task.objects().no_dereference())
+    names = _job_names(tasks)
+    task_updates = []
+    for task in tasks:
+        job_id = task_job_id(task)
+        desired_job_ids.add(job_id)
+        trigger = build_cron_expression(task)
+        job = existing_jobs.get(job_id)
+        if job is None:
+            scheduler.add_job(run_task, trigger=trigger, args=[str(task.id)], id=job_id, name=names[str(task.id)],
+                              executor=DEVICE_EXECUTOR)
+            added += 1
+        else:
+            options = _job_options(job, executor=DEVICE_EXECUTOR,
+                                   misfire_grace_time=settings.SCHEDULER_MISFIRE_GRACE_TIME,
+                                   coalesce=settings.SCHEDULER_COALESCE)
+            trigger_changed = _trigger_changed(job, trigger)
+            if options:
+                job.modify(**options)
+            if trigger_changed:
+                job.reschedule(trigger=trigger)
+            modified += bool(options or trigger_changed)
+        if task.job_id != job_id:
+            task_updates.append(UpdateOne({"_id": task.id}, {"$set": {"job_id": job_id}}))
+
+    scheduled_tasks: List[ScheduledTask] = list(ScheduledTask.objects(is_active=True).no_dereference())
+    names = _job_names(scheduled_tasks)
+    scheduled_task_updates = []
     for task in scheduled_tasks:
-        run_at = calculate_running_time(task=task)
-        schedule_short_term_tasks(task=task, run_at=run_at)
+        job_id = scheduled_task_job_id(task)
+        desired_job_ids.add(job_id)
+        job = existing_jobs.get(job_id)
+        if job is None:
+            _add_scheduled_task_job(task=task, run_at=calculate_running_time(task=task), name=names[str(task.id)])
+            added += 1
+        elif job.executor != DEVICE_EXECUTOR:
+            job.modify(executor=DEVICE_EXECUTOR)
+            modified += 1
+        if task.job_id != job_id:
+            scheduled_task_updates.append(UpdateOne({"_id": task.id}, {"$set": {"job_id": job_id}}))
+
+    removed = 0
+    for job_id in existing_jobs.keys() - desired_job_ids:
+        if job_id.startswith((TASK_JOB_PREFIX, SCHEDULED_TASK_JOB_PREFIX)):
+            scheduler.remove_job(job_id=job_id, jobstore="default")
+            removed += 1
+
+    if task_updates:
+        Task._get_collection().bulk_write(task_updates, ordered=False)
+    if scheduled_task_updates:
+        ScheduledTask._get_collection().bulk_write(scheduled_task_updates, ordered=False)
+
+    logging.info(f"Scheduler reconciled: {added} added, {modified} modified, {removed} removed, "
+                 f"{len(task_updates) + len(scheduled_task_updates)} job ids updated")
 
 
 def shutdown_event():
@@ -58,10 +231,19 @@ def shutdown_event():
 
 def startup_event():
     logging.info("Scheduler starting..")
+    configure_job_store()
+    scheduler.start()
     # Schedule tasks on application startup
     schedule_tasks()
 
 
+def _add_scheduled_task_job(task: ScheduledTask, run_at: datetime, name: str) -> Job:
+    # Overdue one-off jobs restored from a persistent job store must still run
+    return scheduler.add_job(run_scheduled_task, 'date', run_date=run_at, args=[str(task.id)],
+                             id=scheduled_task_job_id(task), name=name, replace_existing=True,
+                             misfire_grace_time=None, executor=DEVICE_EXECUTOR)
+
+
 def schedule_short_term_tasks(task: ScheduledTask, run_at=None):
     logging.info(
         f"setting scheduler in {task.minutes_to_run} minute/s for task action id: '{task.action.id}' "
@@ -69,23 +251,26 @@ def schedule_short_term_tasks(task: ScheduledTask, run_at=None):
     )
     run_time = datetime.now(pytz.UTC) + timedelta(minutes=task.minutes_to_run) if run_at is None else run_at
 
-    job: Job = scheduler.add_job(scheduled_run, 'date', run_date=run_time, args=[run, task, scheduler],
-                                 name=f"{task.smart_controller.name}->{task.action.name}")
-    task.job_id = job.id
-    task.save()
+    job: Job = _add_scheduled_task_job(task=task, run_at=run_time,
+                                       name=f"{task.smart_controller.name}->{task.action.name}")
+    if task.job_id != job.id:
+        write_buffer.set(task, job_id=job.id)
 
 
 def schedule_long_term_tasks(task: Task):
     cron_trigger = build_cron_expression(task)
 
     job: Job = scheduler.add_job(
-        action_runner.run,
+        run_task,
         trigger=cron_trigger,
-        args=[task.smart_controller, task.action],
-        name=f"{task.smart_controller.name}->{task.action.name}"
+        args=[str(task.id)],
+        id=task_job_id(task),
+        name=f"{task.smart_controller.name}->{task.action.name}",
+        replace_existing=True,
+        executor=DEVICE_EXECUTOR
     )
-    task.job_id = job.id
-    task.save()
+    if task.job_id != job.id:
+        write_buffer.set(task, job_id=job.id)
     logging.info(f"Scheduled task: '{task.id}' with cron expression {cron_trigger}")
 
 
@@ -94,4 +279,4 @@ def calculate_running_time(task: ScheduledTask):
     now = datetime.utcnow()
     time_difference = now - original_run_time
     return original_run_time if time_difference.total_seconds() <= THRESHOLD_SECONDS else (
-            now + timedelta(seconds=10))
\ No newline at end of file
+            now + timedelta(seconds=10))
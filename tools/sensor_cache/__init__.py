@@ -0,0 +1 @@
+from .sensor_cache import sensor_cache, SensorReading
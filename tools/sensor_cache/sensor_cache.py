@@ -0,0 +1,102 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from config.settings import settings
+
+SensorKey = Tuple[str, str]
+
+
+@dataclass(frozen=True)
+class SensorReading:
+    text: str
+    read_at: float
+    # False only for the caller whose request actually reached the device
+    cached: bool
+    # Sent by the controller itself rather than read from it
+    pushed: bool = False
+
+    @property
+    def age(self) -> float:
+        return max(time.monotonic() - self.read_at, 0.0)
+
+    @property
+    def value(self) -> float:
+        return float(self.text)
+
+
+class SensorCache:
+    """
+    Per (smart_controller_id, action_id) cache of raw sensor responses. Must be used from the action executor loop.
+    Concurrent reads of a stale key share a single in-flight device request.
+    Values pushed by controllers stay fresh for <push_freshness>, so controllers that push are not polled.
+    """
+
+    def __init__(self, freshness: float, push_freshness: float):
+        self.freshness = freshness
+        self.push_freshness = push_freshness
+        self._readings: Dict[SensorKey, SensorReading] = {}
+        self._in_flight: Dict[SensorKey, asyncio.Future] = {}
+        self._waiters: Dict[SensorKey, List[asyncio.Future]] = {}
+
+    async def read(self, key: SensorKey, fetch: Callable[[], Awaitable[str]]) -> SensorReading:
+        reading = self._readings.get(key)
+        if reading is not None and reading.age <= (self.push_freshness if reading.pushed else self.freshness):
+            return reading
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            text, read_at = await asyncio.shield(in_flight)
+            return SensorReading(text=text, read_at=read_at, cached=True)
+
+        in_flight = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = in_flight
+        try:
+            text = await fetch()
+        except asyncio.CancelledError:
+            in_flight.cancel()
+            raise
+        except Exception as e:
+            in_flight.set_exception(e)
+            # Waiters re-raise it, mark it retrieved so the loop does not log it again
+            in_flight.exception()
+            raise
+        else:
+            reading = self.store(key=key, text=text)
+            in_flight.set_result((reading.text, reading.read_at))
+            return SensorReading(text=reading.text, read_at=reading.read_at, cached=False)
+        finally:
+            del self._in_flight[key]
+
+    def store(self, key: SensorKey, text: str, pushed: bool = False) -> SensorReading:
+        reading = SensorReading(text=text, read_at=time.monotonic(), cached=True, pushed=pushed)
+        self._readings[key] = reading
+        for waiter in self._waiters.pop(key, []):
+            if not waiter.done():
+                waiter.set_result(reading)
+        return reading
+
+    async def wait_for_update(self, key: SensorKey, timeout: float) -> Optional[SensorReading]:
+        """
+        Next reading stored for <key>, pushed or read by anyone, or None when none arrives within <timeout>.
+        """
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(key, []).append(waiter)
+        try:
+            return await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            waiters = self._waiters.get(key)
+            if waiters and waiter in waiters:
+                waiters.remove(waiter)
+                if not waiters:
+                    del self._waiters[key]
+
+    def invalidate(self, key: SensorKey):
+        self._readings.pop(key, None)
+
+
+sensor_cache = SensorCache(freshness=settings.SENSOR_CACHE_FRESHNESS,
+                           push_freshness=settings.SENSOR_PUSH_FRESHNESS)
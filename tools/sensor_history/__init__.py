@@ -0,0 +1 @@
+from .sensor_history import record_reading, record_reading_safe, get_history, pick_resolution
@@ -0,0 +1,128 @@
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from pymongo import UpdateOne
+
+from config.settings import settings
+from db.sensor_history import Resolution, SensorRollup, SensorSegment
+from tools.automation_runner.utils import _string_to_bool
+
+BUCKET_SIZES = {
+    Resolution.RAW: timedelta(hours=1),
+    Resolution.MINUTE: timedelta(minutes=1),
+    Resolution.HOUR: timedelta(hours=1),
+    Resolution.DAY: timedelta(days=1),
+}
+
+# Days to keep each resolution, 0 keeps it forever
+RETENTION_DAYS = {
+    Resolution.RAW: settings.SENSOR_HISTORY_RAW_RETENTION_DAYS,
+    Resolution.MINUTE: settings.SENSOR_HISTORY_MINUTE_RETENTION_DAYS,
+    Resolution.HOUR: settings.SENSOR_HISTORY_HOUR_RETENTION_DAYS,
+    Resolution.DAY: settings.SENSOR_HISTORY_DAY_RETENTION_DAYS,
+}
+
+ROLLUP_RESOLUTIONS = [Resolution.MINUTE, Resolution.HOUR, Resolution.DAY]
+
+
+@dataclass(frozen=True)
+class HistoryPoint:
+    time: datetime
+    min: float
+    max: float
+    avg: float
+    count: int
+
+
+def _bucket_start(timestamp: datetime, resolution: Resolution) -> datetime:
+    if resolution == Resolution.MINUTE:
+        return timestamp.replace(second=0, microsecond=0)
+    if resolution == Resolution.DAY:
+        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def _expires_at(bucket_start: datetime, resolution: Resolution) -> Optional[datetime]:
+    if not RETENTION_DAYS[resolution]:
+        return None
+    return bucket_start + BUCKET_SIZES[resolution] + timedelta(days=RETENTION_DAYS[resolution])
+
+
+def _to_number(text: str) -> Optional[float]:
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    try:
+        return float(_string_to_bool(string=text))
+    except ValueError:
+        return None
+
+
+def record_reading(smart_controller_id: str, action_id: str, text: str, timestamp: Optional[datetime] = None):
+    value = _to_number(text.strip())
+    if value is None:
+        return
+    timestamp = timestamp or datetime.utcnow()
+
+    segment_start = _bucket_start(timestamp, Resolution.RAW)
+    # Raw upserts bypass mongoengine, _cls must be set for the querysets of the inherited models to match
+    SensorSegment._get_collection().update_one(
+        {'smart_controller_id': smart_controller_id, 'action_id': action_id, 'bucket_start': segment_start},
+        {'$push': {'timestamps': timestamp, 'values': value},
+         '$setOnInsert': {'_cls': SensorSegment._class_name, 'inserted_at': timestamp,
+                          'expires_at': _expires_at(segment_start, Resolution.RAW)}},
+        upsert=True
+    )
+
+    rollups = []
+    for resolution in ROLLUP_RESOLUTIONS:
+        bucket_start = _bucket_start(timestamp, resolution)
+        rollups.append(UpdateOne(
+            {'smart_controller_id': smart_controller_id, 'action_id': action_id, 'resolution': resolution.value,
+             'bucket_start': bucket_start},
+            {'$inc': {'count': 1, 'total': value},
+             '$min': {'min': value},
+             '$max': {'max': value},
+             '$setOnInsert': {'_cls': SensorRollup._class_name, 'inserted_at': timestamp,
+                              'expires_at': _expires_at(bucket_start, resolution)}},
+            upsert=True
+        ))
+    SensorRollup._get_collection().bulk_write(rollups, ordered=False)
+
+
+def record_reading_safe(smart_controller_id: str, action_id: str, text: str):
+    try:
+        record_reading(smart_controller_id=smart_controller_id, action_id=action_id, text=text)
+    except Exception as e:
+        logging.error(f"Failed to record reading of action: {action_id} of controller: {smart_controller_id}: {e}")
+
+
+def pick_resolution(start: datetime, end: datetime) -> Resolution:
+    span = end - start
+    if span <= timedelta(hours=2):
+        return Resolution.MINUTE
+    if span <= timedelta(days=7):
+        return Resolution.HOUR
+    return Resolution.DAY
+
+
+def get_history(smart_controller_id: str, action_id: str, start: datetime, end: datetime,
+                resolution: Resolution) -> List[HistoryPoint]:
+    if resolution == Resolution.RAW:
+        segments = SensorSegment.objects(smart_controller_id=smart_controller_id, action_id=action_id,
+                                         bucket_start__gte=_bucket_start(start, Resolution.RAW),
+                                         bucket_start__lt=end).order_by('bucket_start')
+        return [HistoryPoint(time=timestamp, min=value, max=value, avg=value, count=1)
+                for segment in segments
+                for timestamp, value in zip(segment.timestamps, segment.values)
+                if start <= timestamp < end]
+
+    rollups = SensorRollup.objects(smart_controller_id=smart_controller_id, action_id=action_id,
+                                   resolution=resolution, bucket_start__gte=_bucket_start(start, resolution),
+                                   bucket_start__lt=end).order_by('bucket_start')
+    return [HistoryPoint(time=rollup.bucket_start, min=rollup.min, max=rollup.max, avg=rollup.avg, count=rollup.count)
+            for rollup in rollups]
+